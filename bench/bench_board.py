@@ -0,0 +1,90 @@
+""" Compare parse time and memory per board of the array-backed Board against
+the original implementation, which built a NumPy object array of Tile
+instances.
+
+Usage: python3 bench_board.py {optional recorded game log} {optional board size}
+
+Run from the bench directory. If no log is given (or it is "") synthetic
+boards are used. """
+import sys
+sys.path.insert(0, "../game")
+
+import ast
+import re
+import time
+import tracemalloc
+import numpy as np
+
+from game import Board, Tile
+from synthetic import syntheticBoard
+
+class LegacyBoard:
+    """ The original Board parsing code, kept here for comparison. """
+    def __parseTile(self, string):
+        if string == "  ":
+            return Tile(Tile.AIR)
+        if string == "##":
+            return Tile(Tile.WALL)
+        if string == "[]":
+            return Tile(Tile.TAVERN)
+        match = re.match("\$([-0-9])", string)
+        if match:
+            return Tile(Tile.MINE, match.group(1))
+        match = re.match("\@([0-9])", string)
+        if match:
+            return Tile(Tile.HERO, match.group(1))
+
+    def __parseTiles(self, tiles):
+        vector = [tiles[i:i+2] for i in range(0, len(tiles), 2)]
+        matrix = [vector[i:i+self.size] for i in range(0, len(vector), self.size)]
+        return np.transpose([[self.__parseTile(x) for x in xs] for xs in matrix]).copy()
+
+    def __init__(self, board):
+        self.size = board["size"]
+        self.tiles = self.__parseTiles(board["tiles"])
+
+def loadBoards(path):
+    boards = []
+    with open(path) as log:
+        for line in log:
+            line = line.strip()
+            if line:
+                state = ast.literal_eval(line.replace(":false}", ":False}").replace(":true}", ":True}"))
+                boards.append(state["board"])
+    return boards
+
+def timeParse(board_class, boards, repeat):
+    start = time.perf_counter()
+    for i in range(repeat):
+        for board in boards:
+            board_class(board)
+    return (time.perf_counter() - start) / (repeat * len(boards))
+
+def memoryPerBoard(board_class, board, count=50):
+    tracemalloc.start()
+    kept = [board_class(board) for i in range(count)]
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return current / count
+
+def checkEquivalent(boards):
+    for board in boards:
+        legacy, new = LegacyBoard(board), Board(board)
+        for x in range(new.size):
+            for y in range(new.size):
+                old_tile, new_tile = legacy.tiles[x][y], new.tile((x, y))
+                assert (old_tile.type, old_tile.heroId) == (new_tile.type, new_tile.heroId), (x, y)
+
+if __name__ == "__main__":
+    if len(sys.argv) >= 2 and sys.argv[1]:
+        boards = loadBoards(sys.argv[1])
+    else:
+        size = int(sys.argv[2]) if len(sys.argv) >= 3 else 28
+        boards = [syntheticBoard(size, seed=seed)[0] for seed in range(20)]
+    checkEquivalent(boards)
+    
+    repeat = max(1, 2000 // len(boards))
+    print("Board size: %d, boards: %d" % (boards[0]["size"], len(boards)))
+    for name, board_class in (("object array", LegacyBoard), ("int8 arrays", Board)):
+        print("%-14s parse: %8.1f us/board   memory: %8.0f bytes/board" % (name, \
+            timeParse(board_class, boards, repeat) * 1e6, memoryPerBoard(board_class, boards[0])))
@@ -0,0 +1,57 @@
+""" Compare Board.bfs with Board.distanceFields, for the distance fields of
+every hero (unobstructed and obstructed) and for the nearest-tavern and
+nearest-mine fields, which Board.bfs can only produce by running once per
+tavern or mine and taking the minimum.
+
+Usage: python3 bench_distance_fields.py {optional board size} {optional turns}
+
+Run from the bench directory. """
+import sys
+sys.path.insert(0, "../game")
+
+import json
+import time
+
+import numpy as np
+
+from game import Game
+from synthetic import syntheticTurns
+
+FILL = -1
+
+def bfsHeroFields(game):
+    return [np.array(game.board.bfs(hero.pos, path_through_heroes, fill_value=FILL)) \
+        for path_through_heroes in (True, False) for hero in game.heroes]
+
+def bfsNearestFields(game):
+    fields = []
+    for locs in (game.tavern_locs, game.mine_locs):
+        maps = np.array([game.board.bfs(loc, True, fill_value=FILL) for loc in locs])
+        fields.append(np.where((maps >= 0).any(axis=0), np.where(maps >= 0, maps, maps.max() + 1).min(axis=0), FILL))
+    return fields
+
+def engineHeroFields(game):
+    sources = [[hero.pos] for hero in game.heroes]
+    return list(game.board.distanceFields(sources, True)) + list(game.board.distanceFields(sources, False))
+
+def engineNearestFields(game):
+    return list(game.board.distanceFields([list(game.tavern_locs), list(game.mine_locs)]))
+
+def timePerTurn(function, games):
+    start = time.perf_counter()
+    results = [function(game) for game in games]
+    return (time.perf_counter() - start) / len(games), results
+
+if __name__ == "__main__":
+    size = int(sys.argv[1]) if len(sys.argv) >= 2 else 28
+    turns = int(sys.argv[2]) if len(sys.argv) >= 3 else 300
+    games = [Game({"game": json.loads(turn)}, False) for turn in syntheticTurns(size, turns)]
+    print("Board size: %d, turns: %d" % (size, len(games)))
+
+    for name, bfs_function, engine_function in (("hero fields", bfsHeroFields, engineHeroFields), \
+        ("nearest tavern/mine", bfsNearestFields, engineNearestFields)):
+        bfs_time, expected = timePerTurn(bfs_function, games)
+        engine_time, actual = timePerTurn(engine_function, games)
+        assert all(np.array_equal(a, b) for turn_a, turn_b in zip(expected, actual) for a, b in zip(turn_a, turn_b))
+        print("%-20s Board.bfs %8.1f us/turn, distanceFields %8.1f us/turn (%.1fx)" \
+            % (name, bfs_time * 1e6, engine_time * 1e6, bfs_time / engine_time))
@@ -0,0 +1,53 @@
+""" Compare the per-turn cost of computing the Heroes distance columns with
+two Board.bfs runs per hero (the original approach) against DistanceCache.
+
+Usage: python3 bench_distances.py {optional board size} {optional turns}
+
+Run from the bench directory. """
+import sys
+sys.path.insert(0, "../game")
+
+import json
+import time
+
+from game import DistanceCache, Game
+from synthetic import syntheticTurns
+
+FILL = 2**31-1
+
+def bfsDistances(game):
+    result = []
+    for hero in game.heroes:
+        bfs_map = game.board.bfs(hero.pos, True, fill_value=FILL)
+        obstructed_bfs_map = game.board.bfs(hero.pos, False, fill_value=FILL)
+        result.append(tuple([distance_map[x][y] for x, y in locs] \
+            for locs in ([hero.pos for hero in game.heroes], list(game.tavern_locs), \
+                list(game.mine_locs)) \
+            for distance_map in (bfs_map, obstructed_bfs_map)))
+    return result
+
+def cachedDistances(games):
+    cache = None
+    result = []
+    for game in games:
+        if cache is None or not cache.matches(game.board):
+            cache = DistanceCache(game.board)
+        result.append(cache.heroDistances(game, fill_value=FILL))
+    return result
+
+if __name__ == "__main__":
+    size = int(sys.argv[1]) if len(sys.argv) >= 2 else 28
+    turns = int(sys.argv[2]) if len(sys.argv) >= 3 else 1200
+    games = [Game({"game": json.loads(turn)}, False) for turn in syntheticTurns(size, turns)]
+    
+    start = time.perf_counter()
+    expected = [bfsDistances(game) for game in games]
+    bfs_time = (time.perf_counter() - start) / len(games)
+    start = time.perf_counter()
+    actual = cachedDistances(games)
+    cache_time = (time.perf_counter() - start) / len(games)
+    assert expected == actual
+    
+    print("Board size: %d, turns: %d" % (size, len(games)))
+    print("Board.bfs      %8.1f us/turn" % (bfs_time * 1e6))
+    print("DistanceCache  %8.1f us/turn (%.1fx)" % (cache_time * 1e6, bfs_time / cache_time))
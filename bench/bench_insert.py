@@ -0,0 +1,60 @@
+""" Compare rows/sec written by the per-row Inserter and the COPY-based
+BulkInserter, using synthetic games against a local Postgres database with
+the project schema. The games are deleted again afterwards and their bots
+restored (see BotRegistry.restoreBots), so use a database that nothing else
+writes to.
+
+Usage: python3 bench_insert.py <database-name> <database-user> {optional games} {optional board size}
+
+Run from the bench directory. """
+import sys
+sys.path.insert(0, "../game")
+sys.path.insert(0, "../db")
+
+import json
+import time
+
+from BotRegistry import BotRegistry
+from BulkInserter import BulkInserter
+from Inserter import Inserter
+from synthetic import syntheticTurns
+
+def insertGames(inserter, game_turns):
+    start = time.perf_counter()
+    for turns in game_turns:
+        inserter.insertGame(turns)
+    elapsed = time.perf_counter() - start
+    inserter.db.execute(
+        "SELECT (SELECT count(*) FROM Turns WHERE gameId = ANY(%(ids)s)) "
+        "    + (SELECT count(*) FROM Heroes WHERE gameId = ANY(%(ids)s)) "
+        "    + (SELECT count(*) FROM MineSpans WHERE gameId = ANY(%(ids)s));",
+        {"ids": [json.loads(turns[0])["id"] for turns in game_turns]})
+    rows = inserter.db.fetchone()[0]
+    return rows, elapsed
+
+def deleteGames(inserter, game_ids, saved_bots):
+    for table in ("Events", "MineSpans", "Heroes", "Turns"):
+        inserter.db.execute("DELETE FROM " + table + " WHERE gameId = ANY(%s);", (game_ids,))
+    BotRegistry.restoreBots(inserter.db, saved_bots, game_ids)
+    inserter.db.execute("DELETE FROM Games WHERE gameId = ANY(%s);", (game_ids,))
+    inserter.connection.commit()
+
+if __name__ == "__main__":
+    if len(sys.argv) < 3:
+        print(__doc__)
+        sys.exit(1)
+    database_name, database_user = sys.argv[1], sys.argv[2]
+    games = int(sys.argv[3]) if len(sys.argv) >= 4 else 3
+    size = int(sys.argv[4]) if len(sys.argv) >= 5 else 18
+    
+    for name, inserter_class, seed in (("Inserter", Inserter, 0), ("BulkInserter", BulkInserter, 1000)):
+        game_turns = [list(syntheticTurns(size, 1200, seed=seed+i, game_id="bench%03d" % (seed+i))) \
+            for i in range(games)]
+        inserter = inserter_class(database_name, database_user)
+        saved_bots = BotRegistry.saveBots(inserter.db, set(hero["userId"] for turns in game_turns \
+            for hero in json.loads(turns[0])["heroes"]))
+        try:
+            rows, elapsed = insertGames(inserter, game_turns)
+            print("%-13s %8d rows in %6.1f s: %8.0f rows/sec" % (name, rows, elapsed, rows / elapsed))
+        finally:
+            deleteGames(inserter, ["bench%03d" % (seed+i) for i in range(games)], saved_bots)
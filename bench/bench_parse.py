@@ -0,0 +1,50 @@
+""" Report turns/sec for decoding recorded event stream lines with the
+original ast.literal_eval parser and with Inserter._parseJson.
+
+Usage: python3 bench_parse.py {optional recorded game log}
+
+Run from the bench directory. If no log is given a synthetic 28x28 game is
+used. """
+import sys
+sys.path.insert(0, "../game")
+sys.path.insert(0, "../db")
+
+import ast
+import time
+
+from Inserter import Inserter
+from game import Game
+from synthetic import syntheticTurns
+
+def literalEval(string):
+    return ast.literal_eval("{\"game\":" + string.replace(":false}", ":False}").replace(":true}", ":True}") + "}")
+
+def turnsPerSecond(parse, lines, build_game=False):
+    start = time.perf_counter()
+    for line in lines:
+        state = parse(line)
+        if build_game:
+            Game(state, False)
+    return len(lines) / (time.perf_counter() - start)
+
+def advanceTurnsPerSecond(lines):
+    start = time.perf_counter()
+    game = None
+    for line in lines:
+        state = Inserter._parseJson(line)
+        game = Game(state, False) if game is None else game.advance(state)
+    return len(lines) / (time.perf_counter() - start)
+
+if __name__ == "__main__":
+    if len(sys.argv) >= 2:
+        with open(sys.argv[1]) as log:
+            lines = [line.rstrip("\r\n") for line in log if line.strip()]
+    else:
+        lines = list(syntheticTurns(28, 1200))
+    assert all(literalEval(line) == Inserter._parseJson(line) for line in lines[:50])
+    
+    print("Turns: %d, average line length: %d" % (len(lines), sum(map(len, lines)) / len(lines)))
+    for name, parse in (("ast.literal_eval", literalEval), ("_parseJson", Inserter._parseJson)):
+        print("%-17s decode: %8.0f turns/sec   decode + Game: %8.0f turns/sec" % (name, \
+            turnsPerSecond(parse, lines), turnsPerSecond(parse, lines, True)))
+    print("%-17s decode + Game.advance: %8.0f turns/sec" % ("_parseJson", advanceTurnsPerSecond(lines)))
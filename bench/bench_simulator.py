@@ -0,0 +1,39 @@
+""" Measure how many random rollouts per second the simulator runs, each
+from a fresh snapshot of the same position.
+
+Usage: python3 bench_simulator.py {optional board size} {optional rollout turns} {optional rollouts}
+
+Run from the bench directory. """
+import sys
+sys.path.insert(0, "../game")
+
+import json
+import random
+import time
+
+from game import Game
+from simulator import Simulator, randomPolicy
+from synthetic import syntheticTurns
+
+if __name__ == "__main__":
+    size = int(sys.argv[1]) if len(sys.argv) >= 2 else 18
+    turns = int(sys.argv[2]) if len(sys.argv) >= 3 else 100
+    rollouts = int(sys.argv[3]) if len(sys.argv) >= 4 else 2000
+    start_turn = next(syntheticTurns(size, 1200))
+    root = Simulator(Game({"game": json.loads(start_turn)}, False))
+    policy = randomPolicy(random.Random(0))
+
+    start = time.perf_counter()
+    for i in range(rollouts):
+        root.copy().rollout(policy, turns)
+    elapsed = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for i in range(rollouts):
+        root.copy()
+    copy_time = (time.perf_counter() - start) / rollouts
+
+    print("Board size: %d, %d rollouts of %d turns" % (size, rollouts, turns))
+    print("%10.0f rollouts/s" % (rollouts / elapsed))
+    print("%10.0f turns/s" % (rollouts * turns / elapsed))
+    print("%10.2f us per snapshot" % (copy_time * 1e6))
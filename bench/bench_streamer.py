@@ -0,0 +1,85 @@
+""" Measure Streamer throughput against a recorded event stream served from
+a local HTTP server, compared with the original one-character-at-a-time
+reader.
+
+Usage: python3 bench_streamer.py {optional recorded text/event-stream body}
+
+Run from the bench directory. If no recording is given, a synthetic 28x28
+game is streamed. """
+import sys
+sys.path.insert(0, "../game")
+sys.path.insert(0, "../db")
+
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from Streamer import Streamer, StreamerError
+from synthetic import syntheticTurns
+
+class LegacyStreamer(Streamer):
+    """ The original Streamer.stream, kept here for comparison. The length
+    limit is raised so that large turns do not abort the comparison, and one
+    iter_content generator is shared by all lines, because with current
+    versions of urllib3 abandoning the generator closes the connection. """
+    def stream(self):
+        chars = self.connection.iter_content(decode_unicode=True)
+        while True:
+            data = ""
+            for char in chars:
+                if not char:
+                    continue
+                if len(data) > self.max_event_size:
+                    raise StreamerError("Stream data from " + self.url + " is too long!")
+                
+                if char != "\n":
+                    data += char
+                elif len(data) > 0:
+                    break
+            else:
+                break
+            yield data.lstrip("data: ")
+
+def serve(body, chunk_size=8192):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+        
+        def do_GET(self):
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+            for start in range(0, len(body), chunk_size):
+                chunk = body[start:start+chunk_size]
+                self.wfile.write(b"%x\r\n%s\r\n" % (len(chunk), chunk))
+            self.wfile.write(b"0\r\n\r\n")
+        
+        def log_message(self, format, *args):
+            pass
+    
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+def measure(streamer_class, url):
+    start = time.perf_counter()
+    events = list(streamer_class(url).stream())
+    return events, time.perf_counter() - start
+
+if __name__ == "__main__":
+    if len(sys.argv) >= 2:
+        with open(sys.argv[1], "rb") as recording:
+            body = recording.read()
+    else:
+        body = b"".join(b"data: " + turn.encode("utf-8") + b"\n\n" for turn in syntheticTurns(28, 1200))
+    server = serve(body)
+    url = "http://127.0.0.1:%d/events/bench" % server.server_address[1]
+    
+    print("Stream size: %.1f MB" % (len(body) / 1e6))
+    new_events, new_time = measure(Streamer, url)
+    old_events, old_time = measure(LegacyStreamer, url)
+    assert old_events == new_events
+    for name, elapsed in (("char by char", old_time), ("buffered SSE", new_time)):
+        print("%-13s %7.2f s  %8.0f events/sec  %7.2f MB/s" % (name, elapsed, \
+            len(new_events) / elapsed, len(body) / elapsed / 1e6))
+    server.shutdown()
@@ -0,0 +1,202 @@
+""" Microbenchmarks of the ingestion hot paths over simulated games, with a
+saved baseline and a regression gate.
+
+Each benchmark times one operation over every turn (or turn and hero) of a
+fixed set of games from synthetic.simulatedTurns, repeats it and keeps the
+fastest run, reported in microseconds per operation:
+
+    board_parse       Board(board), which parses the tile string
+    board_bfs         Board.bfs from each hero, paths blocked by heroes
+    parse_json        Inserter._parseJson
+    game_init         Game(state, False)
+    game_advance      Game.advance from the previous turn
+    freshly_dead      Game.getFreshlyDeadHeroes between consecutive turns
+    hero_distances    DistanceCache.heroDistances, sharing one cache per game
+    insert_turn       Inserter.insertTurn and its commit, only with --database
+
+Usage: python3 suite.py {options}
+
+    --save                 write the results as the baseline
+    --baseline FILE        baseline to save or compare with (default: baseline.json)
+    --threshold FRACTION   fail if a benchmark is more than this much slower than
+                           its baseline (default: 0.25)
+    --database NAME USER   also run insert_turn against this local Postgres
+                           database, which nothing else may write to; the
+                           games are deleted again and their bots restored
+
+Without --save, the results are compared with the baseline if there is one,
+and the exit status is 1 if any benchmark regressed. Baselines only mean
+something on the machine they were saved on, so save one there first. Run
+from the bench directory. """
+import sys
+sys.path.insert(0, "../game")
+sys.path.insert(0, "../db")
+
+import argparse
+import json
+import os
+import platform
+import time
+
+from BotRegistry import BotRegistry
+from game import Board, DistanceCache, Game
+from Inserter import Inserter
+from synthetic import simulatedTurns
+
+BASELINE_VERSION = 1
+
+def loadGames(workload):
+    """ Return the turn strings and parsed states of the workload's games. """
+    games = []
+    for index in range(workload["games"]):
+        turn_strings = list(simulatedTurns(workload["size"], workload["turns"], seed=workload["seed"] + index, \
+            game_id="suite%03d" % index))
+        games.append((turn_strings, [Inserter._parseJson(turn_string) for turn_string in turn_strings]))
+    return games
+
+def benchmarks(games):
+    """ Return {name: (run, operations)}, where run() performs operations
+    operations. """
+    states = [state for turn_strings, states in games for state in states]
+    turn_strings = [turn_string for turn_strings, states in games for turn_string in turn_strings]
+    game_lists = [[Game(state, False) for state in game_states] for turn_strings, game_states in games]
+    all_games = [game for game_list in game_lists for game in game_list]
+    hero_count = sum(len(game.heroes) for game in all_games)
+    pairs = [(previous, game) for game_list in game_lists for previous, game in zip(game_list, game_list[1:])]
+
+    def boardParse():
+        for state in states:
+            Board(state["game"]["board"])
+
+    def boardBfs():
+        for game in all_games:
+            for hero in game.heroes:
+                game.board.bfs(hero.pos, False)
+
+    def parseJson():
+        for turn_string in turn_strings:
+            Inserter._parseJson(turn_string)
+
+    def gameInit():
+        for state in states:
+            Game(state, False)
+
+    def gameAdvance():
+        for turn_strings, game_states in games:
+            game = Game(game_states[0], False)
+            for state in game_states[1:]:
+                game = game.advance(state)
+
+    def freshlyDead():
+        for previous, game in pairs:
+            Game.getFreshlyDeadHeroes(previous, game)
+
+    def heroDistances():
+        for game_list in game_lists:
+            distance_cache = DistanceCache(game_list[0].board)
+            for game in game_list:
+                distance_cache.heroDistances(game, fill_value=Inserter.UNREACHABLE)
+
+    return {"board_parse": (boardParse, len(states)), "board_bfs": (boardBfs, hero_count), \
+        "parse_json": (parseJson, len(turn_strings)), "game_init": (gameInit, len(states)), \
+        "game_advance": (gameAdvance, len(states) - len(games)), "freshly_dead": (freshlyDead, len(pairs)), \
+        "hero_distances": (heroDistances, len(states))}
+
+def insertTurnBenchmark(games, database_name, database_user):
+    """ Return (run, operations) inserting every turn of games with
+    Inserter.insertTurn, deleting them after each run. """
+    inserter = Inserter(database_name, database_user)
+    game_ids = [json.loads(turn_strings[0])["id"] for turn_strings, states in games]
+    saved_bots = BotRegistry.saveBots(inserter.db, set(hero["userId"] for turn_strings, states in games \
+        for hero in states[0]["game"]["heroes"]))
+    inserter.connection.commit()
+
+    def insertTurns():
+        try:
+            for turn_strings, states in games:
+                inserter._insertGame(turn_strings[0])
+                game = None
+                for turn_string in turn_strings:
+                    game = inserter.insertTurn(turn_string, game)
+                    inserter._commitTurn()
+        finally:
+            inserter.rollback(game_ids)
+            for table in ("Events", "MineSpans", "Heroes", "Turns"):
+                inserter.db.execute("DELETE FROM " + table + " WHERE gameId = ANY(%s);", (game_ids,))
+            BotRegistry.restoreBots(inserter.db, saved_bots, game_ids)
+            inserter.db.execute("DELETE FROM Games WHERE gameId = ANY(%s);", (game_ids,))
+            inserter.connection.commit()
+            # Its cache holds the HistoricalBots rows just deleted
+            inserter.bot_registry = BotRegistry(inserter.db)
+
+    return insertTurns, sum(len(turn_strings) for turn_strings, states in games)
+
+def timeBenchmark(run, operations, repeats):
+    """ Return the fastest of repeats runs, after one to warm up, in
+    microseconds per operation. """
+    run()
+    best = float("inf")
+    for i in range(repeats):
+        start = time.perf_counter()
+        run()
+        best = min(best, time.perf_counter() - start)
+    return best / operations * 1e6
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run the ingestion microbenchmarks and compare them with a baseline.")
+    parser.add_argument("--save", action="store_true", help="Save the results as the baseline.")
+    parser.add_argument("--baseline", default="baseline.json")
+    parser.add_argument("--threshold", type=float, default=0.25, \
+        help="Fail if a benchmark is more than this fraction slower than its baseline.")
+    parser.add_argument("--database", nargs=2, metavar=("DATABASE_NAME", "DATABASE_USER"), default=None, \
+        help="Also benchmark Inserter.insertTurn against this database.")
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--only", nargs="+", default=None, help="Only run these benchmarks.")
+    args = parser.parse_args()
+
+    workload = {"games": 2, "size": 18, "turns": 300, "seed": 0}
+    games = loadGames(workload)
+    suite = benchmarks(games)
+    if args.database is not None:
+        suite["insert_turn"] = insertTurnBenchmark(games, args.database[0], args.database[1])
+    if args.only is not None:
+        suite = {name: suite[name] for name in args.only}
+
+    baseline = None
+    if not args.save and os.path.exists(args.baseline):
+        with open(args.baseline) as baseline_file:
+            baseline = json.load(baseline_file)
+        if baseline.get("version") != BASELINE_VERSION or baseline.get("workload") != workload:
+            print("Ignoring " + args.baseline + ", which was saved for a different workload.")
+            baseline = None
+
+    results = {}
+    regressions = []
+    for name, (run, operations) in suite.items():
+        results[name] = timeBenchmark(run, operations, args.repeats)
+        line = "%-15s %10.2f us/op" % (name, results[name])
+        if baseline is not None and name in baseline["results"]:
+            ratio = results[name] / baseline["results"][name]
+            line += "   baseline %10.2f us/op   %5.2fx" % (baseline["results"][name], ratio)
+            if ratio > 1 + args.threshold:
+                regressions.append(name)
+                line += "   REGRESSED"
+        print(line)
+
+    if args.save:
+        if os.path.exists(args.baseline):
+            with open(args.baseline) as baseline_file:
+                saved = json.load(baseline_file)
+            if saved.get("version") == BASELINE_VERSION and saved.get("workload") == workload:
+                # Keep the baselines of benchmarks not run this time
+                results = dict(saved["results"], **results)
+        with open(args.baseline + ".tmp", "w") as baseline_file:
+            json.dump({"version": BASELINE_VERSION, "workload": workload, "python": platform.python_version(), \
+                "machine": platform.node(), "results": results}, baseline_file, indent=2, sort_keys=True)
+        os.replace(args.baseline + ".tmp", args.baseline)
+        print("Saved the baseline to " + args.baseline + ".")
+    elif baseline is None:
+        print("No baseline to compare with; save one with --save.")
+    elif regressions:
+        print("Regressed by more than " + str(int(args.threshold * 100)) + "%: " + ", ".join(regressions))
+        sys.exit(1)
@@ -0,0 +1,172 @@
+import sys
+sys.path.insert(0, "../game")
+
+import argparse
+import itertools
+import logging as _logging
+from multiprocessing import Pool
+
+import numpy as np
+import psycopg2 as psycopg
+
+from archive import GameArchiveWriter
+from Backfill import gameIdOf, logFiles, readLines
+from game import Game
+from Inserter import Inserter
+from MapStore import MapStore
+
+class ArchiveExporter():
+    """ Writes games to a columnar archive (see game/archive.py), either from
+    recorded logs or from the database.
+
+    Games exported from the database take their terrain and tavern locations
+    from Maps; games inserted before Maps existed have neither. """
+
+    def __init__(self, archive_root, logger=_logging.getLogger("ArchiveExporter")):
+        self.archive_root = archive_root
+        self.logger = logger
+
+    def exportLogs(self, paths, processes=None):
+        """ Archive every game of the logs in paths, one file per task of a
+        process pool. Returns the number of games archived. """
+        with Pool(processes) as pool:
+            return sum(pool.imap_unordered(self._exportLog, paths))
+
+    def _exportLog(self, path):
+        exported = 0
+        for game_id, turn_strings in itertools.groupby(readLines(path), gameIdOf):
+            if game_id is None:
+                continue
+            writer = GameArchiveWriter()
+            game = None
+            for turn_string in turn_strings:
+                state = Inserter._parseJson(turn_string)
+                game = Game(state, False) if game is None else game.advance(state)
+                writer.append(game)
+            writer.write(self.archive_root)
+            exported += 1
+        self.logger.info(path + ": archived " + str(exported) + " games.")
+        return exported
+
+    def exportDatabase(self, database_name, database_user, game_ids=None):
+        """ Archive the given games, or every finished game, from the
+        database. Games whose turns Partitions.py dropped are skipped.
+        Returns the number of games archived. """
+        connection = psycopg.connect("dbname=" + database_name + " user=" + database_user)
+        db = connection.cursor()
+        if game_ids is None:
+            db.execute("SELECT gameId FROM Games WHERE finished AND NOT turnsDropped ORDER BY gameId;")
+            game_ids = [row[0] for row in db.fetchall()]
+        else:
+            db.execute("SELECT gameId FROM Games WHERE gameId = ANY(%s) AND turnsDropped;", (list(game_ids),))
+            dropped = set(row[0] for row in db.fetchall())
+            if dropped:
+                self.logger.warning("Skipping " + str(len(dropped)) + " games whose turns were dropped.")
+            game_ids = [game_id for game_id in game_ids if game_id not in dropped]
+        map_store = MapStore(db)
+        for game_id in game_ids:
+            ArchiveExporter.readGame(db, game_id, map_store).write(self.archive_root)
+            self.logger.debug("Archived " + game_id + ".")
+        connection.close()
+        return len(game_ids)
+
+    @staticmethod
+    def gameBots(db, game_id):
+        """ Return {userId: (name, elo)} for the bots of a game, with their elo
+        in that game: from the HistoricalBots rows of Games.historicalBotIds
+        or, for games inserted before it existed, the rows whose lastGameId
+        is the game. """
+        db.execute(
+            "SELECT b.userId, b.name, hb.elo "
+            "FROM HistoricalBots hb JOIN Bots b ON b.userId = hb.userId "
+            "WHERE hb.id = ANY(COALESCE((SELECT historicalBotIds FROM Games WHERE gameId = %s), '{}')) "
+            "    OR hb.lastGameId = %s;",
+            (game_id, game_id))
+        return {user_id: (name, elo) for user_id, name, elo in db.fetchall()}
+
+    @staticmethod
+    def readGame(db, game_id, map_store=None):
+        """ Read a game from the database into a GameArchiveWriter, with the
+        heroes' elo from gameBots. map_store: a MapStore on db, to share the
+        maps read between calls. """
+        db.execute("SELECT size, finished, mapHash FROM Games WHERE gameId = %s;", (game_id,))
+        size, finished, map_hash = db.fetchone()
+        game_map = None
+        if map_hash is not None:
+            game_map = (map_store or MapStore(db)).byHash(map_hash)
+        db.execute(
+            "SELECT t.turn, h.inGameId, h.userId, h.life, h.gold, h.pos, h.mineCount, h.died, h.crashed "
+            "FROM Turns t JOIN Heroes h ON h.turnId = t.id "
+            "WHERE t.gameId = %s "
+            "ORDER BY t.turn, h.inGameId;",
+            (game_id,))
+        hero_rows = db.fetchall()
+        db.execute(
+            "SELECT mineNumber, pos, inGameId, fromTurn, toTurn "
+            "FROM MineSpans "
+            "WHERE gameId = %s "
+            "ORDER BY mineNumber, fromTurn;",
+            (game_id,))
+        span_rows = db.fetchall()
+        bots = ArchiveExporter.gameBots(db, game_id)
+
+        heroes = {}
+        for row in hero_rows:
+            if row[1] not in heroes:
+                name, elo = bots.get(row[2], (None, None))
+                heroes[row[1]] = {"heroId": row[1], "userId": row[2], "name": name, "elo": elo}
+        mine_locs = {}
+        for mine_number, mine_pos, owner, from_turn, to_turn in span_rows:
+            mine_locs.setdefault(mine_number, tuple(mine_pos))
+        mine_numbers = sorted(mine_locs)
+        turns = np.array(sorted(set(row[0] for row in hero_rows)), dtype=np.int32)
+        owners = np.zeros((len(turns), len(mine_numbers)), dtype=np.int8)
+        for mine_number, mine_pos, owner, from_turn, to_turn in span_rows:
+            if owner is not None:
+                in_span = turns >= from_turn
+                if to_turn is not None:
+                    in_span &= turns <= to_turn
+                owners[in_span, mine_numbers.index(mine_number)] = owner
+
+        writer = GameArchiveWriter()
+        writer.startGame(game_id, size, None, [heroes[hero_id] for hero_id in sorted(heroes)], \
+            [mine_locs[mine_number] for mine_number in mine_numbers], \
+            game_map.tavern_locs if game_map is not None else [], \
+            game_map.terrain if game_map is not None else None)
+        for index, (turn, turn_hero_rows) in enumerate(itertools.groupby(hero_rows, lambda row: row[0])):
+            turn_hero_rows = list(turn_hero_rows)
+            writer.appendRow(turn, [row[3] for row in turn_hero_rows], [row[4] for row in turn_hero_rows], \
+                [row[5] for row in turn_hero_rows], [row[6] for row in turn_hero_rows], \
+                [row[7] for row in turn_hero_rows], [row[8] for row in turn_hero_rows], owners[index])
+        writer.finish(finished)
+        return writer
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export games to a memory-mapped columnar archive, "
+        "from recorded logs or from the database. Query it with game/archive.py.")
+    parser.add_argument("archive_root", help="Directory to write the archive to.")
+    parser.add_argument("--logs", nargs="+", default=None, \
+        help="Archive these recorded logs (files, directories or globs) instead of the database.")
+    parser.add_argument("--database", nargs=2, metavar=("DATABASE_NAME", "DATABASE_USER"), default=None, \
+        help="Archive finished games from this database.")
+    parser.add_argument("--games", nargs="+", default=None, help="Only archive these games from the database.")
+    parser.add_argument("--processes", type=int, default=None, \
+        help="Number of log files to archive in parallel (default: one per CPU).")
+    parser.add_argument("--logging-level", default="info", type=str.lower, \
+        choices=["debug", "info", "warn", "error", "critical"])
+    args = parser.parse_args()
+    if (args.logs is None) == (args.database is None):
+        parser.error("give exactly one of --logs and --database")
+
+    logger = _logging.getLogger("ArchiveExporter")
+    stdout_handler = _logging.StreamHandler(sys.stdout)
+    stdout_handler.setFormatter(_logging.Formatter("%(levelname)s: %(message)s"))
+    logger.addHandler(stdout_handler)
+    logger.setLevel(getattr(_logging, args.logging_level.upper()))
+
+    exporter = ArchiveExporter(args.archive_root, logger)
+    if args.logs is not None:
+        exported = exporter.exportLogs(logFiles(args.logs), args.processes)
+    else:
+        exported = exporter.exportDatabase(args.database[0], args.database[1], args.games)
+    logger.info("Archived " + str(exported) + " games to " + args.archive_root + ".")
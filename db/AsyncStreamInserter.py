@@ -0,0 +1,202 @@
+import sys
+sys.path.insert(0, "../game")
+
+import asyncio
+import json
+import logging as _logging
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import aiohttp
+
+from game import Game
+from GameScheduler import GameScheduler
+from Inserter import Inserter
+from MapStore import MapStore
+from Metrics import metrics
+from Streamer import SSEParser
+
+# The maps seen by this (worker) process, whose distance caches are shared
+# by every game on the same map.
+_map_store = MapStore(max_maps=64)
+
+def buildTurn(turn_string):
+    """ Parse turn_string and compute its hero distances. This is the CPU
+    heavy part of inserting a turn, and runs in the process pool. Returns
+    (game, distances) as expected by Inserter._insertBuiltTurn. """
+    with metrics.time("parse_seconds"):
+        state = Inserter._parseJson(turn_string)
+    with metrics.time("build_seconds"):
+        game = Game(state, False)
+    with metrics.time("distances_seconds"):
+        distances = _map_store.get(game.board).distance_cache.heroDistances(game, fill_value=Inserter.UNREACHABLE)
+    return game, distances
+
+class _GameTask():
+    """ The task following one game, with the part of the Process interface
+    GameScheduler uses. _followGame logs its own errors, so the exit code is
+    always 0. """
+    exitcode = 0
+
+    def __init__(self, task):
+        self.task = task
+
+    def is_alive(self):
+        return not self.task.done()
+
+    def join(self):
+        pass
+
+    def close(self):
+        pass
+
+class AsyncStreamInserter():
+    """ Follows /now-playing and every /events/<gameId> stream from a single
+    asyncio event loop, instead of a process per game.
+
+    Parsing and distance computation run in a bounded process pool. Each game
+    is assigned to one of a small number of writers, each of which owns an
+    Inserter (and so one database connection) and runs its blocking database
+    calls in a thread of its own. Turns of a game are written in order by the
+    same writer. Which games are followed, and when, is decided by a
+    GameScheduler, as in StreamInserter. """
+
+    def __init__(self, hostname, database_name, database_user, logger=_logging.getLogger("AsyncStreamInserter"), \
+        inserter_class=Inserter, inserter_options=None, workers=None, writers=2, queue_size=1000, \
+        metrics_queue=None, scheduler_options=None):
+        """ workers: Size of the parsing process pool (None for one per CPU).
+
+        writers: Number of database writers, and so of connections.
+
+        queue_size: Number of items each writer may have queued before the
+        games assigned to it wait for it to catch up.
+
+        metrics_queue: A multiprocessing Queue the parsing processes forward
+        their metrics to (see Metrics.forwardTo), or None.
+
+        scheduler_options: Keyword arguments for the GameScheduler, such as
+        max_games and priority. Its writer queue depth is the number of items
+        queued for all writers, and max_queue_depth defaults to 10 items per
+        writer per game slot. """
+        self.hostname = hostname
+        self.database_name = database_name
+        self.database_user = database_user
+        self.logger = logger
+        self.inserter_class = inserter_class
+        self.inserter_options = inserter_options or {}
+        self.workers = workers
+        self.writers = writers
+        self.queue_size = queue_size
+        self.metrics_queue = metrics_queue
+        self.scheduler_options = dict(scheduler_options or {})
+        self.scheduler_options.setdefault("max_queue_depth", \
+            10 * writers * self.scheduler_options.get("max_games", 32))
+
+    def start(self):
+        asyncio.run(self._run())
+
+    async def _run(self):
+        if self.metrics_queue is not None:
+            self.process_pool = ProcessPoolExecutor(max_workers=self.workers, \
+                initializer=metrics.forwardTo, initargs=(self.metrics_queue,))
+        else:
+            self.process_pool = ProcessPoolExecutor(max_workers=self.workers)
+        self.thread_pool = ThreadPoolExecutor(max_workers=self.writers)
+        self.write_queues = [asyncio.Queue(maxsize=self.queue_size) for i in range(self.writers)]
+        writer_tasks = [asyncio.ensure_future(self._writer(queue)) for queue in self.write_queues]
+        try:
+            timeout = aiohttp.ClientTimeout(total=None, sock_read=None)
+            async with aiohttp.ClientSession(timeout=timeout) as session:
+                scheduler = GameScheduler(lambda game_id: self._startGame(session, game_id), \
+                    writer_pool=self, logger=self.logger, **self.scheduler_options)
+                async for data in self._stream(session, self.hostname + "/now-playing"):
+                    scheduler.offer(json.loads(data))
+                while scheduler.pending or scheduler.running:
+                    await asyncio.sleep(1)
+                    scheduler.schedule()
+            for queue in self.write_queues:
+                await queue.put(None)
+            await asyncio.gather(*writer_tasks)
+        finally:
+            self.process_pool.shutdown()
+            self.thread_pool.shutdown()
+
+    def _startGame(self, session, game_id):
+        return _GameTask(asyncio.ensure_future(self._followGame(session, game_id)))
+
+    def queueDepth(self):
+        """ Return the number of items queued for all writers, as
+        GameScheduler expects of a WriterPool. """
+        return sum(queue.qsize() for queue in self.write_queues)
+
+    async def _stream(self, session, url):
+        """ Yield the data of each event of the event stream at url. """
+        async with session.get(url) as response:
+            parser = SSEParser()
+            read_start = time.perf_counter()
+            async for chunk in response.content.iter_any():
+                metrics.observe("stream_read_seconds", time.perf_counter() - read_start)
+                metrics.inc("stream_bytes_total", len(chunk))
+                for event in parser.feed(chunk):
+                    yield event.data
+                read_start = time.perf_counter()
+
+    async def _followGame(self, session, game_id):
+        loop = asyncio.get_running_loop()
+        queue = self.write_queues[hash(game_id) % self.writers]
+        game = None
+        try:
+            async for turn_string in self._stream(session, self.hostname + "/events/" + game_id):
+                arrival = time.time()
+                turn_string = turn_string.rstrip("\n").rstrip("\r")
+                if len(turn_string) == 0:
+                    continue
+                built_game, distances = await loop.run_in_executor(self.process_pool, buildTurn, turn_string)
+                # The Games row is only written once the first turn has built
+                if game is None:
+                    await queue.put(("game", game_id, turn_string))
+                await queue.put(("turn", game_id, built_game, distances, game, arrival))
+                game = built_game
+        except Exception:
+            self.logger.exception("Error while streaming game " + game_id)
+            metrics.inc("errors_total")
+        if game is not None:
+            await queue.put(("finish", game_id, game))
+
+    async def _writer(self, queue):
+        loop = asyncio.get_running_loop()
+        inserter = await loop.run_in_executor(self.thread_pool, lambda: self.inserter_class( \
+            self.database_name, self.database_user, self.logger, **self.inserter_options))
+        failed_games = set() # Games rolled back after an error, whose later items are dropped
+        while True:
+            item = await queue.get()
+            if item is None:
+                break
+            game_id = item[1]
+            if game_id in failed_games:
+                if item[0] == "finish":
+                    failed_games.discard(game_id)
+                continue
+            try:
+                await loop.run_in_executor(self.thread_pool, AsyncStreamInserter._write, inserter, item)
+            except Exception:
+                self.logger.exception("Error while writing " + item[0] + " of " + game_id + " to database")
+                metrics.inc("errors_total")
+                rolled_back = await loop.run_in_executor(self.thread_pool, inserter.rollback, [game_id])
+                self.logger.error("Dropping the rest of " + ", ".join(sorted(rolled_back)) + ".")
+                metrics.inc("games_failed_total", len(rolled_back))
+                failed_games |= rolled_back
+                if item[0] == "finish":
+                    failed_games.discard(game_id)
+
+    @staticmethod
+    def _write(inserter, item):
+        kind = item[0]
+        if kind == "game":
+            inserter._insertGame(item[2])
+        elif kind == "turn":
+            game, distances, old_game, arrival = item[2:]
+            inserter._insertBuiltTurn(game, distances, old_game, arrival)
+            inserter._commitTurn()
+        elif kind == "finish":
+            inserter._finishGame(item[2])
@@ -0,0 +1,158 @@
+import sys
+sys.path.insert(0, "../game")
+
+import argparse
+import datetime
+import glob
+import gzip
+import itertools
+import logging as _logging
+import os
+import re
+from multiprocessing import Pool
+
+from BulkInserter import BulkInserter
+from Inserter import Inserter
+
+_GAME_ID_PATTERN = re.compile(r'"id"\s*:\s*"([^"]*)"')
+
+def logFiles(patterns):
+    """ Expand directories (to every file below them) and glob patterns
+    into a sorted list of files. """
+    paths = set()
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            for directory, subdirectories, files in os.walk(pattern):
+                paths.update(os.path.join(directory, name) for name in files)
+        else:
+            paths.update(path for path in glob.glob(pattern) if os.path.isfile(path))
+    return sorted(paths)
+
+def readLines(path):
+    """ Lazily yield the turn strings of a recorded log, which may be gzipped
+    and may keep the event stream's "data: " prefixes. """
+    opener = gzip.open if path.endswith(".gz") else open
+    with opener(path, "rt") as log:
+        for line in log:
+            line = line.rstrip("\n").rstrip("\r")
+            if line.startswith("data:"):
+                line = line[5:].lstrip(" ")
+            if len(line) > 0:
+                yield line
+
+def gameIdOf(turn_string):
+    """ Return the game id of a turn string without decoding all of it. Hero
+    ids are numbers and userId does not match, so the first quoted "id" is
+    the game's. """
+    match = _GAME_ID_PATTERN.search(turn_string)
+    return match.group(1) if match else None
+
+class Backfill():
+    """ Inserts recorded game logs, one file per task of a process pool.
+
+    A log holds the turns of one or more games, each game's turns
+    consecutive and in order. Games are recorded in BackfillCheckpoints once
+    fully inserted and skipped from then on, so an interrupted backfill can
+    simply be started again. A game that was only partly inserted has its
+    turns deleted and inserted again; its Games row and bot history are
+    kept. """
+
+    def __init__(self, database_name, database_user, logger=_logging.getLogger("Backfill"), \
+        inserter_class=Inserter, inserter_options=None):
+        self.database_name = database_name
+        self.database_user = database_user
+        self.logger = logger
+        self.inserter_class = inserter_class
+        self.inserter_options = inserter_options or {}
+
+    def run(self, paths, processes=None):
+        """ Backfill every file in paths using a pool of processes (None for
+        one per CPU). Returns (games inserted, games skipped). """
+        inserted = skipped = 0
+        with Pool(processes, initializer=self._initWorker) as pool:
+            for path, file_inserted, file_skipped in pool.imap_unordered(self._backfillFile, paths):
+                self.logger.info(path + ": inserted " + str(file_inserted) + " games, skipped " \
+                    + str(file_skipped) + ".")
+                inserted += file_inserted
+                skipped += file_skipped
+        return inserted, skipped
+
+    def _initWorker(self):
+        global _inserter
+        _inserter = self.inserter_class(self.database_name, self.database_user, self.logger, \
+            **self.inserter_options)
+
+    def _backfillFile(self, path):
+        inserted = skipped = 0
+        for game_id, turn_strings in itertools.groupby(readLines(path), gameIdOf):
+            if game_id is None:
+                self.logger.warning(path + ": skipping turns without a game id.")
+                continue
+            try:
+                if self._backfillGame(_inserter, game_id, turn_strings, path):
+                    inserted += 1
+                else:
+                    skipped += 1
+            except Exception:
+                self.logger.exception(path + ": failed to insert game " + game_id)
+                _inserter.rollback([game_id])
+        return path, inserted, skipped
+
+    def _backfillGame(self, inserter, game_id, turn_strings, path):
+        """ Insert one game unless it is already checkpointed. Returns True if
+        it was inserted. """
+        db = inserter.db
+        db.execute("SELECT 1 FROM BackfillCheckpoints WHERE gameId = %s;", (game_id,))
+        if db.fetchone() is not None:
+            return False
+
+        db.execute("SELECT 1 FROM Games WHERE gameId = %s;", (game_id,))
+        partly_inserted = db.fetchone() is not None
+        if partly_inserted:
+            self.logger.info("Deleting partly inserted turns of " + game_id + ".")
+            Backfill.deleteTurns(db, game_id)
+            inserter.connection.commit()
+
+        inserter.insertGame(turn_strings, insert_game_row=not partly_inserted)
+        db.execute(
+            "INSERT INTO BackfillCheckpoints (gameId, sourceFile, completedAt) "
+            "VALUES (%s, %s, %s);",
+            (game_id, path, datetime.datetime.now()))
+        inserter.connection.commit()
+        return True
+
+    @staticmethod
+    def deleteTurns(db, game_id):
+        """ Delete the Turns and Events of a game and the rows that reference
+        them. """
+        db.execute("DELETE FROM Events WHERE gameId = %s;", (game_id,))
+        db.execute("DELETE FROM MineSpans WHERE gameId = %s;", (game_id,))
+        db.execute("DELETE FROM Heroes WHERE gameId = %s;", (game_id,))
+        db.execute("DELETE FROM Turns WHERE gameId = %s;", (game_id,))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Insert recorded game logs (plain or gzipped) into Postgres. "
+        "Games already recorded in BackfillCheckpoints are skipped, so an interrupted backfill can be rerun.")
+    parser.add_argument("database_name")
+    parser.add_argument("database_user")
+    parser.add_argument("paths", nargs="+", help="Log files, directories of log files, or glob patterns.")
+    parser.add_argument("--processes", type=int, default=None, \
+        help="Number of files to insert in parallel (default: one per CPU).")
+    parser.add_argument("--bulk", action="store_true", \
+        help="Load each game with COPY instead of one INSERT per row.")
+    parser.add_argument("--logging-level", default="info", type=str.lower, \
+        choices=["debug", "info", "warn", "error", "critical"])
+    args = parser.parse_args()
+
+    logger = _logging.getLogger("Backfill")
+    stdout_handler = _logging.StreamHandler(sys.stdout)
+    stdout_handler.setFormatter(_logging.Formatter("%(levelname)s: %(message)s"))
+    logger.addHandler(stdout_handler)
+    logger.setLevel(getattr(_logging, args.logging_level.upper()))
+
+    paths = logFiles(args.paths)
+    logger.info("Backfilling " + str(len(paths)) + " files.")
+    inserter_class = BulkInserter if args.bulk else Inserter
+    inserted, skipped = Backfill(args.database_name, args.database_user, logger, inserter_class) \
+        .run(paths, args.processes)
+    logger.info("Inserted " + str(inserted) + " games, skipped " + str(skipped) + " already inserted.")
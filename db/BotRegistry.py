@@ -0,0 +1,118 @@
+from psycopg2.extras import execute_values
+
+class BotRegistry():
+    """ Keeps Bots and HistoricalBots up to date as games start, remembering
+    the bots it has seen so that most games need no bot writes at all.
+
+    HistoricalBots has one row per Elo a bot has had, not per game: a row is
+    added only when a bot is first seen or its Elo changed, chained to the
+    previous one through previousHistoricalBotId, and Bots.latestHistoricalBotId
+    points at the newest. Each game records the rows that describe its
+    heroes in Games.historicalBotIds.
+
+    Concurrent writers need no lock between them: the upsert into Bots locks
+    a game's bots, in userId order, until the transaction ends, and returns
+    the latest row and its Elo (Bots.latestHistoricalElo) as they are under
+    that lock, including changes a writer it waited for has just committed.
+    New HistoricalBots rows are chained to that latest row.
+    A bot whose Elo another writer changed is noticed the next time its Elo
+    differs from the one remembered here. """
+
+    def __init__(self, db):
+        self.db = db
+        self.bots = {} # userId: (elo, id of its latest HistoricalBots row)
+        self._pending = {} # Changes to bots, kept until committed()
+
+    def register(self, game):
+        """ Write whatever is new about the bots of game, and return the id of
+        the HistoricalBots row describing each hero, in hero order (None for
+        heroes without a userId, such as training bots). Call committed()
+        once the transaction is committed, or rolledBack() if it is rolled
+        back. """
+        heroes = {hero.userId: hero for hero in game.heroes if hero.userId is not None and hero.elo is not None}
+        changed = sorted(user_id for user_id, hero in heroes.items() \
+            if self._pending.get(user_id, self.bots.get(user_id, (None,)))[0] != hero.elo)
+        if changed:
+            # The update always applies, so that every row is returned, locked
+            # and with its current latestHistoricalBotId.
+            latest = execute_values(self.db,
+                "INSERT INTO Bots AS b (userId, name, elo) "
+                "VALUES %s "
+                "ON CONFLICT (userId) DO UPDATE "
+                "    SET elo = EXCLUDED.elo "
+                "RETURNING b.userId, b.latestHistoricalBotId, b.latestHistoricalElo;",
+                [(user_id, heroes[user_id].name, heroes[user_id].elo) for user_id in changed], fetch=True)
+            new_history = []
+            for user_id, latest_id, latest_elo in sorted(latest):
+                if latest_id is not None and latest_elo == heroes[user_id].elo:
+                    self._pending[user_id] = (latest_elo, latest_id)
+                else:
+                    new_history.append((user_id, game.gameId, heroes[user_id].elo, latest_id))
+            if new_history:
+                rows = execute_values(self.db,
+                    "INSERT INTO HistoricalBots (userId, lastGameId, elo, previousHistoricalBotId) "
+                    "VALUES %s "
+                    "RETURNING userId, id, elo;",
+                    new_history, fetch=True)
+                execute_values(self.db,
+                    "UPDATE Bots "
+                    "    SET latestHistoricalBotId = latest.id, latestHistoricalElo = latest.elo "
+                    "FROM (VALUES %s) AS latest(userId, id, elo) "
+                    "WHERE Bots.userId = latest.userId;",
+                    rows)
+                for user_id, history_id, elo in rows:
+                    self._pending[user_id] = (heroes[user_id].elo, history_id)
+        return [self._historyId(hero.userId) if hero.userId in heroes else None for hero in game.heroes]
+
+    def committed(self):
+        """ Remember the changes of register() since the last commit, now
+        committed. """
+        self.bots.update(self._pending)
+        self._pending = {}
+
+    def rolledBack(self):
+        """ Forget the changes of register() since the last commit. """
+        self._pending = {}
+
+    @staticmethod
+    def saveBots(db, user_ids):
+        """ Return the state of the bots user_ids, for restoreBots. """
+        db.execute(
+            "SELECT userId, elo, latestHistoricalBotId, latestHistoricalElo "
+            "FROM Bots "
+            "WHERE userId = ANY(%s);",
+            (list(user_ids),))
+        return list(user_ids), db.fetchall()
+
+    @staticmethod
+    def restoreBots(db, saved, game_ids):
+        """ Undo what registering the bots of game_ids did, for benchmarks
+        and load tests that delete the games they inserted. saved: the
+        result of saveBots before the games were inserted. The bots get back
+        their Elo and chain head, the HistoricalBots rows added for the
+        games are deleted, and bots first seen in them are deleted along
+        with their statistics rollups. Call it once the games' Heroes are
+        deleted and before their Games rows are.
+
+        The rollups of the other bots are not restored, and registries that
+        are still running keep the deleted rows in their caches, so only use
+        this on a database that nothing else writes to. """
+        user_ids, rows = saved
+        if rows:
+            execute_values(db,
+                "UPDATE Bots "
+                "    SET elo = saved.elo, latestHistoricalBotId = saved.latestId::INT, "
+                "        latestHistoricalElo = saved.latestElo::INT "
+                "FROM (VALUES %s) AS saved(userId, elo, latestId, latestElo) "
+                "WHERE Bots.userId = saved.userId;",
+                rows)
+        db.execute("DELETE FROM HistoricalBots WHERE lastGameId = ANY(%s);", (list(game_ids),))
+        new_user_ids = sorted(set(user_ids) - set(row[0] for row in rows))
+        if new_user_ids:
+            for table in ("BotStats", "BotMapStats", "BotEloStats", "Bots"):
+                db.execute("DELETE FROM " + table + " WHERE userId = ANY(%s);", (new_user_ids,))
+
+    def _historyId(self, user_id):
+        if user_id in self._pending:
+            return self._pending[user_id][1]
+        return self.bots[user_id][1]
@@ -0,0 +1,127 @@
+import sys
+sys.path.insert(0, "../game")
+
+import argparse
+import json
+import logging as _logging
+
+import psycopg2 as psycopg
+
+from ArchiveExporter import ArchiveExporter
+from events import gameEvents
+from Inserter import Inserter
+from stats import gameStats
+
+class BotStats():
+    """ Queries the BotStats, BotMapStats and BotEloStats rollups, which
+    Inserter keeps up to date as games finish. Every query reads a handful
+    of rollup rows, however many games have been inserted.
+
+    Statistics are returned as dicts with the rollup's sums (see
+    Inserter.BOT_STAT_COLUMNS) and these averages: winRate, deathsPerGame,
+    killsPerGame, crashRate, averageGold, averageMineCount,
+    averageLifespan (None for bots that never died) and goldCurve, the
+    average gold at each tenth of a game. """
+
+    def __init__(self, database_name, database_user, logger=_logging.getLogger("BotStats")):
+        self.database_name = database_name
+        self.database_user = database_user
+        self.connection = psycopg.connect("dbname=" + database_name + " user=" + database_user)
+        self.db = self.connection.cursor()
+        self.logger = logger
+
+    def bot(self, user_id):
+        """ Statistics of one bot over all of its games, or None. """
+        rows = self._select("BotStats", None, "userId = %s", (user_id,))
+        return rows[0][1] if rows else None
+
+    def byMapSize(self, user_id):
+        """ Statistics of one bot per board size, as {size: statistics}. """
+        return dict(self._select("BotMapStats", "size", "userId = %s", (user_id,)))
+
+    def byEloBucket(self, user_id):
+        """ Statistics of one bot per Elo range, as {lowest elo of the range:
+        statistics}. """
+        return dict(self._select("BotEloStats", "eloBucket", "userId = %s", (user_id,)))
+
+    def leaderboard(self, order_by="winRate", min_games=20, limit=20):
+        """ The bots with at least min_games games, best first by the given
+        average, as a list of (userId, statistics). """
+        rows = self._select("BotStats", "userId", "games >= %s", (min_games,))
+        rows = [row for row in rows if row[1][order_by] is not None]
+        rows.sort(key=lambda row: row[1][order_by], reverse=True)
+        return rows[:limit]
+
+    def _select(self, table, key_column, condition, parameters):
+        self.db.execute(
+            "SELECT " + (key_column + ", " if key_column else "NULL, ") \
+            + ", ".join(Inserter.BOT_STAT_COLUMNS) + " "
+            "FROM " + table + " "
+            "WHERE " + condition + ";",
+            parameters)
+        rows = [(row[0], BotStats._statistics(row[1:])) for row in self.db.fetchall()]
+        self.connection.commit()
+        return rows
+
+    @staticmethod
+    def _statistics(values):
+        sums = dict(zip(Inserter.BOT_STAT_COLUMNS, values))
+        games = sums["games"]
+        return dict(sums, winRate=sums["wins"] / games, deathsPerGame=sums["deaths"] / games, \
+            killsPerGame=sums["kills"] / games, crashRate=sums["crashes"] / games, \
+            averageGold=sums["gold"] / games, averageMineCount=sums["mineCount"] / games, \
+            averageLifespan=sums["lifespanTurns"] / sums["deaths"] if sums["deaths"] else None, \
+            goldCurve=[gold / games for gold in sums["goldCurve"]])
+
+    def rebuild(self, log_every=100):
+        """ Recompute the rollups from every finished game in the database,
+        for example after loading games with something other than Inserter.
+        Games whose turns Partitions.py dropped cannot be recomputed, and are
+        left out of the new rollups. Returns the number of games folded in. """
+        inserter = Inserter(self.database_name, self.database_user, self.logger)
+        inserter.db.execute("TRUNCATE BotStats, BotMapStats, BotEloStats;")
+        inserter.db.execute("SELECT gameId FROM Games WHERE finished AND NOT turnsDropped ORDER BY gameId;")
+        game_ids = [row[0] for row in inserter.db.fetchall()]
+        for index, game_id in enumerate(game_ids, 1):
+            writer = ArchiveExporter.readGame(inserter.db, game_id, inserter.map_store)
+            arrays = writer.arrays()
+            if len(arrays["turn"]) == 0:
+                continue
+            # Taverns are only known for games with a map, and only tavern
+            # visits need them.
+            events = gameEvents(arrays, [tuple(loc) for loc in writer.meta["taverns"]])
+            bots = [(hero["userId"], hero["elo"]) for hero in writer.meta["heroes"]]
+            inserter._foldBotStats(Inserter._botStatRows(writer.meta["size"], bots, gameStats(arrays, events)))
+            if index % log_every == 0:
+                self.logger.info("Folded " + str(index) + " of " + str(len(game_ids)) + " games.")
+        inserter.connection.commit()
+        return len(game_ids)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Query or rebuild the per-bot statistics rollups.")
+    parser.add_argument("database_name")
+    parser.add_argument("database_user")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    subparsers.add_parser("rebuild", help="Recompute the rollups from every finished game.")
+    bot_parser = subparsers.add_parser("bot", help="Print a bot's statistics as JSON.")
+    bot_parser.add_argument("user_id")
+    leaderboard_parser = subparsers.add_parser("leaderboard", help="Print the best bots as JSON.")
+    leaderboard_parser.add_argument("--order-by", default="winRate")
+    leaderboard_parser.add_argument("--min-games", type=int, default=20)
+    leaderboard_parser.add_argument("--limit", type=int, default=20)
+    args = parser.parse_args()
+
+    logger = _logging.getLogger("BotStats")
+    stdout_handler = _logging.StreamHandler(sys.stdout)
+    stdout_handler.setFormatter(_logging.Formatter("%(levelname)s: %(message)s"))
+    logger.addHandler(stdout_handler)
+    logger.setLevel(_logging.INFO)
+
+    bot_stats = BotStats(args.database_name, args.database_user, logger)
+    if args.command == "rebuild":
+        logger.info("Rebuilt the rollups from " + str(bot_stats.rebuild()) + " games.")
+    elif args.command == "bot":
+        print(json.dumps({"all": bot_stats.bot(args.user_id), "bySize": bot_stats.byMapSize(args.user_id), \
+            "byElo": bot_stats.byEloBucket(args.user_id)}, indent=2))
+    else:
+        print(json.dumps(bot_stats.leaderboard(args.order_by, args.min_games, args.limit), indent=2))
@@ -0,0 +1,120 @@
+import io
+import logging as _logging
+
+from Inserter import Inserter
+from Metrics import metrics
+
+class BulkInserter(Inserter):
+    """ Inserter that buffers turns in memory and loads them with COPY
+    instead of issuing one INSERT per turn, hero and mine span.
+
+    Row ids are reserved from the tables' sequences in blocks, so the
+    Heroes.turnId foreign keys can be filled in before the rows reach the
+    database. Ids skipped by an unfinished block are simply never used, as
+    happens with any sequence. """
+
+    def __init__(self, database_name="vindinium", database_user="postgres", \
+        logger=_logging.getLogger("BulkInserter"), flush_turns=None, id_block_size=1024):
+        """ flush_turns: Number of buffered turns after which the buffer is
+        written out and committed. None buffers the whole game.
+
+        id_block_size: Number of ids reserved from a sequence at a time. """
+        super().__init__(database_name, database_user, logger)
+        self.flush_turns = flush_turns
+        self.id_block_size = id_block_size
+        self._id_blocks = {"Turns": [], "Heroes": []}
+        self._turn_rows = []
+        self._hero_rows = []
+        self._span_rows = {} # (gameId, mineNumber, fromTurn): buffered MineSpans row
+        self._closed_spans = [] # Spans closed since the last flush, opened before it
+        self._arrivals = [] # (gameId, arrival) of the buffered turns
+
+    def _writeTurn(self, game_id, turn, hero_rows, mine_rows, arrival=None):
+        self.uncommitted_games.add(game_id)
+        turn_id = self._nextId("Turns")
+        self._turn_rows.append((turn_id, game_id, turn))
+        game_time = self._gameTime(game_id)
+        for hero_row in hero_rows:
+            self._hero_rows.append((self._nextId("Heroes"), turn_id, game_time) + hero_row)
+        closed_spans, opened_spans = self._mineSpanChanges(game_id, turn, mine_rows)
+        for closed_span in closed_spans:
+            span_row = self._span_rows.get(closed_span[:3])
+            if span_row is not None:
+                self._span_rows[closed_span[:3]] = span_row[:5] + (closed_span[3],) + span_row[6:]
+            else:
+                self._closed_spans.append(closed_span)
+        for span_row in opened_spans:
+            self._span_rows[(span_row[0], span_row[1], span_row[4])] = span_row
+        if arrival is not None:
+            self._arrivals.append((game_id, arrival))
+
+    def _commitTurn(self):
+        if self.flush_turns is not None and len(self._turn_rows) >= self.flush_turns:
+            self._flush()
+            self._commit()
+
+    def _flush(self):
+        """ COPY all buffered rows to the database, parents first. Does not
+        commit. """
+        if len(self._turn_rows) == 0:
+            return
+        with metrics.time("write_seconds"):
+            self._copy("Turns", ("id", "gameId", "turn"), self._turn_rows)
+            self._copy("Heroes", ("id", "turnId", "gameTime") + Inserter.HERO_COLUMNS, self._hero_rows)
+            self._copy("MineSpans", ("gameId", "mineNumber", "pos", "inGameId", "fromTurn", "toTurn", \
+                "gameTime"), self._span_rows.values())
+            self._closeMineSpansInDB(self._closed_spans)
+        self.logger.debug("Copied " + str(len(self._turn_rows)) + " turns to database.")
+        self.pending_arrivals.extend(self._arrivals)
+        self._turn_rows = []
+        self._hero_rows = []
+        self._span_rows = {}
+        self._closed_spans = []
+        self._arrivals = []
+
+    def bufferedGames(self):
+        return set(row[1] for row in self._turn_rows) | set(key[0] for key in self._span_rows) \
+            | set(span[0] for span in self._closed_spans)
+
+    def _forgetGames(self, game_ids):
+        """ Also drop the buffered rows of game_ids. A failed COPY leaves the
+        buffers as they were, so they would otherwise be sent again. """
+        super()._forgetGames(game_ids)
+        self._turn_rows = [row for row in self._turn_rows if row[1] not in game_ids]
+        self._hero_rows = [row for row in self._hero_rows if row[4] not in game_ids]
+        self._span_rows = {key: row for key, row in self._span_rows.items() if key[0] not in game_ids}
+        self._closed_spans = [span for span in self._closed_spans if span[0] not in game_ids]
+        self._arrivals = [(game_id, arrival) for game_id, arrival in self._arrivals if game_id not in game_ids]
+
+    def _copy(self, table, columns, rows):
+        data = io.StringIO()
+        for row in rows:
+            data.write("\t".join(map(BulkInserter._copyValue, row)))
+            data.write("\n")
+        data.seek(0)
+        self.db.copy_expert("COPY " + table + " (" + ", ".join(columns) + ") FROM STDIN;", data)
+
+    def _nextId(self, table):
+        block = self._id_blocks[table]
+        if len(block) == 0:
+            self.db.execute(
+                "SELECT nextval(pg_get_serial_sequence(%s, 'id')) "
+                "FROM generate_series(1, %s);",
+                (table.lower(), self.id_block_size))
+            # Reversed so that ids are handed out in increasing order by pop()
+            block.extend(sorted((row[0] for row in self.db.fetchall()), reverse=True))
+        return block.pop()
+
+    @staticmethod
+    def _copyValue(value):
+        """ Format value in COPY's text format. """
+        if value is None:
+            return "\\N"
+        if isinstance(value, bool):
+            return "t" if value else "f"
+        if isinstance(value, (list, tuple)):
+            return "{" + ",".join(map(str, value)) + "}"
+        if isinstance(value, str):
+            return value.replace("\\", "\\\\").replace("\t", "\\t") \
+                .replace("\n", "\\n").replace("\r", "\\r")
+        return str(value)
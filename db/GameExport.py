@@ -0,0 +1,208 @@
+import sys
+sys.path.insert(0, "../game")
+
+import argparse
+import gzip
+import itertools
+import json
+import logging as _logging
+import os
+
+import psycopg2 as psycopg
+
+from ArchiveExporter import ArchiveExporter
+from Backfill import Backfill, logFiles
+from BulkInserter import BulkInserter
+from game import Tile
+from Inserter import Inserter
+from MapStore import MapStore
+
+FILE_PATTERN = "games-%06d.log.gz"
+
+# Tile strings of the terrain, by Tile type. Heroes and mine owners are
+# filled in per turn.
+_TILE_STRINGS = {Tile.AIR: "  ", Tile.WALL: "##", Tile.TAVERN: "[]", Tile.MINE: "$-"}
+
+class GameExport():
+    """ Writes games from the database as replay files: gzipped logs of the
+    turn strings the server sent, rebuilt from Games, Maps, Turns, Heroes,
+    MineSpans and the bots' Elo in each game. Backfill reads them like any
+    recorded log, so importing them into another database runs every turn
+    through Inserter (or BulkInserter) again, in parallel.
+
+    Rows are read through a server-side cursor and each game is written as
+    it is read, so memory use does not grow with the number of games. Files
+    hold whole games, games_per_file of them each, and only get their final
+    name once complete.
+
+    Games.time, Turns and Heroes ids and the HistoricalBots chain are not
+    carried over; the importing database assigns its own. The server's
+    maxTurns is not stored either, and is written as the game's last turn.
+    Games inserted before Maps existed have no terrain and are skipped. """
+
+    def __init__(self, database_name, database_user, logger=_logging.getLogger("GameExport"), \
+        games_per_file=1000, fetch_rows=20000):
+        self.database_name = database_name
+        self.database_user = database_user
+        self.logger = logger
+        self.games_per_file = games_per_file
+        self.fetch_rows = fetch_rows # Rows fetched from the server-side cursor at a time
+
+    def exportGames(self, directory, game_ids=None):
+        """ Write the given games, or every game, to replay files in
+        directory. Returns (games written, games skipped). """
+        os.makedirs(directory, exist_ok=True)
+        connection = psycopg.connect("dbname=" + self.database_name + " user=" + self.database_user)
+        lookup = connection.cursor()
+        map_store = MapStore(lookup)
+        rows = connection.cursor(name="game_export")
+        rows.itersize = self.fetch_rows
+        rows.execute(
+            "SELECT t.gameId, t.turn, h.inGameId, h.userId, h.life, h.gold, h.mineCount, h.pos, "
+            "    h.spawnPos, h.lastDir, h.crashed "
+            "FROM Turns t JOIN Heroes h ON h.turnId = t.id "
+            + ("WHERE t.gameId = ANY(%s) " if game_ids is not None else "") +
+            "ORDER BY t.gameId, t.turn, h.inGameId;",
+            (list(game_ids),) if game_ids is not None else None)
+
+        written = skipped = 0
+        replay_file = None # (file, temporary path, final path)
+        for game_id, game_rows in itertools.groupby(rows, lambda row: row[0]):
+            game = GameExport._readGame(lookup, game_id, map_store)
+            if game is None:
+                self.logger.warning("Skipping " + game_id + ", which has no map.")
+                skipped += 1
+                continue
+            if replay_file is None or written % self.games_per_file == 0:
+                if replay_file is not None:
+                    GameExport._closeFile(*replay_file)
+                replay_file = GameExport._openFile(directory, written // self.games_per_file)
+            for turn, turn_rows in itertools.groupby(game_rows, lambda row: row[1]):
+                replay_file[0].write(game.turnString(turn, list(turn_rows)) + "\n")
+            written += 1
+            self.logger.debug("Exported " + game_id + ".")
+        if replay_file is not None:
+            GameExport._closeFile(*replay_file)
+        rows.close()
+        connection.close()
+        return written, skipped
+
+    @staticmethod
+    def _readGame(db, game_id, map_store):
+        db.execute(
+            "SELECT g.size, g.finished, g.mapHash, (SELECT max(turn) FROM Turns WHERE gameId = g.gameId) "
+            "FROM Games g "
+            "WHERE g.gameId = %s;",
+            (game_id,))
+        size, finished, map_hash, last_turn = db.fetchone()
+        game_map = map_store.byHash(map_hash) if map_hash is not None else None
+        if game_map is None:
+            return None
+        db.execute(
+            "SELECT pos, inGameId, fromTurn "
+            "FROM MineSpans "
+            "WHERE gameId = %s "
+            "ORDER BY fromTurn;",
+            (game_id,))
+        spans = db.fetchall()
+        return ReplayGame(game_id, game_map.terrain, finished, last_turn, \
+            ArchiveExporter.gameBots(db, game_id), spans)
+
+    @staticmethod
+    def _openFile(directory, number):
+        # Hidden until complete, so that *.log.gz only matches whole files
+        temporary_path = os.path.join(directory, "." + FILE_PATTERN % number + ".tmp")
+        return gzip.open(temporary_path, "wt"), temporary_path, os.path.join(directory, FILE_PATTERN % number)
+
+    @staticmethod
+    def _closeFile(replay_file, temporary_path, path):
+        replay_file.close()
+        os.replace(temporary_path, path)
+
+    @staticmethod
+    def importFiles(database_name, database_user, directory, processes=None, bulk=False, \
+        logger=_logging.getLogger("GameExport")):
+        """ Insert the replay files in directory with Backfill. Returns (games
+        inserted, games skipped as already inserted). """
+        inserter_class = BulkInserter if bulk else Inserter
+        return Backfill(database_name, database_user, logger, inserter_class) \
+            .run(logFiles([os.path.join(directory, "*.log.gz")]), processes)
+
+class ReplayGame():
+    """ Rebuilds the turn strings of one exported game from its rows. """
+
+    def __init__(self, game_id, terrain, finished, last_turn, bots, spans):
+        """ terrain: the static terrain of the game's map. bots: {userId:
+        (name, elo)}. spans: (pos, inGameId, fromTurn) of every MineSpans row
+        of the game, by fromTurn. """
+        self.game_id = game_id
+        self.size = len(terrain)
+        self.finished = finished
+        self.last_turn = last_turn
+        self.bots = bots
+        self.spans = spans
+        self.next_span = 0
+        # Tile strings in the server's order, one row per y value
+        self.tiles = [_TILE_STRINGS[int(terrain[x][y])] for y in range(self.size) for x in range(self.size)]
+
+    def turnString(self, turn, hero_rows):
+        """ Return the turn string of turn, given its Heroes rows (inGameId,
+        userId, life, gold, mineCount, pos, spawnPos, lastDir, crashed, after
+        gameId and turn) in inGameId order. Turns must come in order. """
+        size = self.size
+        while self.next_span < len(self.spans) and self.spans[self.next_span][2] <= turn:
+            (x, y), owner, from_turn = self.spans[self.next_span]
+            self.tiles[y * size + x] = "$" + (str(owner) if owner is not None else "-")
+            self.next_span += 1
+        tiles = list(self.tiles)
+        heroes = []
+        for game_id, row_turn, hero_id, user_id, life, gold, mine_count, pos, spawn_pos, last_dir, crashed \
+            in hero_rows:
+            tiles[pos[1] * size + pos[0]] = "@" + str(hero_id)
+            name, elo = self.bots.get(user_id, (None, None))
+            # Hero.pos swaps the server's x and y
+            hero = {"id": hero_id, "name": name, "userId": user_id, "elo": elo, \
+                "pos": {"x": pos[1], "y": pos[0]}}
+            if last_dir is not None:
+                hero["lastDir"] = last_dir
+            hero.update({"life": life, "gold": gold, "mineCount": mine_count, \
+                "spawnPos": {"x": spawn_pos[1], "y": spawn_pos[0]}, "crashed": crashed})
+            heroes.append(hero)
+        return json.dumps({"id": self.game_id, "turn": turn, "maxTurns": self.last_turn, "heroes": heroes, \
+            "board": {"size": size, "tiles": "".join(tiles)}, \
+            "finished": self.finished and turn == self.last_turn}, separators=(",", ":"))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export games from Postgres as gzipped replay files, or import "
+        "replay files into another database through Inserter.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    export_parser = subparsers.add_parser("export", help="Write games to replay files.")
+    export_parser.add_argument("--games", nargs="+", default=None, help="Only export these games.")
+    export_parser.add_argument("--games-per-file", type=int, default=1000)
+    import_parser = subparsers.add_parser("import", help="Insert replay files, resuming an interrupted import.")
+    import_parser.add_argument("--processes", type=int, default=None, \
+        help="Number of files to insert in parallel (default: one per CPU).")
+    import_parser.add_argument("--bulk", action="store_true", \
+        help="Load each game with COPY instead of one INSERT per row.")
+    for subparser in (export_parser, import_parser):
+        subparser.add_argument("database_name")
+        subparser.add_argument("database_user")
+        subparser.add_argument("directory", help="Directory of replay files.")
+        subparser.add_argument("--logging-level", default="info", type=str.lower, \
+            choices=["debug", "info", "warn", "error", "critical"])
+    args = parser.parse_args()
+
+    logger = _logging.getLogger("GameExport")
+    stdout_handler = _logging.StreamHandler(sys.stdout)
+    stdout_handler.setFormatter(_logging.Formatter("%(levelname)s: %(message)s"))
+    logger.addHandler(stdout_handler)
+    logger.setLevel(getattr(_logging, args.logging_level.upper()))
+
+    if args.command == "export":
+        written, skipped = GameExport(args.database_name, args.database_user, logger, args.games_per_file) \
+            .exportGames(args.directory, args.games)
+        logger.info("Exported " + str(written) + " games, skipped " + str(skipped) + " without a map.")
+    else:
+        inserted, skipped = GameExport.importFiles(args.database_name, args.database_user, args.directory, \
+            args.processes, args.bulk, logger)
+        logger.info("Inserted " + str(inserted) + " games, skipped " + str(skipped) + " already inserted.")
@@ -0,0 +1,132 @@
+import logging as _logging
+import time
+from collections import OrderedDict
+
+class ExpiringSet():
+    """ Set of ids that forgets an id ttl seconds after it was last added,
+    and its oldest ids beyond max_size. """
+
+    def __init__(self, ttl=3600, max_size=100000):
+        self.ttl = ttl
+        self.max_size = max_size
+        self._added = OrderedDict() # id: time last added, least recently added first
+
+    def add(self, item):
+        self._added.pop(item, None)
+        self._added[item] = time.monotonic()
+        self.expire()
+
+    def expire(self):
+        deadline = time.monotonic() - self.ttl
+        while self._added and (len(self._added) > self.max_size or next(iter(self._added.values())) < deadline):
+            self._added.popitem(last=False)
+
+    def __contains__(self, item):
+        added = self._added.get(item)
+        return added is not None and added >= time.monotonic() - self.ttl
+
+    def __len__(self):
+        return len(self._added)
+
+class GameScheduler():
+    """ Decides which of the games seen on /now-playing are streamed, and
+    when.
+
+    At most max_games games are streamed at once. New games wait in a
+    pending list, and whenever a stream slot is free the next one is picked
+    by the priority policy: "newest" favours the games that appeared last,
+    i.e. those just starting, whose every turn can still be streamed;
+    "oldest" takes them in the order they appeared. priority can also be a
+    function of (gameId, time first seen) returning a sort key, highest
+    first. A game that waited more than max_wait seconds is dropped, since
+    most of it would be missed anyway.
+
+    No game is started while the writer_pool has more than max_queue_depth
+    items queued, so that streaming slows down when the database writers
+    fall behind. """
+
+    def __init__(self, start_game, max_games=32, priority="newest", max_wait=120, \
+        writer_pool=None, max_queue_depth=None, seen_ttl=3600, max_seen=100000, \
+        logger=_logging.getLogger("GameScheduler")):
+        """ start_game: Function starting the stream of a game id, returning
+        its Process.
+
+        seen_ttl, max_seen: How long, and how many, game ids are remembered
+        after they were last listed on /now-playing, so that they are not
+        streamed twice. """
+        if priority == "newest":
+            priority = lambda game_id, first_seen: first_seen
+        elif priority == "oldest":
+            priority = lambda game_id, first_seen: -first_seen
+        self.start_game = start_game
+        self.max_games = max_games
+        self.priority = priority
+        self.max_wait = max_wait
+        self.writer_pool = writer_pool
+        self.max_queue_depth = max_queue_depth
+        self.logger = logger
+        self.seen = ExpiringSet(seen_ttl, max_seen)
+        self.pending = {} # gameId: time first seen
+        self.running = {} # gameId: Process
+        self.backpressured = False
+
+    def offer(self, game_ids):
+        """ Add the games of one /now-playing update that were not seen
+        before, and start as many waiting games as allowed. """
+        now = time.monotonic()
+        for game_id in game_ids:
+            if game_id not in self.seen and game_id not in self.running:
+                self.pending.setdefault(game_id, now)
+            self.seen.add(game_id)
+        self.schedule()
+
+    def schedule(self):
+        """ Reap finished streams, drop games that waited too long, then
+        start waiting games while there are free slots and no backpressure. """
+        self.reap()
+        if self.max_wait is not None:
+            deadline = time.monotonic() - self.max_wait
+            expired = [game_id for game_id, first_seen in self.pending.items() if first_seen < deadline]
+            for game_id in expired:
+                del self.pending[game_id]
+            if expired:
+                self.logger.warning("Dropped " + str(len(expired)) + " games that waited more than " \
+                    + str(self.max_wait) + " seconds to be streamed.")
+        if not self.pending or len(self.running) >= self.max_games or self._isBackpressured():
+            return
+        waiting = sorted(self.pending, key=lambda game_id: self.priority(game_id, self.pending[game_id]), \
+            reverse=True)
+        for game_id in waiting[:self.max_games - len(self.running)]:
+            del self.pending[game_id]
+            self.running[game_id] = self.start_game(game_id)
+
+    def reap(self):
+        """ Join the processes of the games that finished streaming. """
+        for game_id, process in list(self.running.items()):
+            if not process.is_alive():
+                process.join()
+                if process.exitcode != 0:
+                    self.logger.warning("Stream of game " + game_id + " exited with code " \
+                        + str(process.exitcode) + ".")
+                process.close()
+                del self.running[game_id]
+
+    def wait(self, interval=1.0):
+        """ Keep scheduling until every waiting game has been streamed or
+        dropped. """
+        while self.pending or self.running:
+            time.sleep(interval)
+            self.schedule()
+
+    def _isBackpressured(self):
+        if self.writer_pool is None or self.max_queue_depth is None:
+            return False
+        backpressured = self.writer_pool.queueDepth() > self.max_queue_depth
+        if backpressured != self.backpressured:
+            if backpressured:
+                self.logger.warning("Writer queues are over " + str(self.max_queue_depth) \
+                    + " items; not starting new games.")
+            else:
+                self.logger.info("Writer queues caught up; starting new games again.")
+            self.backpressured = backpressured
+        return backpressured
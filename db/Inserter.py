@@ -1,66 +1,350 @@
 import sys
 sys.path.insert(0, "../game")
 
-import ast
 import datetime
+import json
 import logging as _logging
+import time
 import numpy as np
 import psycopg2 as psycopg
-from multiprocessing import Lock
-from psycopg2.extras import Json
+from psycopg2.extras import Json, execute_values
 
+from archive import GameArchiveWriter
+from BotRegistry import BotRegistry
+from events import eventRows, gameEvents
 from game import Game
+from MapStore import MapStore
+from Metrics import metrics
+from stats import gameStats
 
 class Inserter():
-    insert_user_lock = Lock()
+    # Columns of a row of Heroes as built by _heroRow, in order. The id, turnId
+    # and gameTime columns are filled in when the row is written.
+    HERO_COLUMNS = ("userId", "gameId", "inGameId", "life", "gold", "mineCount", \
+        "died", "pos", "spawnPos", "lastDir", "crashed", "heroDistances", \
+        "heroObstructedDistances", "tavernDistances", "tavernObstructedDistances", \
+        "mineDistances", "mineObstructedDistances")
+    
+    UNREACHABLE = 2**31-1 # Distance stored for unreachable targets
+    
+    # Columns of the BotStats, BotMapStats and BotEloStats rollups after their
+    # keys, as built by _botStatRows. Each is a sum over the bot's games.
+    BOT_STAT_COLUMNS = ("games", "wins", "deaths", "kills", "crashes", "gold", "mineCount", \
+        "lifespanTurns", "minesCaptured", "goldCurve")
+    ELO_BUCKET = 100 # Width of the Elo ranges of BotEloStats
     
     def __init__(self, database_name="vindinium", database_user="postgres", logger=_logging.getLogger("Inserter")):
         self.connection = psycopg.connect("dbname=" + database_name + " user=" + database_user)
         self.db = self.connection.cursor()
         self.logger = logger
+        self.map_store = MapStore(self.db)
+        self.game_map = None # GameMap of the last turn inserted
+        self.game_columns = {} # gameId: GameArchiveWriter, for the Events of each game
+        self.mine_spans = {} # gameId: state of the game's open MineSpans, see _mineSpanChanges
+        self.game_times = {} # gameId: Games.time, which Heroes and MineSpans are partitioned by
+        self.pending_arrivals = [] # (gameId, arrival time) of the turns written since the last commit
+        self.turn_lags = {} # gameId: lag of the game's last committed turn, for turn_lag_max_seconds
+        self.finished_games = set() # Games finished since the last commit
+        self.uncommitted_games = set() # Games with rows written since the last commit, see rollback
+        self.defer_commits = False # True while the caller commits, as WriterPool does per batch
+        self.bot_registry = BotRegistry(self.db)
     
-    def insertGame(self, game_strings):
+    def insertGame(self, game_strings, insert_game_row=True):
         """ game_strings : list of strings, each of which represents one turn
-        of the same game. game_strings can also be a generator. """
+        of the same game. game_strings can also be a generator.
+        
+        insert_game_row: If False, the game's Games row (and its bots) must
+        already exist, and only its turns are inserted. """
         
+        game = None
         for index, turn_string in enumerate(game_strings):
-            if index == 0:
+            arrival = time.time()
+            if index == 0 and insert_game_row:
                 self._insertGame(turn_string)
-                game = None
             
             turn_string = turn_string.rstrip("\n").rstrip("\r")
             if len(turn_string) > 0:
-                game = self.insertTurn(turn_string, game)
-                self.connection.commit()
+                game = self.insertTurn(turn_string, game, arrival)
+                self._commitTurn()
         
-        """ game.finished should always be true at this point, but in case of 
-        any unexpected errors we check anyway. Worst case, we never set
-        Games.finished to true in the DB and our queries will just ignore this
-        game. """
-        if game.finished:
-            self._setGameFinished(game)
-        self.connection.commit()
-    
-    def insertTurn(self, turn_string, old_game):
-        """ Insert turn represented by turn_string into database. """
+        if game is not None:
+            self._finishGame(game)
+    
+    def insertTurn(self, turn_string, old_game, arrival=None):
+        """ Insert turn represented by turn_string into database. arrival:
+        time.time() when turn_string was received, for the turn lag metric. """
         
-        state = Inserter._parseJson(turn_string)
-        game = Game(state, False)
+        game = self.buildTurn(turn_string, old_game)
+        with metrics.time("distances_seconds"):
+            if self.game_map is None or not self.game_map.distance_cache.matches(game.board):
+                self.game_map = self.map_store.get(game.board)
+            distances = self.game_map.distance_cache.heroDistances(game, fill_value=Inserter.UNREACHABLE)
+        self._insertBuiltTurn(game, distances, old_game, arrival)
+        return game
+    
+    def buildTurn(self, turn_string, old_game):
+        """ Parse turn_string into the Game following old_game, or a new Game
+        if old_game is None. """
+        with metrics.time("parse_seconds"):
+            state = Inserter._parseJson(turn_string)
+        with metrics.time("build_seconds"):
+            if old_game is None:
+                return Game(state, False)
+            return old_game.advance(state)
+    
+    def skipTurn(self, turn_string, old_game):
+        """ Like insertTurn, for a turn that is already in the database: only
+        what is remembered between the turns of a game (its columns and open
+        MineSpans) is updated, so that the following turns can be inserted
+        as if this Inserter had inserted the game from its start. """
+        game = self.buildTurn(turn_string, old_game)
+        self._trackTurn(game, old_game)
+        self._mineSpanChanges(game.gameId, game.turn, Inserter._mineRows(game))
+        return game
+    
+    def _insertBuiltTurn(self, game, distances, old_game, arrival=None):
+        """ Insert a turn that has already been parsed into game, with
+        distances as returned by DistanceCache.heroDistances. old_game is the
+        previous turn, or None. arrival: see insertTurn. """
+        self.logger.debug("Game: " + str(game.gameId) + ", Turn: " + str(game.turn))
+        
+        freshly_dead_heroes = self._trackTurn(game, old_game)
+        hero_rows = [Inserter._heroRow(game, hero, hero in freshly_dead_heroes, hero_distances) \
+            for hero, hero_distances in zip(game.heroes, distances)]
+        metrics.inc("turns_total")
+        self._writeTurn(game.gameId, game.turn, hero_rows, Inserter._mineRows(game), arrival)
+    
+    def _trackTurn(self, game, old_game):
+        """ Add game to the columns of its game, and return the heroes that
+        died since old_game. """
         if old_game is None:
             freshly_dead_heroes = []
         else:
             freshly_dead_heroes = Game.getFreshlyDeadHeroes(old_game, game)
-        
-        turn_id = self._insertTurnToDB(game, state)
-        self.logger.debug("Game: " + str(game.gameId) + ", Turn: " + str(game.turn))
-        
-        hero_ids = []
-        for hero in game.heroes:
-            hero_ids.append(self._insertHeroToDB(game, hero, turn_id, hero in freshly_dead_heroes))
-        
-        self._insertMinesToDB(game, turn_id, hero_ids)
-        
-        return game
+        if old_game is None or game.gameId not in self.game_columns:
+            self.game_columns[game.gameId] = GameArchiveWriter()
+        self.game_columns[game.gameId].append(game, freshly_dead_heroes)
+        return freshly_dead_heroes
+    
+    def _finishGame(self, game, event_rows=None, stat_rows=None):
+        """ Called after the last turn of a game, game being that turn.
+        event_rows, stat_rows: the game's Events rows and bot statistics, as
+        returned by _takeGameRows; by default those of the turns this
+        Inserter has seen. """
+        if event_rows is None:
+            event_rows, stat_rows = self._takeGameRows(game)
+        self.uncommitted_games.add(game.gameId)
+        self._flush()
+        with metrics.time("write_seconds"):
+            self._finishMineSpans(game.gameId)
+            self.game_times.pop(game.gameId, None)
+            self._insertEventsToDB(event_rows)
+            """ game.finished should always be true at this point, but in case of 
+            any unexpected errors we check anyway. Worst case, we never set
+            Games.finished to true in the DB and our queries will just ignore this
+            game. """
+            if game.finished:
+                self._setGameFinished(game, stat_rows)
+        self.finished_games.add(game.gameId)
+        self._commit()
+        metrics.inc("games_finished_total")
+    
+    def _writeTurn(self, game_id, turn, hero_rows, mine_rows, arrival=None):
+        """ Write one turn to the database. hero_rows are built by _heroRow
+        and mine_rows by _mineRows. arrival: see insertTurn. """
+        self.uncommitted_games.add(game_id)
+        with metrics.time("write_seconds"):
+            turn_id = self._insertTurnToDB(game_id, turn)
+            game_time = self._gameTime(game_id)
+            for hero_row in hero_rows:
+                self._insertHeroToDB(turn_id, game_time, hero_row)
+            closed_spans, opened_spans = self._mineSpanChanges(game_id, turn, mine_rows)
+            self._closeMineSpansInDB(closed_spans)
+            self._insertMineSpansToDB(opened_spans)
+        if arrival is not None:
+            self.pending_arrivals.append((game_id, arrival))
+    
+    def _commitTurn(self):
+        """ Called after each turn of insertGame. """
+        self._commit()
+    
+    def _commit(self):
+        """ Commit, recording how long it took and the lag of the turns
+        written since the last commit. Does nothing while defer_commits is
+        set. """
+        if self.defer_commits:
+            return
+        with metrics.time("commit_seconds"):
+            self.connection.commit()
+        self.bot_registry.committed()
+        self.map_store.committed()
+        self.uncommitted_games = self.bufferedGames()
+        now = time.time()
+        for game_id, arrival in self.pending_arrivals:
+            metrics.observe("turn_lag_seconds", now - arrival)
+            self.turn_lags[game_id] = now - arrival
+        self.pending_arrivals = []
+        for game_id in self.finished_games:
+            self.turn_lags.pop(game_id, None)
+        self.finished_games = set()
+        self._setTurnLagGauge()
+    
+    def _setTurnLagGauge(self):
+        """ Set turn_lag_max_seconds to the largest lag of the last committed
+        turns of the open games, so that one game falling behind shows even
+        when the lag of most turns is low. """
+        metrics.set("turn_lag_max_seconds", max(self.turn_lags.values(), default=0.0))
+    
+    def rollback(self, game_ids=()):
+        """ Roll back the transaction after an error. The games in game_ids,
+        and every game with rows written since the last commit, lose those
+        rows and are forgotten, so no more of their turns may be written.
+        Returns the ids of those games. """
+        self.connection.rollback()
+        self.bot_registry.rolledBack()
+        self.map_store.rolledBack()
+        self.pending_arrivals = []
+        self.finished_games = set()
+        failed_games = self.uncommitted_games | set(game_ids)
+        self.uncommitted_games = set()
+        self._forgetGames(failed_games)
+        return failed_games
+    
+    def _saveGames(self, game_ids):
+        """ Return what is remembered about the turns of game_ids, for
+        _restoreGames to put back after a rollback. """
+        return {game_id: (self._copySpans(self.mine_spans.get(game_id)), self.game_times.get(game_id)) \
+            for game_id in game_ids}
+    
+    def _restoreGames(self, saved):
+        for game_id, (spans, game_time) in saved.items():
+            for state, value in ((self.mine_spans, self._copySpans(spans)), (self.game_times, game_time)):
+                if value is None:
+                    state.pop(game_id, None)
+                else:
+                    state[game_id] = value
+    
+    @staticmethod
+    def _copySpans(spans):
+        return dict(spans, mines=dict(spans["mines"])) if spans is not None else None
+    
+    def _forgetGames(self, game_ids):
+        """ Drop what is remembered about the turns of game_ids. """
+        for game_id in game_ids:
+            self.game_columns.pop(game_id, None)
+            self.mine_spans.pop(game_id, None)
+            self.game_times.pop(game_id, None)
+            self.turn_lags.pop(game_id, None)
+        self._setTurnLagGauge()
+    
+    def bufferedGames(self):
+        """ Return the ids of the games with turns written but not yet sent
+        to the database; see _flush. """
+        return set()
+    
+    def _flush(self):
+        """ Called once the last turn of insertGame has been inserted, before
+        the game is marked finished. Subclasses that buffer turns must write
+        them out here. """
+        pass
+    
+    def _gameTime(self, game_id):
+        """ Return the Games.time of game_id, remembered from _insertGameToDB
+        or read from the database. """
+        if game_id not in self.game_times:
+            self.db.execute("SELECT time FROM Games WHERE gameId = %s;", (game_id,))
+            self.game_times[game_id] = self.db.fetchone()[0]
+        return self.game_times[game_id]
+    
+    def _mineSpanChanges(self, game_id, turn, mine_rows):
+        """ Compare the owners in mine_rows with the game's open MineSpans.
+        Returns (closed, opened): closed as (gameId, mineNumber, fromTurn,
+        toTurn, gameTime) for each span that ended before turn, and opened as
+        the MineSpans rows (gameId, mineNumber, pos, inGameId, fromTurn,
+        toTurn, gameTime) of the spans that start at turn, with toTurn None
+        while open. """
+        if game_id not in self.mine_spans:
+            self.mine_spans[game_id] = {"turn": turn, "time": self._gameTime(game_id), "mines": {}}
+        spans = self.mine_spans[game_id]
+        spans["turn"] = turn
+        open_spans = spans["mines"]
+        closed = []
+        opened = []
+        for _, mine_number, mine_pos, owner_of_mine in mine_rows:
+            span = open_spans.get(mine_number)
+            if span is not None and span[1] == owner_of_mine:
+                continue
+            if span is not None:
+                closed.append((game_id, mine_number, span[0], turn - 1, spans["time"]))
+            open_spans[mine_number] = (turn, owner_of_mine)
+            opened.append((game_id, mine_number, mine_pos, owner_of_mine, turn, None, spans["time"]))
+        return closed, opened
+    
+    def _finishMineSpans(self, game_id):
+        """ Close the game's open MineSpans at the last turn written. """
+        spans = self.mine_spans.pop(game_id, None)
+        if spans is not None:
+            self.db.execute(
+                "UPDATE MineSpans "
+                "    SET toTurn = %s "
+                "WHERE gameId = %s AND gameTime = %s AND toTurn IS NULL;",
+                (spans["turn"], game_id, spans["time"]))
+    
+    def _takeGameRows(self, game):
+        """ Return the Events rows of game and the rows _botStatRows builds
+        for it, and forget its turns. """
+        columns = self.game_columns.pop(game.gameId, None)
+        if columns is None:
+            return [], []
+        arrays = columns.arrays()
+        events = gameEvents(arrays, game.tavern_locs)
+        return eventRows(game.gameId, events), Inserter._botStatRows(game.board.size, \
+            [(hero.userId, hero.elo) for hero in game.heroes], gameStats(arrays, events))
+    
+    @staticmethod
+    def _botStatRows(size, bots, stats):
+        """ Return (userId, size, eloBucket) + BOT_STAT_COLUMNS values for each
+        hero of a game. bots: (userId, elo) of each hero, in heroId order.
+        stats: as returned by stats.gameStats. """
+        rows = []
+        for index, (user_id, elo) in enumerate(bots):
+            elo_bucket = elo // Inserter.ELO_BUCKET * Inserter.ELO_BUCKET if elo is not None else None
+            rows.append((user_id, size, elo_bucket, 1, int(stats["won"][index]), \
+                int(stats["deaths"][index]), int(stats["kills"][index]), int(stats["crashes"][index]), \
+                int(stats["gold"][index]), int(stats["mineCount"][index]), \
+                int(stats["lifespanTurns"][index]), int(stats["minesCaptured"][index]), \
+                [int(gold) for gold in stats["goldCurve"][index]]))
+        return rows
+    
+    def _foldBotStats(self, stat_rows):
+        """ Add rows built by _botStatRows to the BotStats, BotMapStats and
+        BotEloStats rollups. Rows are summed per key first and written in key
+        order, so concurrent writers lock rollup rows in the same order. """
+        for table, key_columns in (("BotStats", (0,)), ("BotMapStats", (0, 1)), ("BotEloStats", (0, 2))):
+            sums = {}
+            for row in stat_rows:
+                key = tuple(row[column] for column in key_columns)
+                if None in key:
+                    continue
+                values = row[3:]
+                if key in sums:
+                    values = tuple(total + value for total, value in zip(sums[key][:-1], values[:-1])) \
+                        + ([total + value for total, value in zip(sums[key][-1], values[-1])],)
+                sums[key] = values
+            if len(sums) == 0:
+                continue
+            key_names = ("userId", "size", "eloBucket")
+            names = tuple(key_names[column] for column in key_columns) + Inserter.BOT_STAT_COLUMNS
+            updates = ", ".join(name + " = s." + name + " + EXCLUDED." + name \
+                for name in Inserter.BOT_STAT_COLUMNS[:-1])
+            execute_values(self.db,
+                "INSERT INTO " + table + " AS s (" + ", ".join(names) + ") "
+                "VALUES %s "
+                "ON CONFLICT (" + ", ".join(names[:len(key_columns)]) + ") DO UPDATE "
+                "    SET " + updates + ", "
+                "    goldCurve = ARRAY(SELECT a + b FROM unnest(s.goldCurve, EXCLUDED.goldCurve) AS g(a, b));",
+                [key + values for key, values in sorted(sums.items())])
+    
     
     def _insertGame(self, first_turn_string):
         state = Inserter._parseJson(first_turn_string)
@@ -69,84 +353,101 @@ class Inserter():
         
         self._insertGameToDB(game)
         self._insertOrUpdateBots(game)
+        self._commit()
     
     def _insertGameToDB(self, game):
+        self.uncommitted_games.add(game.gameId)
+        self.game_times[game.gameId] = datetime.datetime.now()
+        game_map = self.map_store.get(game.board)
+        self.map_store.store(game_map)
         self.db.execute( \
             "INSERT INTO Games "
-            "    (gameId, time, size, mineCount, finished) "
-            "VALUES (%s, %s, %s, %s, %s);",
-            (game.gameId, datetime.datetime.now(), game.board.size, \
-            len(game.mine_locs), game.finished))
+            "    (gameId, time, size, mineCount, finished, mapHash) "
+            "VALUES (%s, %s, %s, %s, %s, %s);",
+            (game.gameId, self.game_times[game.gameId], game.board.size, \
+            len(game.mine_locs), game.finished, game_map.map_hash))
+        metrics.inc("games_started_total")
     
     def _insertOrUpdateBots(self, game):
-        for hero in game.heroes:
-            hero_dict = {"userId": hero.userId, "name": hero.name, "elo": hero.elo, \
-                "lastGameId": game.gameId}
-            
-            self.db.execute(
-                "UPDATE Bots "
-                "    SET elo = %(elo)s "
-                "WHERE userId = %(userId)s;",
-                hero_dict)
-            
-            # Conditional insert if bot does not exist yet.
-            # This may contain a race condition; see 
-            # http://stackoverflow.com/a/13342031/2491377.
-            # Thus, we wrap a lock around these inserts.
-            try:
-                Inserter.insert_user_lock.acquire()
-                self.db.execute(
-                    "INSERT INTO Bots (userId, name, elo) "
-                    "SELECT %(userId)s, %(name)s, %(elo)s "
-                    "WHERE NOT EXISTS "
-                    "    (SELECT 1 FROM Bots WHERE userId = %(userId)s);",
-                    hero_dict)
-            
-                self.db.execute(
-                    "INSERT INTO HistoricalBots "
-                    "    (userId, lastGameId, elo, previousHistoricalBotId) "
-                    "VALUES (%(userId)s, %(lastGameId)s, %(elo)s, "
-                    "    (SELECT hb.id FROM HistoricalBots hb "
-                    "    LEFT JOIN HistoricalBots hb_later "
-                    "        ON hb_later.userId = hb.userId "
-                    "        AND hb_later.previousHistoricalBotId = hb.id "
-                    "    WHERE hb.userId = %(userId)s "
-                    "        AND hb_later.id IS NULL));",
-                    hero_dict)
-            
-                self.connection.commit()
-            finally:
-                Inserter.insert_user_lock.release()
+        """ Bring the game's bots up to date and record which HistoricalBots
+        rows describe its heroes; see BotRegistry. """
+        historical_bot_ids = self.bot_registry.register(game)
+        self.db.execute(
+            "UPDATE Games "
+            "    SET historicalBotIds = %s "
+            "WHERE gameId = %s;",
+            (historical_bot_ids, game.gameId))
     
     @staticmethod
-    def _parseJson (string):
-        return ast.literal_eval("{\"game\":" + string.replace(":false}", ":False}").replace(":true}", ":True}") + "}")
+    def _parseJson(string):
+        """ Decode one turn of the event stream into the state dict Game
+        expects. Game, Board and Hero read nearly every field the server
+        sends, so the whole object is decoded by the C JSON decoder rather
+        than picking fields out in Python. """
+        return {"game": json.loads(string)}
 
-    def _insertTurnToDB(self, game, state):
+    def _insertTurnToDB(self, game_id, turn):
         self.db.execute(
             "INSERT INTO Turns "
             "    (gameId, turn) "
             "VALUES (%(gameId)s, %(turn)s) "
             "RETURNING id;",
-            {"gameId": game.gameId, "turn": game.turn})
+            {"gameId": game_id, "turn": turn})
         return self.db.fetchone()[0]
     
-    def _setGameFinished(self, game):
+    def _setGameFinished(self, game, stat_rows=()):
+        """ Mark the game finished and fold stat_rows into the bot statistics
+        rollups, unless it was already marked finished (and so folded). """
         self.db.execute(
             "UPDATE GAMES "
             "    SET finished = TRUE "
-            "WHERE gameId = %s;",
+            "WHERE gameId = %s AND NOT finished "
+            "RETURNING gameId;",
             (game.gameId,))
+        if self.db.fetchone() is not None:
+            self._foldBotStats(stat_rows or ())
     
-    def _insertHeroToDB(self, game, hero, turn_id, died):
-        bfs_map = game.board.bfs(hero.pos, False, fill_value=2**31-1)
-        obstructed_bfs_map = game.board.bfs(hero.pos, True, fill_value=2**31-1)
-        
+    @staticmethod
+    def _heroRow(game, hero, died, distances):
+        """ Return the values of hero's Heroes row, in Inserter.HERO_COLUMNS
+        order. distances: the tuple of six distance lists for hero, as
+        returned by DistanceCache.heroDistances. """
+        # The *Distances columns hold the distances that route around other
+        # heroes and the *ObstructedDistances columns those that ignore them,
+        # as they always have; heroDistances returns them the other way round.
+        hero_free, hero_routed, tavern_free, tavern_routed, mine_free, mine_routed = distances
+        return (hero.userId, \
+            game.gameId, \
+            hero.heroId, \
+            hero.health, \
+            hero.gold, \
+            hero.mine_count, \
+            died, \
+            list(hero.pos), \
+            list(hero.spawn_pos), \
+            hero.last_direction, \
+            hero.crashed, \
+            hero_routed, \
+            hero_free, \
+            tavern_routed, \
+            tavern_free, \
+            mine_routed, \
+            mine_free)
+    
+    @staticmethod
+    def _mineRows(game):
+        """ Return (gameId, mineNumber, pos, inGameId of owner or None) for
+        each mine of game. """
+        return [(game.gameId, mine_number+1, list(mine_pos), game.board.tile(mine_pos).heroId) \
+            for mine_number, mine_pos in enumerate(game.mine_locs)]
+    
+    def _insertHeroToDB(self, turn_id, game_time, hero_row):
         self.db.execute( \
             "INSERT INTO Heroes ( "
+            "    turnId, "
+            "    gameTime, "
             "    userId, "
             "    gameId, "
-            "    turnId, "
             "    inGameId, "
             "    life, "
             "    gold, "
@@ -162,39 +463,36 @@ class Inserter():
             "    tavernObstructedDistances, "
             "    mineDistances, "
             "    mineObstructedDistances) "
-            "VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s) "
+            "VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s) "
             "RETURNING id;", \
-            (hero.userId, \
-            game.gameId, \
-            turn_id, \
-            hero.heroId, \
-            hero.health, \
-            hero.gold, \
-            hero.mine_count, \
-            died, \
-            list(hero.pos), \
-            list(hero.spawn_pos), \
-            hero.last_direction, \
-            hero.crashed, \
-            [bfs_map[x][y] for x, y in map(lambda hero : hero.pos, game.heroes)], \
-            [obstructed_bfs_map[x][y] for x, y in map(lambda hero : hero.pos, game.heroes)], \
-            [bfs_map[x][y] for x, y in game.tavern_locs], \
-            [obstructed_bfs_map[x][y] for x, y in game.tavern_locs], \
-            [bfs_map[x][y] for x, y in game.mine_locs], \
-            [obstructed_bfs_map[x][y] for x, y in game.mine_locs]))
+            (turn_id, game_time) + hero_row)
         return self.db.fetchone()[0]
     
-    def _insertMinesToDB(self, game, turn_id, hero_ids):
-        for mine_number, mine_pos in enumerate(game.mine_locs):
-            owner_of_mine = game.board.tile(mine_pos).heroId
-            hero_id = hero_ids[owner_of_mine-1] if owner_of_mine is not None else None
-            
-            self.db.execute(
-                "INSERT INTO Mines "
-                "    (gameId, turnId, mineNumber, pos, heroId) "
-                "VALUES (%(gameId)s, %(turnId)s, %(mineNumber)s, %(pos)s, %(heroId)s);", 
-                {"gameId": game.gameId, "turnId": turn_id, "mineNumber": mine_number+1, \
-                "pos": list(mine_pos), "heroId": hero_id})
+    def _insertMineSpansToDB(self, span_rows):
+        if len(span_rows) > 0:
+            execute_values(self.db,
+                "INSERT INTO MineSpans "
+                "    (gameId, mineNumber, pos, inGameId, fromTurn, toTurn, gameTime) "
+                "VALUES %s;",
+                span_rows)
+    
+    def _closeMineSpansInDB(self, closed_spans):
+        if len(closed_spans) > 0:
+            execute_values(self.db,
+                "UPDATE MineSpans s "
+                "    SET toTurn = closed.toTurn "
+                "FROM (VALUES %s) AS closed (gameId, mineNumber, fromTurn, toTurn, gameTime) "
+                "WHERE s.gameId = closed.gameId AND s.mineNumber = closed.mineNumber "
+                "    AND s.fromTurn = closed.fromTurn AND s.gameTime = closed.gameTime;",
+                closed_spans)
+    
+    def _insertEventsToDB(self, event_rows):
+        if len(event_rows) > 0:
+            execute_values(self.db,
+                "INSERT INTO Events "
+                "    (gameId, turn, kind, inGameId, otherInGameId, mineNumber) "
+                "VALUES %s;",
+                event_rows)
 
 if __name__ == "__main__":
     inserter = Inserter()
@@ -0,0 +1,170 @@
+import sys
+sys.path.insert(0, "../game")
+
+import hashlib
+import zlib
+from collections import OrderedDict
+
+import numpy as np
+import psycopg2 as psycopg
+
+from game import Board, DistanceCache, Tile
+
+class GameMap():
+    """ The static part of a board (walls, taverns and mines, with heroes
+    shown as air) and what is worth computing once per map rather than once
+    per game: the passable mask, the mine and tavern locations, the
+    unobstructed distance fields from every mine and tavern, and a
+    DistanceCache whose memoised fields every game on the map shares.
+
+    map_hash is the hex sha1 of the size and the static terrain, which keys
+    the Maps table. """
+
+    def __init__(self, size, terrain, target_fields=None):
+        """ terrain: (size, size) int8 static terrain, as returned by
+        DistanceCache.staticTerrain. target_fields: the result of
+        targetFields() if already known. """
+        self.size = size
+        self.terrain = terrain
+        self.map_hash = GameMap.hashTerrain(size, terrain)
+        self.board = Board.fromTerrain(terrain)
+        self.passable_mask = self.board.passable_mask
+        self.mine_locs = self.board.locsOfType(Tile.MINE)
+        self.tavern_locs = self.board.locsOfType(Tile.TAVERN)
+        self.distance_cache = DistanceCache(self.board)
+        self._target_fields = target_fields
+        self.stored = False # True once the map is known to be in Maps
+
+    @staticmethod
+    def hashTerrain(size, terrain):
+        return hashlib.sha1(("%d:" % size).encode("ascii") \
+            + np.ascontiguousarray(terrain, dtype=np.int8).tobytes()).hexdigest()
+
+    def targetFields(self):
+        """ Return the unobstructed distance fields from each mine (in
+        mine_locs order) and then each tavern (in tavern_locs order), as a
+        (mines + taverns, size, size) int16 array with -1 for unreachable
+        tiles. """
+        if self._target_fields is None:
+            fields = self.board.distanceFields([[loc] for loc in self.mine_locs + self.tavern_locs])
+            self._target_fields = fields.astype(np.int16)
+            self._target_fields.setflags(write=False)
+        return self._target_fields
+
+    def mineFields(self):
+        return self.targetFields()[:len(self.mine_locs)]
+
+    def tavernFields(self):
+        return self.targetFields()[len(self.mine_locs):]
+
+    def nearestMineField(self):
+        """ Unobstructed distance from each tile to the nearest mine, -1 if
+        none is reachable. """
+        return GameMap._nearest(self.mineFields())
+
+    def nearestTavernField(self):
+        return GameMap._nearest(self.tavernFields())
+
+    @staticmethod
+    def _nearest(fields):
+        if len(fields) == 0:
+            return np.full(fields.shape[1:], -1, dtype=np.int16)
+        reachable = fields >= 0
+        nearest = np.where(reachable, fields, np.iinfo(np.int16).max).min(axis=0)
+        return np.where(reachable.any(axis=0), nearest, -1).astype(np.int16)
+
+    def encodeFields(self):
+        """ targetFields() as stored in Maps.targetFields. """
+        return zlib.compress(self.targetFields().tobytes())
+
+    @staticmethod
+    def decodeFields(size, target_count, data):
+        fields = np.frombuffer(zlib.decompress(bytes(data)), dtype=np.int16).reshape(target_count, size, size)
+        fields.setflags(write=False)
+        return fields
+
+class MapStore():
+    """ Finds the GameMap of a board, keeping the maps used most recently in
+    memory and, given a database cursor, the rest in the Maps table, so
+    that each distinct map is only analysed once.
+
+    Rows are written with the caller's transaction: store() a map before
+    referring to it, and call committed() once that transaction is
+    committed, or rolledBack() if it is rolled back. """
+
+    def __init__(self, db=None, max_maps=64):
+        """ db: a cursor, or None to keep maps in memory only. """
+        self.db = db
+        self.max_maps = max_maps
+        self._maps = OrderedDict() # mapHash: GameMap, most recently used last
+        self._pending = [] # Maps stored since the last commit
+
+    def get(self, board):
+        """ Return the GameMap of board. """
+        terrain = DistanceCache.staticTerrain(board)
+        map_hash = GameMap.hashTerrain(board.size, terrain)
+        game_map = self._maps.pop(map_hash, None)
+        if game_map is None:
+            game_map = self._load(map_hash)
+            if game_map is None:
+                game_map = GameMap(board.size, terrain)
+        self._remember(game_map)
+        return game_map
+
+    def byHash(self, map_hash):
+        """ Return the GameMap stored under map_hash, or None if there is no
+        such map. """
+        game_map = self._maps.pop(map_hash, None)
+        if game_map is None:
+            game_map = self._load(map_hash)
+            if game_map is None:
+                return None
+        self._remember(game_map)
+        return game_map
+
+    def store(self, game_map):
+        """ Add game_map to Maps unless it is already there. """
+        if game_map.stored or self.db is None:
+            return
+        self.db.execute(
+            "INSERT INTO Maps (mapHash, size, terrain, mineLocs, tavernLocs, targetFields) "
+            "VALUES (%s, %s, %s, %s, %s, %s) "
+            "ON CONFLICT (mapHash) DO NOTHING;",
+            (game_map.map_hash, game_map.size, psycopg.Binary(game_map.terrain.tobytes()), \
+            [list(loc) for loc in game_map.mine_locs], [list(loc) for loc in game_map.tavern_locs], \
+            psycopg.Binary(game_map.encodeFields())))
+        self._pending.append(game_map)
+
+    def committed(self):
+        """ Record that the maps stored since the last call are committed. """
+        for game_map in self._pending:
+            game_map.stored = True
+        self._pending = []
+
+    def rolledBack(self):
+        """ Forget the maps stored since the last commit, which will be
+        stored again when next used. """
+        self._pending = []
+
+    def _remember(self, game_map):
+        if len(self._maps) >= self.max_maps:
+            self._maps.popitem(last=False)
+        self._maps[game_map.map_hash] = game_map
+
+    def _load(self, map_hash):
+        if self.db is None:
+            return None
+        self.db.execute(
+            "SELECT size, terrain, targetFields "
+            "FROM Maps "
+            "WHERE mapHash = %s;",
+            (map_hash,))
+        row = self.db.fetchone()
+        if row is None:
+            return None
+        size, terrain, target_fields = row
+        terrain = np.frombuffer(bytes(terrain), dtype=np.int8).reshape(size, size).copy()
+        target_count = int(((terrain == Tile.MINE) | (terrain == Tile.TAVERN)).sum())
+        game_map = GameMap(size, terrain, GameMap.decodeFields(size, target_count, target_fields))
+        game_map.stored = True
+        return game_map
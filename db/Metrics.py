@@ -0,0 +1,202 @@
+import bisect
+import os
+import queue as _queue
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Upper bounds, in seconds, of the histogram buckets
+BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, \
+    1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+HISTOGRAMS = {
+    "stream_read_seconds": "Time spent waiting for the network per chunk read from an event stream.",
+    "parse_seconds": "Time to decode one turn's JSON.",
+    "build_seconds": "Time to build one turn's Game from its decoded state.",
+    "distances_seconds": "Time to compute one turn's hero distances.",
+    "write_seconds": "Time spent in database writes, per turn or per batch of buffered turns.",
+    "commit_seconds": "Time per database commit.",
+    "turn_lag_seconds": "Time from a turn arriving from the server to it being committed.",
+}
+
+COUNTERS = {
+    "stream_bytes_total": "Bytes read from event streams.",
+    "games_started_total": "Games whose Games row was inserted.",
+    "games_finished_total": "Games whose last turn was written.",
+    "turns_total": "Turns built and handed over to be written.",
+    "errors_total": "Errors logged while streaming or writing games.",
+    "games_failed_total": "Games given up on after their rows were rolled back.",
+}
+
+# Gauges are combined across processes by taking the largest value
+GAUGES = {
+    "turn_lag_max_seconds": "Largest turn lag of the open games, each as of its last committed turn.",
+}
+
+class Metrics():
+    """ Counters and latency histograms of the ingestion stages of one
+    process, exposed in the Prometheus text format.
+
+    Each process records into its own Metrics (the module's `metrics`).
+    Child processes call forwardTo() with a multiprocessing queue, and the
+    parent calls collectFrom() on the same queue, so that the parent's
+    metrics include its children's. Children send their gauges whole, and
+    the parent keeps the latest of each child's. """
+
+    def __init__(self, prefix="vindinium_"):
+        self.prefix = prefix
+        self.lock = threading.Lock()
+        self.forward_queue = None
+        self.gauges = {name: 0.0 for name in GAUGES}
+        self.child_gauges = {} # pid: gauges of a child process, as last sent
+        self.sent_gauges = None # The gauges as last sent to the parent
+        self._reset()
+
+    def _reset(self):
+        self.counters = {name: 0 for name in COUNTERS}
+        # name: [count per bucket (the last for values above every bound), sum]
+        self.histograms = {name: [[0] * (len(BUCKETS) + 1), 0.0] for name in HISTOGRAMS}
+
+    def inc(self, name, value=1):
+        with self.lock:
+            self.counters[name] += value
+
+    def observe(self, name, value):
+        with self.lock:
+            histogram = self.histograms[name]
+            histogram[0][bisect.bisect_left(BUCKETS, value)] += 1
+            histogram[1] += value
+
+    def set(self, name, value):
+        with self.lock:
+            self.gauges[name] = value
+
+    @contextmanager
+    def time(self, name):
+        """ Observe the time spent in a with block in histogram name. """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start)
+
+    def snapshot(self, reset=False):
+        """ Return the current values as a picklable dict, optionally
+        starting again from zero. Gauges are not reset. """
+        with self.lock:
+            snapshot = {"counters": dict(self.counters), \
+                "histograms": {name: [list(counts), total] for name, (counts, total) in self.histograms.items()}, \
+                "gauges": dict(self.gauges), "pid": os.getpid()}
+            if reset:
+                self._reset()
+        return snapshot
+
+    def merge(self, snapshot):
+        """ Add the values of a snapshot, e.g. from another process. Gauges
+        from another process replace those it sent before. """
+        with self.lock:
+            if snapshot["pid"] != os.getpid():
+                self.child_gauges[snapshot["pid"]] = snapshot["gauges"]
+            for name, value in snapshot["counters"].items():
+                self.counters[name] += value
+            for name, (counts, total) in snapshot["histograms"].items():
+                histogram = self.histograms[name]
+                histogram[0] = [a + b for a, b in zip(histogram[0], counts)]
+                histogram[1] += total
+
+    def prometheusText(self):
+        snapshot = self.snapshot()
+        lines = []
+        for name, value in snapshot["counters"].items():
+            lines.append("# HELP " + self.prefix + name + " " + COUNTERS[name])
+            lines.append("# TYPE " + self.prefix + name + " counter")
+            lines.append(self.prefix + name + " " + str(value))
+        for name, (counts, total) in snapshot["histograms"].items():
+            lines.append("# HELP " + self.prefix + name + " " + HISTOGRAMS[name])
+            lines.append("# TYPE " + self.prefix + name + " histogram")
+            cumulative = 0
+            for bound, count in zip(BUCKETS + ("+Inf",), counts):
+                cumulative += count
+                lines.append(self.prefix + name + '_bucket{le="' + str(bound) + '"} ' + str(cumulative))
+            lines.append(self.prefix + name + "_sum " + repr(total))
+            lines.append(self.prefix + name + "_count " + str(cumulative))
+        with self.lock:
+            gauges = [self.gauges] + list(self.child_gauges.values())
+        for name in GAUGES:
+            lines.append("# HELP " + self.prefix + name + " " + GAUGES[name])
+            lines.append("# TYPE " + self.prefix + name + " gauge")
+            lines.append(self.prefix + name + " " + repr(max(values.get(name, 0.0) for values in gauges)))
+        return "\n".join(lines) + "\n"
+
+    def serve(self, port, host="127.0.0.1"):
+        """ Serve the metrics at http://host:port/metrics from a background
+        thread. Returns the server. """
+        metrics = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.rstrip("/") not in ("", "/metrics"):
+                    self.send_error(404)
+                    return
+                body = metrics.prometheusText().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        server = ThreadingHTTPServer((host, port), Handler)
+        server.daemon_threads = True
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        return server
+
+    def dump(self, path):
+        with open(path, "w") as dump_file:
+            dump_file.write(self.prometheusText())
+
+    def collectFrom(self, queue):
+        """ Merge the snapshots child processes put on queue, from a
+        background thread, until None is put on it. Returns the thread. """
+        def collect():
+            for snapshot in iter(queue.get, None):
+                self.merge(snapshot)
+        thread = threading.Thread(target=collect, daemon=True)
+        thread.start()
+        return thread
+
+    def forwardTo(self, queue, interval=1.0):
+        """ In a child process: start from zero (dropping what was inherited
+        from the parent) and send what is recorded to queue every interval
+        seconds. Call flush() before the process exits. """
+        self._reset()
+        self.lock = threading.Lock()
+        self.gauges = {name: 0.0 for name in GAUGES}
+        self.child_gauges = {}
+        self.sent_gauges = None
+        self.forward_queue = queue
+
+        def forward():
+            while True:
+                time.sleep(interval)
+                self.flush()
+        threading.Thread(target=forward, daemon=True).start()
+
+    def flush(self):
+        """ Send what was recorded since the last flush to the queue given to
+        forwardTo(), if any. """
+        if self.forward_queue is not None:
+            snapshot = self.snapshot(reset=True)
+            if any(snapshot["counters"].values()) \
+                or any(total or any(counts) for counts, total in snapshot["histograms"].values()) \
+                or snapshot["gauges"] != self.sent_gauges:
+                try:
+                    self.forward_queue.put(snapshot, timeout=1)
+                    self.sent_gauges = snapshot["gauges"]
+                except _queue.Full:
+                    self.merge(snapshot)
+
+metrics = Metrics()
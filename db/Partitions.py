@@ -0,0 +1,272 @@
+import argparse
+import datetime
+import logging as _logging
+import sys
+
+import psycopg2 as psycopg
+
+# Mines is a view of MineSpans; see create_tables.sql. It has to be dropped
+# and created again when the tables under it are replaced.
+MINES_VIEW = \
+    "CREATE VIEW Mines AS " \
+    "    SELECT s.gameId, t.id AS turnId, s.mineNumber, s.pos, h.id AS heroId " \
+    "    FROM MineSpans s " \
+    "    JOIN Turns t ON t.gameId = s.gameId AND t.turn >= s.fromTurn " \
+    "        AND (s.toTurn IS NULL OR t.turn <= s.toTurn) " \
+    "    LEFT JOIN Heroes h ON h.turnId = t.id AND h.inGameId = s.inGameId;"
+
+def monthStart(date, months_later=0):
+    """ Return midnight on the first day of date's month, months_later
+    months on (which may be negative). """
+    month = date.year * 12 + date.month - 1 + months_later
+    return datetime.datetime(month // 12, month % 12 + 1, 1)
+
+class Partitions():
+    """ Maintains the monthly partitions of Heroes and MineSpans, which are
+    partitioned by the time of their game (Games.time).
+
+    A partition is named <table>_p<YYYYMM>; rows of months without one go to
+    <table>_default. maintain() is meant to be run regularly, e.g. daily
+    from cron: it creates the coming months' partitions, deletes games that
+    never finished, drops the partitions of months older than the retention
+    period and compacts partitions of past months once. Dropping a month
+    removes the per-turn rows of its games (Heroes, MineSpans and Turns) and
+    sets their Games.turnsDropped, which exports and BotStats.rebuild skip.
+    Their Games, Events and BackfillCheckpoints rows and the bot statistics
+    rollups are kept, so a backfill does not insert them again. """
+
+    TABLES = ("Heroes", "MineSpans")
+
+    # Foreign keys, which CREATE TABLE ... (LIKE ...) does not copy
+    FOREIGN_KEYS = {
+        "Heroes": ("FOREIGN KEY (userId) REFERENCES Bots", "FOREIGN KEY (gameId) REFERENCES Games", \
+            "FOREIGN KEY (turnId) REFERENCES Turns(id)"),
+        "MineSpans": ("FOREIGN KEY (gameId) REFERENCES Games",)}
+    PRIMARY_KEYS = {"Heroes": "(id, gameTime)", "MineSpans": "(gameId, mineNumber, fromTurn, gameTime)"}
+    INDEXES = {"Heroes": ("(gameId)", "(turnId)", "USING BRIN (gameTime)"), \
+        "MineSpans": ("USING BRIN (gameTime)",)}
+
+    def __init__(self, database_name, database_user, logger=_logging.getLogger("Partitions")):
+        self.connection = psycopg.connect("dbname=" + database_name + " user=" + database_user)
+        self.db = self.connection.cursor()
+        self.logger = logger
+
+    def maintain(self, months_ahead=3, retention_months=None, compact_after_months=1, \
+        purge_unfinished_after=datetime.timedelta(days=1)):
+        """ retention_months: Keep the partitions of the current month and of
+        this many months before it, and drop older ones. None keeps
+        everything.
+
+        compact_after_months: Compact the partitions of months at least this
+        many months before the current one. None disables compaction.
+
+        purge_unfinished_after: Delete unfinished games older than this.
+        None disables the purge. """
+        now = datetime.datetime.now()
+        self.createPartitions(monthStart(now), monthStart(now, months_ahead + 1))
+        if purge_unfinished_after is not None:
+            self.purgeUnfinishedGames(now - purge_unfinished_after)
+        if retention_months is not None:
+            self.dropPartitions(monthStart(now, -retention_months))
+        if compact_after_months is not None:
+            self.compactPartitions(monthStart(now, -compact_after_months + 1))
+
+    def partitions(self, table):
+        """ Return {month start: partition name} for the monthly partitions
+        of table. """
+        self.db.execute(
+            "SELECT c.relname FROM pg_inherits i "
+            "JOIN pg_class c ON c.oid = i.inhrelid "
+            "WHERE i.inhparent = %s::regclass;",
+            (table.lower(),))
+        months = {}
+        for (name,) in self.db.fetchall():
+            suffix = name.rsplit("_p", 1)[-1]
+            if suffix.isdigit() and len(suffix) == 6:
+                months[datetime.datetime(int(suffix[:4]), int(suffix[4:]), 1)] = name
+        return months
+
+    def createPartitions(self, start, end):
+        """ Create the missing monthly partitions of each table for the months
+        from start up to end. Rows of those months already in the default
+        partition are moved into the new partition. """
+        for table in Partitions.TABLES:
+            existing = self.partitions(table)
+            month = monthStart(start)
+            while month < end:
+                if month not in existing:
+                    self._createPartition(table, month)
+                month = monthStart(month, 1)
+
+    def _createPartition(self, table, month):
+        name = table.lower() + "_p" + month.strftime("%Y%m")
+        default = table.lower() + "_default"
+        bounds = (month, monthStart(month, 1))
+        self.db.execute("SELECT 1 FROM " + default + " WHERE gameTime >= %s AND gameTime < %s LIMIT 1;", bounds)
+        if self.db.fetchone() is None:
+            self.db.execute("CREATE TABLE " + name + " PARTITION OF " + table + " "
+                "FOR VALUES FROM (%s) TO (%s);", bounds)
+        else:
+            # The default partition may not hold rows of a new partition's range.
+            self.db.execute("ALTER TABLE " + table + " DETACH PARTITION " + default + ";")
+            self.db.execute("CREATE TABLE " + name + " PARTITION OF " + table + " "
+                "FOR VALUES FROM (%s) TO (%s);", bounds)
+            self.db.execute("INSERT INTO " + name + " "
+                "SELECT * FROM " + default + " WHERE gameTime >= %s AND gameTime < %s;", bounds)
+            self.db.execute("DELETE FROM " + default + " WHERE gameTime >= %s AND gameTime < %s;", bounds)
+            self.db.execute("ALTER TABLE " + table + " ATTACH PARTITION " + default + " DEFAULT;")
+        self.connection.commit()
+        self.logger.info("Created partition " + name + ".")
+
+    def purgeUnfinishedGames(self, started_before):
+        """ Delete every game that started before started_before and never
+        finished, with all of its rows. Bot history rows that point at such
+        a game are kept, without the game. Returns the number deleted. """
+        self.db.execute("SELECT gameId FROM Games WHERE NOT finished AND time < %s;", (started_before,))
+        game_ids = [row[0] for row in self.db.fetchall()]
+        if len(game_ids) > 0:
+            for table in ("Events", "MineSpans", "Heroes", "Turns", "BackfillCheckpoints"):
+                self.db.execute("DELETE FROM " + table + " WHERE gameId = ANY(%s);", (game_ids,))
+            self.db.execute("UPDATE HistoricalBots SET lastGameId = NULL WHERE lastGameId = ANY(%s);", \
+                (game_ids,))
+            self.db.execute("DELETE FROM Games WHERE gameId = ANY(%s);", (game_ids,))
+            self.connection.commit()
+            self.logger.info("Purged " + str(len(game_ids)) + " unfinished games.")
+        return len(game_ids)
+
+    def dropPartitions(self, before):
+        """ Drop the partitions of months that ended by before, and the Turns
+        of their games, marking the games turnsDropped. Each month is
+        dropped in one transaction. """
+        partitions = {table: self.partitions(table) for table in Partitions.TABLES}
+        months = sorted(set(month for table_partitions in partitions.values() for month in table_partitions))
+        for month in months:
+            if monthStart(month, 1) > before:
+                continue
+            for table in Partitions.TABLES:
+                name = partitions[table].get(month)
+                if name is not None:
+                    self.db.execute("ALTER TABLE " + table + " DETACH PARTITION " + name + ";")
+                    self.db.execute("DROP TABLE " + name + ";")
+            # Games.time is the gameTime the partitions are ranged by
+            self.db.execute(
+                "DELETE FROM Turns "
+                "WHERE gameId IN (SELECT gameId FROM Games WHERE time >= %s AND time < %s);",
+                (month, monthStart(month, 1)))
+            self.db.execute(
+                "UPDATE Games "
+                "    SET turnsDropped = TRUE "
+                "WHERE time >= %s AND time < %s AND NOT turnsDropped;",
+                (month, monthStart(month, 1)))
+            game_count = self.db.rowcount
+            self.connection.commit()
+            self.logger.info("Dropped the turns of " + str(game_count) + " games of " + month.strftime("%Y-%m") + ".")
+
+    def compactPartitions(self, before):
+        """ Rewrite each partition of a month that ended by before in gameId
+        order, once, so that a game's rows are stored together and the space
+        of deleted rows is returned. Compacted partitions are marked with a
+        comment. """
+        for table in Partitions.TABLES:
+            for month, name in sorted(self.partitions(table).items()):
+                if monthStart(month, 1) > before:
+                    continue
+                self.db.execute("SELECT obj_description(%s::regclass, 'pg_class');", (name,))
+                if self.db.fetchone()[0] == "compacted":
+                    continue
+                self.db.execute(
+                    "SELECT indexname FROM pg_indexes "
+                    "WHERE tablename = %s AND indexdef LIKE %s;",
+                    (name, "%(gameid%"))
+                index = self.db.fetchone()
+                if index is not None:
+                    self.db.execute("CLUSTER " + name + " USING " + index[0] + ";")
+                self.db.execute("ANALYZE " + name + ";")
+                self.db.execute("COMMENT ON TABLE " + name + " IS 'compacted';")
+                self.connection.commit()
+                self.logger.info("Compacted partition " + name + ".")
+
+    def migrate(self, months_ahead=3):
+        """ Convert Heroes and MineSpans from plain tables (as created before
+        they were partitioned) to partitioned tables, copying their rows.
+        Takes the tables' locks for the whole copy, so run it while nothing is
+        inserting. Tables that are already partitioned are left alone. """
+        self.db.execute("ALTER TABLE Games ADD COLUMN IF NOT EXISTS turnsDropped BOOLEAN NOT NULL DEFAULT FALSE;")
+        self.db.execute("DROP VIEW IF EXISTS Mines;")
+        for table in Partitions.TABLES:
+            self.db.execute("SELECT relkind FROM pg_class WHERE oid = %s::regclass;", (table.lower(),))
+            if self.db.fetchone()[0] == "p":
+                self.logger.info(table + " is already partitioned.")
+                continue
+            self._migrateTable(table)
+        self.db.execute(MINES_VIEW)
+        self.connection.commit()
+
+        self.db.execute("SELECT min(time) FROM Games;")
+        first = self.db.fetchone()[0] or datetime.datetime.now()
+        now = datetime.datetime.now()
+        self.createPartitions(monthStart(first), monthStart(now, months_ahead + 1))
+
+    def _migrateTable(self, table):
+        old = table.lower() + "_unpartitioned"
+        self.db.execute("ALTER TABLE " + table + " RENAME TO " + old + ";")
+        self.db.execute(
+            "SELECT 1 FROM information_schema.columns "
+            "WHERE table_name = %s AND column_name = 'gametime';",
+            (old,))
+        has_game_time = self.db.fetchone() is not None
+        self.db.execute("CREATE TABLE " + table + " (LIKE " + old + " INCLUDING DEFAULTS" \
+            + ("" if has_game_time else ", gameTime TIMESTAMP") + ") PARTITION BY RANGE (gameTime);")
+        self.db.execute("ALTER TABLE " + table + " ALTER COLUMN gameTime SET NOT NULL;")
+        self.db.execute("ALTER TABLE " + table + " ADD PRIMARY KEY " + Partitions.PRIMARY_KEYS[table] + ";")
+        for foreign_key in Partitions.FOREIGN_KEYS[table]:
+            self.db.execute("ALTER TABLE " + table + " ADD " + foreign_key + ";")
+        for index in Partitions.INDEXES[table]:
+            self.db.execute("CREATE INDEX ON " + table + " " + index + ";")
+        self.db.execute("CREATE TABLE " + table.lower() + "_default PARTITION OF " + table + " DEFAULT;")
+        if has_game_time:
+            self.db.execute("INSERT INTO " + table + " SELECT * FROM " + old + ";")
+        else:
+            # gameTime is the new table's last column.
+            self.db.execute("INSERT INTO " + table + " "
+                "SELECT o.*, COALESCE(g.time, 'epoch') "
+                "FROM " + old + " o JOIN Games g ON g.gameId = o.gameId;")
+        self.db.execute("SELECT pg_get_serial_sequence(%s, 'id');", (old,))
+        sequence = self.db.fetchone()
+        if sequence is not None and sequence[0] is not None:
+            self.db.execute("ALTER SEQUENCE " + sequence[0] + " OWNED BY " + table + ".id;")
+        self.db.execute("DROP TABLE " + old + ";")
+        self.logger.info("Partitioned " + table + ".")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Maintain the monthly partitions of Heroes and MineSpans.")
+    parser.add_argument("database_name")
+    parser.add_argument("database_user")
+    parser.add_argument("command", choices=["migrate", "maintain"], \
+        help="migrate: partition the tables of a database created before they were partitioned. "
+        "maintain: create, compact and drop partitions and purge unfinished games; run it daily.")
+    parser.add_argument("--months-ahead", type=int, default=3, \
+        help="Create partitions this many months ahead (default: 3).")
+    parser.add_argument("--retention-months", type=int, default=None, \
+        help="Keep partitions of the current month and this many months before it, "
+        "and drop older ones (default: keep everything).")
+    parser.add_argument("--compact-after-months", type=int, default=1, \
+        help="Compact partitions of months at least this many months before the current one (default: 1).")
+    parser.add_argument("--purge-unfinished-after-hours", type=float, default=24, \
+        help="Delete games that have not finished this many hours after they started (default: 24).")
+    parser.add_argument("--logging-level", default="info", type=str.lower, \
+        choices=["debug", "info", "warn", "error", "critical"])
+    args = parser.parse_args()
+
+    logger = _logging.getLogger("Partitions")
+    stdout_handler = _logging.StreamHandler(sys.stdout)
+    stdout_handler.setFormatter(_logging.Formatter("%(levelname)s: %(message)s"))
+    logger.addHandler(stdout_handler)
+    logger.setLevel(getattr(_logging, args.logging_level.upper()))
+
+    partitions = Partitions(args.database_name, args.database_user, logger)
+    if args.command == "migrate":
+        partitions.migrate(args.months_ahead)
+    else:
+        partitions.maintain(args.months_ahead, args.retention_months, args.compact_after_months, \
+            datetime.timedelta(hours=args.purge_unfinished_after_hours))
@@ -0,0 +1,328 @@
+import sys
+sys.path.insert(0, "../game")
+
+import argparse
+import json
+import logging as _logging
+import os
+import queue as _queue
+import re
+import time
+
+from Backfill import gameIdOf
+from BulkInserter import BulkInserter
+from GameScheduler import ExpiringSet
+from Inserter import Inserter
+
+SEGMENT_SUFFIX = ".spool"
+OFFSETS_FILE = "offsets.json"
+
+_TURN_PATTERN = re.compile(r'"turn"\s*:\s*(\d+)')
+
+def turnOf(turn_string):
+    """ Return the turn number of a turn string without decoding all of it.
+    Only the game object has a "turn" field. """
+    return int(_TURN_PATTERN.search(turn_string).group(1))
+
+def segments(directory):
+    """ Return the numbers of the spool's segments, in order. """
+    return sorted(int(name[:-len(SEGMENT_SUFFIX)]) for name in os.listdir(directory) \
+        if name.endswith(SEGMENT_SUFFIX) and name[:-len(SEGMENT_SUFFIX)].isdigit())
+
+def segmentPath(directory, segment):
+    return os.path.join(directory, "%010d" % segment + SEGMENT_SUFFIX)
+
+class SpoolWriter():
+    """ Appends event lines to a spool: a directory of numbered segment
+    files, each holding one turn string per line, the turns of concurrent
+    games interleaved in the order they arrived.
+
+    A segment is closed and a new one started once it reaches
+    segment_bytes. Lines are fsynced in batches, every sync_lines lines or
+    sync_interval seconds, whichever comes first; a crash loses at most
+    that batch. Every SpoolWriter starts a new segment, so a line torn by a
+    crash is always at the end of a segment that is never appended to
+    again. """
+
+    def __init__(self, directory, segment_bytes=64 * 2**20, sync_lines=1000, sync_interval=1.0, \
+        logger=_logging.getLogger("SpoolWriter")):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.sync_lines = sync_lines
+        self.sync_interval = sync_interval
+        self.logger = logger
+        existing = segments(directory)
+        self.segment = existing[-1] if existing else -1
+        self.file = None
+        self.unsynced_lines = 0
+        self.last_sync = time.monotonic()
+        self._rotate()
+
+    def append(self, line):
+        """ Append one turn string. Newlines within it are replaced by
+        spaces, which JSON treats alike. """
+        self.file.write(line.rstrip("\r\n").replace("\r", " ").replace("\n", " ").encode("utf-8") + b"\n")
+        self.unsynced_lines += 1
+        if self.file.tell() >= self.segment_bytes:
+            self._rotate()
+        elif self.unsynced_lines >= self.sync_lines or time.monotonic() - self.last_sync >= self.sync_interval:
+            self.sync()
+
+    def sync(self):
+        if self.unsynced_lines > 0:
+            self.file.flush()
+            os.fsync(self.file.fileno())
+            self.unsynced_lines = 0
+        self.last_sync = time.monotonic()
+
+    def close(self):
+        self.sync()
+        self.file.close()
+
+    def writeFrom(self, queue):
+        """ Append the lines put on queue (e.g. by game processes) until None
+        is put on it, syncing whenever no line arrived for sync_interval
+        seconds. """
+        while True:
+            try:
+                line = queue.get(timeout=self.sync_interval)
+            except _queue.Empty:
+                self.sync()
+                continue
+            if line is None:
+                break
+            self.append(line)
+        self.close()
+
+    def _rotate(self):
+        if self.file is not None:
+            self.close()
+        self.segment += 1
+        path = segmentPath(self.directory, self.segment)
+        self.file = open(path, "xb")
+        # Make the new segment's directory entry durable, so that a reader
+        # never sees a later segment survive a crash an earlier one did not.
+        directory_fd = os.open(self.directory, os.O_RDONLY)
+        try:
+            os.fsync(directory_fd)
+        finally:
+            os.close(directory_fd)
+        self.logger.debug("Spooling to " + path + ".")
+
+class SpoolReader():
+    """ Reads the lines of a spool in order, optionally waiting for more
+    to be written. Positions are (segment, byte offset) tuples. """
+
+    def __init__(self, directory, logger=_logging.getLogger("SpoolReader")):
+        self.directory = directory
+        self.logger = logger
+
+    def lines(self, start=(0, 0), follow=False, poll_interval=1.0):
+        """ Yield (line, position of the line, position after it) from start
+        on. With follow, wait for new lines at the end of the spool instead
+        of returning, yielding (None, position, position) after each wait so
+        that the caller can act while the spool is idle. """
+        segment, offset = start
+        while True:
+            existing = [number for number in segments(self.directory) if number >= segment]
+            if not existing:
+                if not follow:
+                    return
+                yield None, (segment, offset), (segment, offset)
+                time.sleep(poll_interval)
+                continue
+            if existing[0] != segment:
+                segment, offset = existing[0], 0
+            with open(segmentPath(self.directory, segment), "rb") as segment_file:
+                segment_file.seek(offset)
+                while True:
+                    line = segment_file.readline()
+                    if line.endswith(b"\n"):
+                        yield line[:-1].decode("utf-8"), (segment, offset), (segment, offset + len(line))
+                        offset += len(line)
+                        continue
+                    # At the end of the segment, or of what was written of it so far
+                    if any(number > segment for number in segments(self.directory)):
+                        if line:
+                            self.logger.warning("Skipping a torn line at the end of segment " \
+                                + str(segment) + ".")
+                        break
+                    if not follow:
+                        return
+                    yield None, (segment, offset), (segment, offset)
+                    time.sleep(poll_interval)
+                    segment_file.seek(offset)
+            segment, offset = segment + 1, 0
+
+    def gameLines(self, game_id):
+        """ Yield the turn strings of one game, e.g. to replay it. """
+        for line, _, _ in self.lines():
+            if gameIdOf(line) == game_id:
+                yield line
+
+class SpoolLoader():
+    """ Tails a spool and inserts its games at the pace of the database.
+
+    The position from which loading must restart is saved atomically to
+    offsets.json in the spool directory: the start of the earliest game
+    still being loaded, or the end of what was read if no game is. After a
+    crash, loading restarts there. Games already finished in the database
+    are skipped; for the others, the turns already committed (up to their
+    highest turn in Turns) only rebuild the Inserter's per-game state, and
+    loading carries on from the next turn.
+
+    A game whose turns stop before its last turn is finished as it is once
+    abandon_after_lines more lines have been read. """
+
+    def __init__(self, directory, database_name, database_user, logger=_logging.getLogger("SpoolLoader"), \
+        inserter_class=Inserter, inserter_options=None, checkpoint_interval=1.0, abandon_after_lines=100000):
+        self.directory = directory
+        self.logger = logger
+        self.inserter = inserter_class(database_name, database_user, logger, **(inserter_options or {}))
+        self.reader = SpoolReader(directory, logger)
+        self.checkpoint_interval = checkpoint_interval
+        self.abandon_after_lines = abandon_after_lines
+        self.games = {} # gameId: {"game", "start", "lastLine", "loadedTurn"}
+        self.done = ExpiringSet(ttl=float("inf")) # Games finished or given up on
+        self.line_count = 0
+
+    def run(self, follow=True, poll_interval=1.0):
+        """ Load the spool from the saved position on. With follow, keep
+        waiting for new lines. Returns the number of lines read. """
+        position = self.savedPosition()
+        last_checkpoint = time.monotonic()
+        lines_read = 0
+        for line, start, end in self.reader.lines(position, follow, poll_interval):
+            if line is not None:
+                self._loadLine(line, start)
+                lines_read += 1
+            position = end
+            if time.monotonic() - last_checkpoint >= self.checkpoint_interval:
+                self._abandonGames()
+                self._checkpoint(position)
+                last_checkpoint = time.monotonic()
+        self.inserter._flush()
+        self.inserter._commit()
+        self._checkpoint(position)
+        return lines_read
+
+    def savedPosition(self):
+        try:
+            with open(os.path.join(self.directory, OFFSETS_FILE)) as offsets_file:
+                return tuple(json.load(offsets_file)["restart"])
+        except FileNotFoundError:
+            return (0, 0)
+
+    def _loadLine(self, line, position):
+        self.line_count += 1
+        game_id = gameIdOf(line)
+        if game_id is None or game_id in self.done:
+            return
+        state = self.games.get(game_id)
+        try:
+            if state is None:
+                state = self._openGame(game_id, line, position)
+                if state is None:
+                    self.done.add(game_id)
+                    return
+            state["lastLine"] = self.line_count
+            if state["loadedTurn"] is None:
+                self.inserter._insertGame(line)
+                state["loadedTurn"] = -1
+            if turnOf(line) <= state["loadedTurn"]:
+                state["game"] = self.inserter.skipTurn(line, state["game"])
+            else:
+                state["game"] = self.inserter.insertTurn(line, state["game"])
+                self.inserter._commitTurn()
+            if state["game"].finished:
+                self._closeGame(game_id)
+        except Exception:
+            self.logger.exception("Failed to load game " + game_id + "; skipping the rest of it.")
+            for failed_game_id in self.inserter.rollback([game_id]):
+                if failed_game_id != game_id:
+                    self.logger.error("Skipping the rest of " + failed_game_id + ", whose uncommitted turns "
+                        "were rolled back with it.")
+                self.games.pop(failed_game_id, None)
+                self.done.add(failed_game_id)
+
+    def _openGame(self, game_id, line, position):
+        """ Return the loading state of a game first read at position, or
+        None if it must be skipped. """
+        db = self.inserter.db
+        db.execute("SELECT finished FROM Games WHERE gameId = %s;", (game_id,))
+        row = db.fetchone()
+        if row is not None and row[0]:
+            return None
+        # loadedTurn: the highest turn in the database, or None while the
+        # game's Games row is not
+        loaded_turn = None
+        if row is not None:
+            db.execute("SELECT min(turn), max(turn) FROM Turns WHERE gameId = %s;", (game_id,))
+            first_turn, last_turn = db.fetchone()
+            turn = turnOf(line)
+            if first_turn is not None and first_turn < turn:
+                self.logger.warning("Skipping " + game_id + ": its turns from " + str(first_turn) \
+                    + " are in the database, but the spool only has them from " + str(turn) + ".")
+                return None
+            loaded_turn = last_turn if last_turn is not None else -1
+        state = {"game": None, "start": position, "lastLine": self.line_count, "loadedTurn": loaded_turn}
+        self.games[game_id] = state
+        return state
+
+    def _closeGame(self, game_id):
+        state = self.games.pop(game_id)
+        self.inserter._finishGame(state["game"])
+        self.done.add(game_id)
+
+    def _abandonGames(self):
+        for game_id, state in list(self.games.items()):
+            if self.line_count - state["lastLine"] > self.abandon_after_lines:
+                self.logger.warning("Game " + game_id + " stopped at turn " \
+                    + (str(state["game"].turn) if state["game"] is not None else "none") + "; finishing it.")
+                if state["game"] is not None:
+                    self._closeGame(game_id)
+                else:
+                    del self.games[game_id]
+                    self.done.add(game_id)
+
+    def _checkpoint(self, position):
+        restart = min([state["start"] for state in self.games.values()] + [position])
+        path = os.path.join(self.directory, OFFSETS_FILE)
+        with open(path + ".tmp", "w") as offsets_file:
+            json.dump({"restart": restart, "read": position}, offsets_file)
+            offsets_file.flush()
+            os.fsync(offsets_file.fileno())
+        os.replace(path + ".tmp", path)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load the games captured to a spool "
+        "(StreamInserter.py --spool) into Postgres, or print one game's turns from it.")
+    parser.add_argument("spool_directory")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    load_parser = subparsers.add_parser("load", help="Insert the spool's games, following it as it grows.")
+    load_parser.add_argument("database_name")
+    load_parser.add_argument("database_user")
+    load_parser.add_argument("--once", action="store_true", \
+        help="Stop at the end of the spool instead of waiting for more lines.")
+    load_parser.add_argument("--bulk", action="store_true", \
+        help="Load each game with COPY instead of one INSERT per row.")
+    cat_parser = subparsers.add_parser("cat", help="Print the turns of a game, as a log Backfill.py reads.")
+    cat_parser.add_argument("game_id")
+    parser.add_argument("--logging-level", default="info", type=str.lower, \
+        choices=["debug", "info", "warn", "error", "critical"])
+    args = parser.parse_args()
+
+    logger = _logging.getLogger("Spool")
+    stdout_handler = _logging.StreamHandler(sys.stderr if args.command == "cat" else sys.stdout)
+    stdout_handler.setFormatter(_logging.Formatter("%(levelname)s: %(message)s"))
+    logger.addHandler(stdout_handler)
+    logger.setLevel(getattr(_logging, args.logging_level.upper()))
+
+    if args.command == "cat":
+        for line in SpoolReader(args.spool_directory, logger).gameLines(args.game_id):
+            print(line)
+    else:
+        inserter_class = BulkInserter if args.bulk else Inserter
+        loader = SpoolLoader(args.spool_directory, args.database_name, args.database_user, logger, inserter_class)
+        logger.info("Loaded " + str(loader.run(follow=not args.once)) + " lines.")
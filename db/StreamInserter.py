@@ -1,37 +1,94 @@
-import ast
+import argparse
+import json
 import logging as _logging
 import sys
+import threading
 
-from multiprocessing import Process
+from multiprocessing import Process, Queue
 
+from BulkInserter import BulkInserter
+from GameScheduler import GameScheduler
 from Inserter import Inserter
+from Metrics import metrics
 from Streamer import Streamer
+from WriterPool import QueuedInserter, WriterPool
 
 class StreamInserter():
-    def __init__(self, hostname, database_name, database_user, logger=_logging.getLogger("StreamInserter")):
+    def __init__(self, hostname, database_name, database_user, logger=_logging.getLogger("StreamInserter"), \
+        inserter_class=Inserter, inserter_options=None, writer_pool=None, metrics_queue=None, \
+        scheduler_options=None, spool_queue=None):
+        """ inserter_class: Inserter or a subclass of it, such as BulkInserter,
+        used to write each game. inserter_options are passed as keyword
+        arguments to its constructor.
+        
+        writer_pool: A started WriterPool. If given, game processes hand their
+        rows to it instead of each opening a database connection, and
+        inserter_class is not used.
+        
+        metrics_queue: A multiprocessing Queue the game processes forward
+        their metrics to (see Metrics.forwardTo), or None.
+        
+        scheduler_options: Keyword arguments for the GameScheduler deciding
+        which games are streamed, such as max_games and priority. With a
+        writer_pool, max_queue_depth defaults to 10 items per writer per
+        game slot.
+        
+        spool_queue: If given, game processes only put the turn strings they
+        receive on this multiprocessing Queue, for a SpoolWriter, instead of
+        inserting them. """
         self.hostname = hostname
         self.database_name = database_name
         self.database_user = database_user
         self.logger = logger
+        self.inserter_class = inserter_class
+        self.inserter_options = inserter_options or {}
+        self.writer_pool = writer_pool
+        self.metrics_queue = metrics_queue
+        self.spool_queue = spool_queue
+        scheduler_options = dict(scheduler_options or {})
+        if writer_pool is not None:
+            scheduler_options.setdefault("max_queue_depth", \
+                10 * writer_pool.pool_size * scheduler_options.get("max_games", 32))
+        self.scheduler = GameScheduler(self.startGameStream, writer_pool=writer_pool, logger=logger, \
+            **scheduler_options)
     
     def start(self):
-        already_streaming_game_ids = set()
+        """ Stream games until the /now-playing stream ends, then wait for
+        the games already being streamed, or waiting to be, to finish.
+        Games are scheduled whenever /now-playing sends an update. """
         now_playing_streamer = Streamer(self.hostname + "/now-playing", self.logger)
         for data in now_playing_streamer.stream():
-            game_ids = set(ast.literal_eval(data))
-            new_game_ids = game_ids - already_streaming_game_ids
-            for game_id in new_game_ids:
-                self.startGameStream(game_id)
-            already_streaming_game_ids.update(game_ids)
+            self.scheduler.offer(json.loads(data))
+        self.scheduler.wait()
     
     def startGameStream(self, game_id):
+        """ Start streaming game_id in a new process, and return it. """
         process = Process(target=self._runGameStream, args=(game_id,))
         process.start()
+        return process
     
     def _runGameStream(self, game_id):
-        inserter = Inserter(self.database_name, self.database_user, self.logger)
-        streamer = Streamer(self.hostname + "/events/" + game_id)
-        inserter.insertGame(streamer.stream())
+        if self.metrics_queue is not None:
+            metrics.forwardTo(self.metrics_queue)
+        try:
+            if self.spool_queue is not None:
+                streamer = Streamer(self.hostname + "/events/" + game_id)
+                for turn_string in streamer.stream():
+                    self.spool_queue.put(turn_string)
+                    metrics.inc("turns_total")
+                return
+            if self.writer_pool is not None:
+                inserter = QueuedInserter(self.writer_pool, self.logger)
+            else:
+                inserter = self.inserter_class(self.database_name, self.database_user, self.logger, \
+                    **self.inserter_options)
+            streamer = Streamer(self.hostname + "/events/" + game_id)
+            inserter.insertGame(streamer.stream())
+        except Exception:
+            metrics.inc("errors_total")
+            raise
+        finally:
+            metrics.flush()
 
 if __name__ == "__main__":
     
@@ -43,24 +100,100 @@ if __name__ == "__main__":
         logger.setLevel(log_level)
         return logger
     
-    num_args = len(sys.argv)
-    if num_args < 3:
-        print("Usage: %s <database-name> <database-user> {hostname} {logging_level}" % (sys.argv[0]))
+    parser = argparse.ArgumentParser(description="Stream games from a Vindinium server to Postgres.")
+    parser.add_argument("database_name")
+    parser.add_argument("database_user")
+    parser.add_argument("hostname", nargs="?", default="http://vindinium.org/")
+    parser.add_argument("logging_level", nargs="?", default="info", type=str.lower, \
+        choices=["debug", "info", "warn", "error", "critical"])
+    parser.add_argument("--bulk", action="store_true", \
+        help="Buffer turns and load them with COPY instead of one INSERT per row.")
+    parser.add_argument("--flush-turns", type=int, default=None, \
+        help="With --bulk, write out and commit every N turns instead of once per game.")
+    parser.add_argument("--mode", choices=["process", "async"], default="process", \
+        help="Run one process per game (the default), or follow every game from one asyncio event loop.")
+    parser.add_argument("--workers", type=int, default=None, \
+        help="With --mode async, size of the parsing process pool (default: one per CPU).")
+    parser.add_argument("--writers", type=int, default=2, \
+        help="With --mode async, number of database writers (default: 2).")
+    parser.add_argument("--pool-size", type=int, default=4, \
+        help="With --mode process, number of pooled writer connections shared by all games, "
+        "or 0 for a connection per game (default: 4).")
+    parser.add_argument("--batch-size", type=int, default=200, \
+        help="Items a pooled writer commits together at most (default: 200).")
+    parser.add_argument("--flush-interval", type=float, default=1.0, \
+        help="Seconds a pooled writer waits to fill a batch (default: 1).")
+    parser.add_argument("--max-games", type=int, default=32, \
+        help="Number of games streamed at once at most (default: 32).")
+    parser.add_argument("--priority", choices=["newest", "oldest"], default="newest", \
+        help="Which waiting game to stream when a slot frees up: the one that "
+        "appeared last on /now-playing, i.e. is just starting (the default), or the one that appeared first.")
+    parser.add_argument("--max-wait", type=float, default=120, \
+        help="Seconds after which a game still waiting for a slot is dropped "
+        "(default: 120).")
+    parser.add_argument("--max-queue-depth", type=int, default=None, \
+        help="With pooled writers or --mode async, do not start games while more items than this "
+        "wait for the writers (default: 10 per writer per game slot).")
+    parser.add_argument("--spool", default=None, metavar="DIRECTORY", \
+        help="With --mode process, only capture the games' turns to a spool in DIRECTORY, for Spool.py "
+        "to load into the database at its own pace.")
+    parser.add_argument("--metrics-port", type=int, default=None, \
+        help="Serve per-stage timings and counters in the Prometheus text format at "
+        "http://127.0.0.1:PORT/metrics.")
+    parser.add_argument("--metrics-file", default=None, \
+        help="Write the metrics, in the Prometheus text format, to this file on exit.")
+    args = parser.parse_args()
+    if args.spool is not None and args.mode == "async":
+        parser.error("--spool requires --mode process")
     
-    database_name = sys.argv[1]
-    database_user = sys.argv[2]
-    if num_args >= 4:
-        hostname = sys.argv[3]
-    else:
-        hostname = "http://vindinium.org/"
+    logger = configureLogger(getattr(_logging, args.logging_level.upper()))
     
-    if num_args >= 5:
-        logging_level = getattr(_logging, sys.argv[4].upper(), None)
-        if not isinstance(logging_level, int):
-            print("logging_level should be one of \"DEBUG\", \"INFO\", \"WARN\", \"ERROR\", \"CRITICAL\".")
-    else:
-        logging_level = _logging.INFO
-    logger = configureLogger(logging_level)
+    metrics_queue = None
+    if args.metrics_port is not None or args.metrics_file is not None:
+        metrics_queue = Queue()
+        metrics_collector = metrics.collectFrom(metrics_queue)
+        if args.metrics_port is not None:
+            metrics.serve(args.metrics_port)
+            logger.info("Serving metrics at http://127.0.0.1:" + str(args.metrics_port) + "/metrics")
     
-    stream_inserter = StreamInserter(hostname, database_name, database_user, logger)
-    stream_inserter.start()
+    if args.bulk:
+        inserter_class, inserter_options = BulkInserter, {"flush_turns": args.flush_turns}
+    else:
+        inserter_class, inserter_options = Inserter, {}
+    scheduler_options = {"max_games": args.max_games, "priority": args.priority, "max_wait": args.max_wait}
+    if args.max_queue_depth is not None:
+        scheduler_options["max_queue_depth"] = args.max_queue_depth
+    if args.mode == "async":
+        from AsyncStreamInserter import AsyncStreamInserter
+        stream_inserter = AsyncStreamInserter(args.hostname, args.database_name, args.database_user, \
+            logger, inserter_class, inserter_options, args.workers, args.writers, \
+            metrics_queue=metrics_queue, scheduler_options=scheduler_options)
+    else:
+        writer_pool = spool_queue = None
+        if args.spool is not None:
+            from Spool import SpoolWriter
+            spool_queue = Queue()
+            spool_writer = threading.Thread(target=SpoolWriter(args.spool, logger=logger).writeFrom, \
+                args=(spool_queue,))
+            spool_writer.start()
+        elif args.pool_size > 0:
+            writer_pool = WriterPool(args.database_name, args.database_user, logger, args.pool_size, \
+                args.batch_size, args.flush_interval, inserter_class=inserter_class, \
+                inserter_options=inserter_options, metrics_queue=metrics_queue)
+            writer_pool.start()
+        stream_inserter = StreamInserter(args.hostname, args.database_name, args.database_user, \
+            logger, inserter_class, inserter_options, writer_pool, metrics_queue, scheduler_options, \
+            spool_queue)
+    try:
+        stream_inserter.start()
+        if args.mode == "process" and writer_pool is not None:
+            writer_pool.stop()
+    finally:
+        if args.mode == "process" and spool_queue is not None:
+            spool_queue.put(None)
+            spool_writer.join()
+        if metrics_queue is not None:
+            metrics_queue.put(None)
+            metrics_collector.join(timeout=5)
+        if args.metrics_file is not None:
+            metrics.dump(args.metrics_file)
@@ -1,35 +1,105 @@
 import logging as _logging
+import time
+
 import requests
 
+from Metrics import metrics
+
 class Streamer():
-    
-    def __init__(self, url, logger=_logging.getLogger("Streamer")):
+
+    def __init__(self, url, logger=_logging.getLogger("Streamer"), max_event_size=2**20):
+        """ max_event_size: Largest event, in bytes, accepted from the
+        stream before a StreamerError is raised. """
         self.url = url
         req = requests.Request("GET", self.url).prepare()
         self.connection = requests.Session().send(req, stream=True)
         self.logger = logger
-    
+        self.max_event_size = max_event_size
+        self.last_event_id = None
+
     def stream(self):
-        """ Returns one line of stream data from URL. Waits if no line is on the
-        stream. """
-        while True:
-            data = ""
-            for char in self.connection.iter_content(decode_unicode=True):
-                if not char:
-                    continue
-                if len(data) > 10000:
-                    raise StreamerError("Stream data from " + self.url + " is too long!")
-                
-                if char != "\n":
-                    data += char
-                elif len(data) > 0:
-                    break
-            else:
-                # If the session finished, this generator function shout return
-                # StopIteration (which we do by breaking out of the while loop,
-                # allowing the function to end).
-                break
-            yield data.lstrip("data: ")
+        """ Returns the data of one event from URL at a time. Waits if no
+        event is on the stream. """
+        for event in self.events():
+            yield event.data
+
+    def events(self):
+        """ Like stream(), but yields the whole SSEEvent. """
+        parser = SSEParser(self.max_event_size)
+        # chunk_size=None hands over data as it arrives rather than waiting
+        # for a fixed amount, which matters for a slow, chunked event stream.
+        read_start = time.perf_counter()
+        for chunk in self.connection.iter_content(chunk_size=None):
+            # Only the wait for the chunk, not the consumer of the events
+            metrics.observe("stream_read_seconds", time.perf_counter() - read_start)
+            metrics.inc("stream_bytes_total", len(chunk))
+            try:
+                events = parser.feed(chunk)
+            except StreamerError as e:
+                raise StreamerError(str(e) + " (" + self.url + ")")
+            for event in events:
+                self.last_event_id = parser.last_event_id
+                yield event
+            read_start = time.perf_counter()
+        # If the session finished, this generator function returns, ending
+        # the iteration.
+
+class SSEEvent():
+    def __init__(self, data, id=None, event="message"):
+        self.data = data
+        self.id = id
+        self.event = event
+
+class SSEParser():
+    """ Incremental parser for a text/event-stream body, following the
+    Server-Sent Events specification: events are separated by blank lines,
+    multiple data: fields of one event are joined with newlines, and lines
+    starting with a colon are comments. """
+
+    def __init__(self, max_event_size=2**20):
+        self.max_event_size = max_event_size
+        self.last_event_id = None
+        self._buffer = bytearray()
+        self._data = []
+        self._event_type = None
+
+    def feed(self, chunk):
+        """ Add chunk (bytes) from the stream and return the list of SSEEvents
+        completed by it. """
+        self._buffer += chunk
+        end = self._buffer.rfind(b"\n")
+        if end < 0:
+            if len(self._buffer) > self.max_event_size:
+                raise StreamerError("Stream data is too long!")
+            return []
+        lines = self._buffer[:end].split(b"\n")
+        del self._buffer[:end+1]
+
+        events = []
+        for line in lines:
+            if line.endswith(b"\r"):
+                line = line[:-1]
+            if len(line) == 0:
+                if self._data:
+                    events.append(SSEEvent("\n".join(self._data), self.last_event_id, \
+                        self._event_type or "message"))
+                self._data = []
+                self._event_type = None
+                continue
+            if line.startswith(b":"):
+                continue
+            field, colon, value = line.partition(b":")
+            if value.startswith(b" "):
+                value = value[1:]
+            if field == b"data":
+                self._data.append(value.decode("utf-8"))
+            elif field == b"id":
+                self.last_event_id = value.decode("utf-8")
+            elif field == b"event":
+                self._event_type = value.decode("utf-8")
+        if sum(map(len, self._data)) + len(self._buffer) > self.max_event_size:
+            raise StreamerError("Stream data is too long!")
+        return events
 
 class StreamerError(RuntimeError):
     pass
@@ -42,4 +112,4 @@ if __name__ == "__main__":
         print(line)
     #while True:
         #print(s.stream())
-        
+
@@ -0,0 +1,209 @@
+import logging as _logging
+import queue as _queue
+import threading
+import time
+import zlib
+from multiprocessing import Process, Queue
+
+from Inserter import Inserter
+from MapStore import MapStore
+from Metrics import metrics
+
+class WriterPool():
+    """ A fixed set of writer processes, each owning one database connection.
+
+    Parsing happens wherever the games are streamed; finished rows are handed
+    to the pool with submit() and written by the writer assigned to their
+    game, so the number of Postgres connections does not grow with the number
+    of concurrent games. A writer takes up to batch_size items, or whatever
+    arrived within flush_interval seconds of the first of them, and commits
+    them together in one transaction.
+
+    If an item fails, the batch is rolled back and written again without the
+    items of its game, which is given up on: the writer forgets it and drops
+    its later items, so it is never marked finished, and the other games of
+    the batch are not affected. If the batch fails as it is written out or
+    committed, every game in it is given up on. """
+
+    def __init__(self, database_name, database_user, logger=_logging.getLogger("WriterPool"), \
+        pool_size=4, batch_size=200, flush_interval=1.0, queue_size=10000, \
+        inserter_class=Inserter, inserter_options=None, metrics_queue=None):
+        """ queue_size: Number of items that may wait for each writer before
+        submit() blocks.
+
+        metrics_queue: A multiprocessing Queue the writers forward their
+        metrics to (see Metrics.forwardTo), or None. """
+        self.database_name = database_name
+        self.database_user = database_user
+        self.logger = logger
+        self.pool_size = pool_size
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.inserter_class = inserter_class
+        self.inserter_options = inserter_options or {}
+        self.metrics_queue = metrics_queue
+        self.queues = [Queue(queue_size) for i in range(pool_size)]
+        self.processes = []
+
+    def start(self, report_interval=30):
+        """ Start the writers. Every report_interval seconds the depth of each
+        writer's queue is logged; None disables the report. """
+        for index in range(self.pool_size):
+            process = Process(target=self._runWriter, args=(index,), daemon=True)
+            process.start()
+            self.processes.append(process)
+        if report_interval is not None:
+            threading.Thread(target=self._reportQueueDepth, args=(report_interval,), daemon=True).start()
+
+    def stop(self):
+        """ Let the writers finish their queues, then stop them. """
+        for queue in self.queues:
+            queue.put(None)
+        for process in self.processes:
+            process.join()
+        self.processes = []
+
+    def submit(self, game_id, item):
+        """ Queue item for the writer of game_id. Items of one game are
+        written in the order they are submitted. Blocks while that writer's
+        queue is full. """
+        self.queues[zlib.crc32(game_id.encode("utf-8")) % self.pool_size].put(item)
+
+    def queueDepths(self):
+        """ Return the approximate number of items waiting for each writer,
+        or None where the platform cannot tell. """
+        depths = []
+        for queue in self.queues:
+            try:
+                depths.append(queue.qsize())
+            except NotImplementedError:
+                depths.append(None)
+        return depths
+
+    def queueDepth(self):
+        """ Return the approximate number of items waiting for all writers. """
+        return sum(depth or 0 for depth in self.queueDepths())
+
+    def _reportQueueDepth(self, interval):
+        while True:
+            time.sleep(interval)
+            self.logger.info("Writer queue depths: " + str(self.queueDepths()))
+
+    def _runWriter(self, index):
+        if self.metrics_queue is not None:
+            metrics.forwardTo(self.metrics_queue)
+        inserter = self.inserter_class(self.database_name, self.database_user, self.logger, \
+            **self.inserter_options)
+        inserter.defer_commits = True
+        failed_games = set() # Games given up on, whose later items are dropped
+        queue = self.queues[index]
+        running = True
+        while running:
+            batch = []
+            deadline = None
+            while len(batch) < self.batch_size:
+                try:
+                    if deadline is None:
+                        item = queue.get()
+                    else:
+                        item = queue.get(timeout=max(0, deadline - time.monotonic()))
+                except _queue.Empty:
+                    break
+                if item is None:
+                    running = False
+                    break
+                batch.append(item)
+                if deadline is None:
+                    deadline = time.monotonic() + self.flush_interval
+            if batch:
+                self._writeBatch(inserter, batch, failed_games)
+        metrics.flush()
+
+    def _writeBatch(self, inserter, batch, failed_games):
+        while True:
+            batch = [item for item in batch if WriterPool._keepItem(item, failed_games)]
+            if not batch:
+                return
+            game_ids = set(WriterPool._gameIdOf(item) for item in batch)
+            saved = inserter._saveGames(game_ids)
+            failed_item = None
+            try:
+                for item in batch:
+                    failed_item = item
+                    WriterPool._writeItem(inserter, item)
+                failed_item = None
+                inserter._flush()
+                inserter.defer_commits = False
+                inserter._commit()
+                self.logger.debug("Wrote batch of " + str(len(batch)) + " items.")
+                return
+            except Exception:
+                if failed_item is not None:
+                    self.logger.exception("Error while writing " + failed_item[0] + " of " \
+                        + WriterPool._gameIdOf(failed_item))
+                else:
+                    self.logger.exception("Error while committing a batch of " + str(len(batch)) + " items")
+                metrics.inc("errors_total")
+                inserter.rollback(game_ids)
+            finally:
+                inserter.defer_commits = True
+            given_up = game_ids if failed_item is None else {WriterPool._gameIdOf(failed_item)}
+            self.logger.error("Gave up on " + ", ".join(sorted(given_up)) + "; its rows in this batch "
+                "were rolled back and its later items are dropped.")
+            metrics.inc("games_failed_total", len(given_up))
+            failed_games |= given_up
+            inserter._restoreGames({game_id: state for game_id, state in saved.items() if game_id not in given_up})
+
+    @staticmethod
+    def _keepItem(item, failed_games):
+        """ False for the items of games given up on. Their finish item is
+        their last, after which they are no longer remembered. """
+        game_id = WriterPool._gameIdOf(item)
+        if game_id not in failed_games:
+            return True
+        if item[0] == "finish":
+            failed_games.discard(game_id)
+        return False
+
+    @staticmethod
+    def _writeItem(inserter, item):
+        kind = item[0]
+        if kind == "game":
+            inserter._insertGame(item[1])
+        elif kind == "turn":
+            inserter._writeTurn(*item[1:])
+        elif kind == "finish":
+            inserter._finishGame(*item[1:])
+
+    @staticmethod
+    def _gameIdOf(item):
+        if item[0] == "game":
+            return Inserter._parseJson(item[1])["game"]["id"]
+        if item[0] == "turn":
+            return item[1]
+        return item[1].gameId
+
+class QueuedInserter(Inserter):
+    """ Inserter that computes a game's rows in the current process but hands
+    them to a WriterPool instead of writing them itself. It opens no
+    database connection. """
+
+    def __init__(self, writer_pool, logger=_logging.getLogger("QueuedInserter")):
+        self.writer_pool = writer_pool
+        self.logger = logger
+        self.map_store = MapStore()
+        self.game_map = None
+        self.game_columns = {}
+
+    def _insertGame(self, first_turn_string):
+        game_id = Inserter._parseJson(first_turn_string)["game"]["id"]
+        self.writer_pool.submit(game_id, ("game", first_turn_string))
+
+    def _writeTurn(self, game_id, turn, hero_rows, mine_rows, arrival=None):
+        self.writer_pool.submit(game_id, ("turn", game_id, turn, hero_rows, mine_rows, arrival))
+
+    def _commitTurn(self):
+        pass
+
+    def _finishGame(self, game):
+        self.writer_pool.submit(game.gameId, ("finish", game) + self._takeGameRows(game))
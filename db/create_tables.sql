@@ -1,21 +1,47 @@
 BEGIN;
 
+-- One row per distinct map, keyed by the hex sha1 of its size and terrain
+-- (see db/MapStore.py). terrain holds the int8 Tile type of each tile, x-major,
+-- with heroes shown as air. targetFields is the zlib-compressed int16
+-- (mines + taverns, size, size) array of unobstructed distances from each
+-- mine and then each tavern, in mineLocs and tavernLocs order (x-major).
+DROP TABLE IF EXISTS Maps CASCADE;
+CREATE TABLE Maps (
+    mapHash CHAR(40) PRIMARY KEY,
+    size INT NOT NULL,
+    terrain BYTEA NOT NULL,
+    mineLocs INT[][] NOT NULL,
+    tavernLocs INT[][] NOT NULL,
+    targetFields BYTEA NOT NULL
+);
+
 DROP TABLE IF EXISTS Games CASCADE;
 CREATE TABLE Games (
     gameId VARCHAR(8) PRIMARY KEY,
     time TIMESTAMP,
     size INT NOT NULL,
     mineCount INT NOT NULL,
-    finished BOOLEAN NOT NULL
+    finished BOOLEAN NOT NULL,
+    -- Set once Partitions.py has dropped the game's Turns, Heroes and
+    -- MineSpans for being older than the retention period
+    turnsDropped BOOLEAN NOT NULL DEFAULT FALSE,
+    historicalBotIds INT[], -- HistoricalBots.id of each hero, in hero order
+    mapHash CHAR(40) REFERENCES Maps
 );
 
 DROP TABLE IF EXISTS Bots CASCADE;
 CREATE TABLE Bots(
     userId VARCHAR(8) PRIMARY KEY,
     name VARCHAR(20) UNIQUE NOT NULL,
-    elo INT NOT NULL
+    elo INT NOT NULL,
+    latestHistoricalBotId INT,
+    latestHistoricalElo INT -- elo of latestHistoricalBotId
 );
 
+-- One row per Elo a bot has had, chained through previousHistoricalBotId
+-- with Bots.latestHistoricalBotId the newest. A row is added only when a bot
+-- is first seen or its Elo changed, lastGameId being the game it was seen in;
+-- Games.historicalBotIds gives the rows of each game's heroes.
 DROP TABLE IF EXISTS HistoricalBots CASCADE;
 CREATE TABLE HistoricalBots(
     id SERIAL PRIMARY KEY,
@@ -25,6 +51,9 @@ CREATE TABLE HistoricalBots(
     previousHistoricalBotId INT REFERENCES HistoricalBots(id)
 );
 
+ALTER TABLE Bots ADD FOREIGN KEY (latestHistoricalBotId)
+    REFERENCES HistoricalBots(id) ON DELETE SET NULL;
+
 DROP TABLE IF EXISTS Turns CASCADE;
 CREATE TABLE Turns (
     id SERIAL PRIMARY KEY,
@@ -36,9 +65,13 @@ CREATE TABLE Turns (
 DROP TYPE IF EXISTS dir CASCADE;
 CREATE TYPE dir AS ENUM('North', 'South', 'East', 'West', 'Stay');
 
+-- Heroes and MineSpans are partitioned by month of gameTime, the Games.time
+-- of their game. New rows go to the DEFAULT partition until monthly ones are
+-- created by db/Partitions.py, which should be run regularly.
 DROP TABLE IF EXISTS Heroes CASCADE;
 CREATE TABLE Heroes(
-    id SERIAL PRIMARY KEY,
+    id SERIAL,
+    gameTime TIMESTAMP NOT NULL,
     userId VARCHAR(8) NOT NULL REFERENCES Bots,
     gameId VARCHAR(8) NOT NULL REFERENCES Games,
     turnId INT NOT NULL REFERENCES Turns(id),
@@ -51,22 +84,130 @@ CREATE TABLE Heroes(
     spawnPos INT[] NOT NULL,
     lastDir dir,
     crashed boolean NOT NULL,
+    -- *Distances route around other heroes; *ObstructedDistances walk
+    -- through them.
     heroDistances INT[] NOT NULL,
     heroObstructedDistances INT[] NOT NULL,
     tavernDistances INT[] NOT NULL,
     tavernObstructedDistances INT[] NOT NULL,
     mineDistances INT[] NOT NULL,
-    mineObstructedDistances INT[] NOT NULL
-);
-
-DROP TABLE IF EXISTS Mines CASCADE;
-CREATE TABLE Mines(
-    id SERIAL PRIMARY KEY,
+    mineObstructedDistances INT[] NOT NULL,
+    PRIMARY KEY (id, gameTime)
+) PARTITION BY RANGE (gameTime);
+CREATE TABLE heroes_default PARTITION OF Heroes DEFAULT;
+CREATE INDEX ON Heroes (gameId);
+CREATE INDEX ON Heroes (turnId);
+CREATE INDEX ON Heroes USING BRIN (gameTime);
+
+-- Mine ownership, one row per span of consecutive turns in which a mine had
+-- the same owner (inGameId, NULL if none). toTurn is NULL while the span is
+-- still open during ingest.
+DROP TABLE IF EXISTS MineSpans CASCADE;
+CREATE TABLE MineSpans(
     gameId VARCHAR(8) NOT NULL REFERENCES Games,
-    turnId INT NOT NULL REFERENCES Turns(id),
     mineNumber INT NOT NULL,
     pos INT[] NOT NULL,
-    heroId INT REFERENCES Heroes
+    inGameId INT,
+    fromTurn INT NOT NULL,
+    toTurn INT,
+    gameTime TIMESTAMP NOT NULL,
+    PRIMARY KEY (gameId, mineNumber, fromTurn, gameTime)
+) PARTITION BY RANGE (gameTime);
+CREATE TABLE minespans_default PARTITION OF MineSpans DEFAULT;
+CREATE INDEX ON MineSpans USING BRIN (gameTime);
+
+-- Mines used to be a table with one row per mine per turn; it is now a view
+-- of MineSpans with the same shape, less the id column.
+DO $$
+BEGIN
+    IF EXISTS (SELECT 1 FROM pg_tables WHERE tablename = 'mines') THEN
+        DROP TABLE Mines CASCADE;
+    END IF;
+END $$;
+CREATE VIEW Mines AS
+    SELECT s.gameId, t.id AS turnId, s.mineNumber, s.pos, h.id AS heroId
+    FROM MineSpans s
+    JOIN Turns t ON t.gameId = s.gameId AND t.turn >= s.fromTurn
+        AND (s.toTurn IS NULL OR t.turn <= s.toTurn)
+    LEFT JOIN Heroes h ON h.turnId = t.id AND h.inGameId = s.inGameId;
+
+DROP TYPE IF EXISTS eventKind CASCADE;
+CREATE TYPE eventKind AS ENUM('death', 'capture', 'loss', 'tavern', 'crash');
+
+-- One row per event of a game, found by game/events.py when the game ends.
+-- otherInGameId is the likely killer for deaths, the previous owner of the
+-- mine for captures and its new owner for losses.
+DROP TABLE IF EXISTS Events CASCADE;
+CREATE TABLE Events(
+    gameId VARCHAR(8) NOT NULL REFERENCES Games,
+    turn INT NOT NULL,
+    kind eventKind NOT NULL,
+    inGameId SMALLINT NOT NULL,
+    otherInGameId SMALLINT,
+    mineNumber SMALLINT
+);
+CREATE INDEX ON Events (gameId, turn);
+CREATE INDEX ON Events (kind, gameId);
+
+-- Per-bot statistics, each column a sum over the bot's finished games, added
+-- to when Inserter marks a game finished. lifespanTurns / deaths is the
+-- average lifespan and goldCurve[i] / games the average gold at i tenths of
+-- a game. BotMapStats splits them by board size and BotEloStats by the bot's
+-- Elo rounded down to a multiple of 100. Rebuild with db/BotStats.py.
+DROP TABLE IF EXISTS BotStats CASCADE;
+CREATE TABLE BotStats(
+    userId VARCHAR(8) PRIMARY KEY REFERENCES Bots,
+    games INT NOT NULL,
+    wins INT NOT NULL,
+    deaths INT NOT NULL,
+    kills INT NOT NULL,
+    crashes INT NOT NULL,
+    gold BIGINT NOT NULL,
+    mineCount BIGINT NOT NULL,
+    lifespanTurns BIGINT NOT NULL,
+    minesCaptured INT NOT NULL,
+    goldCurve BIGINT[] NOT NULL
+);
+
+DROP TABLE IF EXISTS BotMapStats CASCADE;
+CREATE TABLE BotMapStats(
+    userId VARCHAR(8) NOT NULL REFERENCES Bots,
+    size INT NOT NULL,
+    games INT NOT NULL,
+    wins INT NOT NULL,
+    deaths INT NOT NULL,
+    kills INT NOT NULL,
+    crashes INT NOT NULL,
+    gold BIGINT NOT NULL,
+    mineCount BIGINT NOT NULL,
+    lifespanTurns BIGINT NOT NULL,
+    minesCaptured INT NOT NULL,
+    goldCurve BIGINT[] NOT NULL,
+    PRIMARY KEY (userId, size)
+);
+
+DROP TABLE IF EXISTS BotEloStats CASCADE;
+CREATE TABLE BotEloStats(
+    userId VARCHAR(8) NOT NULL REFERENCES Bots,
+    eloBucket INT NOT NULL,
+    games INT NOT NULL,
+    wins INT NOT NULL,
+    deaths INT NOT NULL,
+    kills INT NOT NULL,
+    crashes INT NOT NULL,
+    gold BIGINT NOT NULL,
+    mineCount BIGINT NOT NULL,
+    lifespanTurns BIGINT NOT NULL,
+    minesCaptured INT NOT NULL,
+    goldCurve BIGINT[] NOT NULL,
+    PRIMARY KEY (userId, eloBucket)
+);
+
+DROP TABLE IF EXISTS BackfillCheckpoints CASCADE;
+CREATE TABLE BackfillCheckpoints(
+    gameId VARCHAR(8) PRIMARY KEY REFERENCES Games,
+    sourceFile TEXT NOT NULL,
+    completedAt TIMESTAMP NOT NULL
 );
 
 COMMIT;
@@ -0,0 +1,78 @@
+""" Check that building each turn with Game.advance gives the same result as
+building it from scratch with Game(state, False), for every turn of recorded
+logs, or of random synthetic games if no logs are given.
+
+Usage: python3 CheckAdvance.py {log files, directories or globs}
+       python3 CheckAdvance.py --synthetic {number of games}
+
+Run from db/local. Exits with status 1 on the first mismatch. """
+import sys
+sys.path.insert(0, "../../game")
+sys.path.insert(0, "..")
+
+import itertools
+import random
+
+import numpy as np
+
+from Backfill import gameIdOf, logFiles, readLines
+from game import Game
+from Inserter import Inserter
+from synthetic import syntheticTurns
+
+HERO_ATTRIBUTES = ("name", "heroId", "userId", "elo", "pos", "spawn_pos", "last_direction", \
+    "health", "gold", "mine_count", "crashed")
+
+def differences(expected, actual):
+    """ Return a list describing how two Games differ. """
+    found = []
+    for attribute in ("gameId", "turn", "max_turns", "hero_turn", "max_hero_turns", "finished", \
+        "mine_locs", "tavern_locs"):
+        if getattr(expected, attribute) != getattr(actual, attribute):
+            found.append(attribute)
+    for attribute in ("terrain", "owners", "passable_mask"):
+        if not np.array_equal(getattr(expected.board, attribute), getattr(actual.board, attribute)):
+            found.append("board." + attribute)
+    if list(expected.mine_locs) != list(actual.mine_locs):
+        found.append("mine_locs order")
+    for index, (expected_hero, actual_hero) in enumerate(zip(expected.heroes, actual.heroes)):
+        for attribute in HERO_ATTRIBUTES:
+            if getattr(expected_hero, attribute) != getattr(actual_hero, attribute):
+                found.append("heroes[" + str(index) + "]." + attribute)
+    return found
+
+def checkGame(turn_strings):
+    """ Return (number of turns checked, list of (turn, differences)). """
+    game = None
+    mismatches = []
+    turns = 0
+    for turn_string in turn_strings:
+        state = Inserter._parseJson(turn_string)
+        expected = Game(state, False)
+        game = expected if game is None else game.advance(state)
+        found = differences(expected, game)
+        if found:
+            mismatches.append((expected.turn, found))
+        turns += 1
+    return turns, mismatches
+
+if __name__ == "__main__":
+    if len(sys.argv) >= 2 and sys.argv[1] == "--synthetic":
+        count = int(sys.argv[2]) if len(sys.argv) >= 3 else 20
+        rng = random.Random()
+        games = [("synthetic " + str(seed), syntheticTurns(rng.choice((12, 18, 24, 28)), 300, seed=seed)) \
+            for seed in (rng.randrange(2**31) for i in range(count))]
+    else:
+        games = ((path + " " + str(game_id), turn_strings) for path in logFiles(sys.argv[1:]) \
+            for game_id, turn_strings in itertools.groupby(readLines(path), gameIdOf))
+    
+    checked_games = checked_turns = 0
+    for name, turn_strings in games:
+        turns, mismatches = checkGame(turn_strings)
+        checked_games += 1
+        checked_turns += turns
+        if mismatches:
+            turn, found = mismatches[0]
+            print(name + ": turn " + str(turn) + " differs in " + ", ".join(found))
+            sys.exit(1)
+    print("Checked " + str(checked_turns) + " turns of " + str(checked_games) + " games: no differences.")
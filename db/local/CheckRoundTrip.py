@@ -0,0 +1,86 @@
+""" Check that exporting games with GameExport and importing the replay files
+into another database reproduces them: the same Games, Turns, Heroes
+(distances included), MineSpans, Events, maps and Elo in each game. Ids,
+Games.time and the HistoricalBots chain are the importing database's own
+and are not compared.
+
+Usage: python3 CheckRoundTrip.py <source-database> <target-database> <database-user> {options}
+
+The target database must have the tables of create_tables.sql and none of
+the games checked. Run from db/local. Exits with status 1 on the first
+mismatch. """
+import sys
+sys.path.insert(0, "../../game")
+sys.path.insert(0, "..")
+
+import argparse
+import tempfile
+
+import psycopg2 as psycopg
+
+from ArchiveExporter import ArchiveExporter
+from GameExport import GameExport
+
+# Each query reads one game's rows in an order that does not depend on ids.
+QUERIES = {
+    "Games": "SELECT size, mineCount, finished, mapHash FROM Games WHERE gameId = %s;",
+    "Maps": "SELECT m.size, m.terrain, m.mineLocs, m.tavernLocs, m.targetFields "
+        "FROM Maps m JOIN Games g ON g.mapHash = m.mapHash WHERE g.gameId = %s;",
+    "Turns": "SELECT turn FROM Turns WHERE gameId = %s ORDER BY turn;",
+    "Heroes": "SELECT t.turn, h.inGameId, h.userId, h.life, h.gold, h.mineCount, h.died, h.pos, "
+        "    h.spawnPos, h.lastDir, h.crashed, h.heroDistances, h.heroObstructedDistances, "
+        "    h.tavernDistances, h.tavernObstructedDistances, h.mineDistances, h.mineObstructedDistances "
+        "FROM Turns t JOIN Heroes h ON h.turnId = t.id WHERE t.gameId = %s ORDER BY t.turn, h.inGameId;",
+    "MineSpans": "SELECT mineNumber, pos, inGameId, fromTurn, toTurn FROM MineSpans "
+        "WHERE gameId = %s ORDER BY mineNumber, fromTurn;",
+    "Events": "SELECT turn, kind, inGameId, otherInGameId, mineNumber FROM Events "
+        "WHERE gameId = %s ORDER BY turn, kind, inGameId, otherInGameId, mineNumber;",
+}
+
+def gameRows(db, game_id):
+    """ Return {table: rows} for one game, plus its bots' names and Elo. """
+    rows = {}
+    for table, query in QUERIES.items():
+        db.execute(query, (game_id,))
+        rows[table] = [tuple(bytes(value) if isinstance(value, memoryview) else value for value in row) \
+            for row in db.fetchall()]
+    rows["Bots"] = sorted(ArchiveExporter.gameBots(db, game_id).items())
+    return rows
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export games from one database, import them into another "
+        "and compare the two.")
+    parser.add_argument("source_database")
+    parser.add_argument("target_database")
+    parser.add_argument("database_user")
+    parser.add_argument("--games", nargs="+", default=None, help="Games to check (default: every finished game).")
+    parser.add_argument("--bulk", action="store_true", help="Import with BulkInserter.")
+    parser.add_argument("--processes", type=int, default=None)
+    args = parser.parse_args()
+
+    source = psycopg.connect("dbname=" + args.source_database + " user=" + args.database_user).cursor()
+    target = psycopg.connect("dbname=" + args.target_database + " user=" + args.database_user).cursor()
+    game_ids = args.games
+    if game_ids is None:
+        source.execute("SELECT gameId FROM Games WHERE finished AND mapHash IS NOT NULL AND NOT turnsDropped "
+            "ORDER BY gameId;")
+        game_ids = [row[0] for row in source.fetchall()]
+
+    with tempfile.TemporaryDirectory() as directory:
+        written, skipped = GameExport(args.source_database, args.database_user).exportGames(directory, game_ids)
+        inserted, already_inserted = GameExport.importFiles(args.target_database, args.database_user, \
+            directory, args.processes, args.bulk)
+    print("Exported " + str(written) + " games (" + str(skipped) + " without a map), imported " \
+        + str(inserted) + ".")
+    if skipped or already_inserted or inserted != written:
+        print("Not every game was exported and imported.")
+        sys.exit(1)
+
+    for game_id in game_ids:
+        expected, actual = gameRows(source, game_id), gameRows(target, game_id)
+        for table in expected:
+            if expected[table] != actual[table]:
+                print(game_id + ": " + table + " differs (" + str(len(expected[table])) + " rows exported, " \
+                    + str(len(actual[table])) + " imported).")
+                sys.exit(1)
+    print("Checked " + str(len(game_ids)) + " games: no differences.")
@@ -0,0 +1,163 @@
+""" End-to-end ingestion load test: runs StreamInserter against a local
+MockServer and a local Postgres database, and reports games/sec, turns/sec,
+the lag between a turn being sent and it being committed, and the peak RSS
+of StreamInserter and all of its child processes.
+
+Lag is measured by polling Turns, so it is only as precise as
+--poll-interval. Peak RSS is read from /proc, so it needs Linux.
+
+The games are deleted afterwards and their bots restored (see
+BotRegistry.restoreBots), so use a database that nothing else writes to.
+
+Usage: python3 LoadTest.py <database-name> <database-user> {options} [-- StreamInserter options]
+
+Run from db/local. """
+import sys
+sys.path.insert(0, "../../game")
+sys.path.insert(0, "..")
+
+import argparse
+import json
+import os
+import subprocess
+import time
+
+import psycopg2 as psycopg
+
+import MockServer
+from BotRegistry import BotRegistry
+from Spool import turnOf
+
+def processTree(root_pid):
+    """ Return the pids of root_pid and all of its descendants. """
+    children = {}
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open("/proc/" + entry + "/stat") as stat:
+                # The command name may contain spaces; ppid follows it.
+                ppid = int(stat.read().rsplit(")", 1)[1].split()[1])
+        except (OSError, IndexError, ValueError):
+            continue
+        children.setdefault(ppid, []).append(int(entry))
+    pids = [root_pid]
+    for pid in pids:
+        pids.extend(children.get(pid, []))
+    return pids
+
+def rssBytes(pids):
+    total = 0
+    for pid in pids:
+        try:
+            with open("/proc/" + str(pid) + "/status") as status:
+                for line in status:
+                    if line.startswith("VmRSS:"):
+                        total += int(line.split()[1]) * 1024
+        except OSError:
+            pass
+    return total
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(fraction * len(values)))] if values else float("nan")
+
+class LoadTest():
+    def __init__(self, mock_server, database_name, database_user, stream_inserter_args=(), \
+        poll_interval=0.25, timeout=None):
+        self.mock_server = mock_server
+        self.database_name = database_name
+        self.database_user = database_user
+        self.stream_inserter_args = list(stream_inserter_args)
+        self.poll_interval = poll_interval
+        self.timeout = timeout
+        self.connection = psycopg.connect("dbname=" + database_name + " user=" + database_user)
+        self.db = self.connection.cursor()
+        user_ids = set(hero["userId"] for game in mock_server.games \
+            for hero in json.loads(game.turn_strings[0])["heroes"] if hero.get("userId") is not None)
+        self.saved_bots = BotRegistry.saveBots(self.db, user_ids)
+        self.connection.commit()
+
+    def run(self):
+        game_ids = [game.game_id for game in self.mock_server.games]
+        # Logs may start mid-game, so count each game's turns from its first one
+        first_turns = {game.game_id: turnOf(game.turn_strings[0]) for game in self.mock_server.games}
+        committed = {game_id: first_turns[game_id] - 1 for game_id in game_ids}
+        lags = []
+        peak_rss = 0
+
+        self.mock_server.start()
+        start = time.time()
+        process = subprocess.Popen([sys.executable, "StreamInserter.py", self.database_name, \
+            self.database_user, self.mock_server.url, "warn"] + self.stream_inserter_args, cwd="..")
+        try:
+            while True:
+                time.sleep(self.poll_interval)
+                peak_rss = max(peak_rss, rssBytes(processTree(process.pid)))
+                now = time.time()
+                self.db.execute(
+                    "SELECT gameId, max(turn) FROM Turns WHERE gameId = ANY(%s) GROUP BY gameId;",
+                    (game_ids,))
+                for game_id, max_turn in self.db.fetchall():
+                    game = self.mock_server.games_by_id[game_id]
+                    for turn in range(committed[game_id] + 1, max_turn + 1):
+                        if turn in game.sent_times:
+                            lags.append(now - game.sent_times[turn])
+                    committed[game_id] = max(committed[game_id], max_turn)
+                self.db.execute("SELECT count(*) FROM Games WHERE finished AND gameId = ANY(%s);", \
+                    (game_ids,))
+                finished_games = self.db.fetchone()[0]
+                self.connection.commit()
+                if finished_games == len(game_ids) or process.poll() is not None \
+                    or (self.timeout is not None and now - start > self.timeout):
+                    break
+            elapsed = time.time() - start
+        finally:
+            if process.poll() is None:
+                process.terminate()
+                process.wait()
+            self.mock_server.stop()
+
+        turns = sum(committed[game_id] - first_turns[game_id] + 1 for game_id in game_ids)
+        return {"games": finished_games, "elapsed": elapsed, "games_per_sec": finished_games / elapsed, \
+            "turns": turns, "turns_per_sec": turns / elapsed, "lag_p50": percentile(lags, 0.5), \
+            "lag_p95": percentile(lags, 0.95), "lag_max": max(lags) if lags else float("nan"), \
+            "peak_rss": peak_rss}
+
+    def deleteGames(self):
+        game_ids = [game.game_id for game in self.mock_server.games]
+        for table in ("Events", "MineSpans", "Heroes", "Turns"):
+            self.db.execute("DELETE FROM " + table + " WHERE gameId = ANY(%s);", (game_ids,))
+        BotRegistry.restoreBots(self.db, self.saved_bots, game_ids)
+        self.db.execute("DELETE FROM Games WHERE gameId = ANY(%s);", (game_ids,))
+        self.connection.commit()
+
+if __name__ == "__main__":
+    argv = sys.argv[1:]
+    stream_inserter_args = []
+    if "--" in argv:
+        stream_inserter_args = argv[argv.index("--")+1:]
+        argv = argv[:argv.index("--")]
+    parser = argparse.ArgumentParser(description="Load test StreamInserter against a local mock server. "
+        "Arguments after -- are passed on to StreamInserter.py.")
+    parser.add_argument("database_name")
+    parser.add_argument("database_user")
+    MockServer.addArguments(parser)
+    parser.add_argument("--poll-interval", type=float, default=0.25)
+    parser.add_argument("--timeout", type=float, default=None, help="Give up after this many seconds.")
+    parser.add_argument("--keep", action="store_true", help="Keep the inserted games afterwards.")
+    args = parser.parse_args(argv)
+
+    load_test = LoadTest(MockServer.serverFromArguments(args), args.database_name, args.database_user, \
+        stream_inserter_args, args.poll_interval, args.timeout)
+    try:
+        result = load_test.run()
+    finally:
+        if not args.keep:
+            load_test.deleteGames()
+    print("Games:     %d in %.1f s (%.2f games/sec)" % (result["games"], result["elapsed"], \
+        result["games_per_sec"]))
+    print("Turns:     %d (%.0f turns/sec)" % (result["turns"], result["turns_per_sec"]))
+    print("Lag:       p50 %.3f s, p95 %.3f s, max %.3f s" % (result["lag_p50"], result["lag_p95"], \
+        result["lag_max"]))
+    print("Peak RSS:  %.1f MB" % (result["peak_rss"] / 1e6))
@@ -0,0 +1,199 @@
+""" A local stand-in for the Vindinium server, for load testing StreamInserter
+without vindinium.org.
+
+It serves /now-playing and /events/<gameId> as chunked text/event-stream
+responses, replaying recorded logs or synthetic games. Up to `concurrency`
+games are live at a time, each emitting `turn_rate` turns per second; when a
+game ends the next one starts, and once every game has ended /now-playing
+ends too.
+
+Usage: python3 MockServer.py {options}, run from db/local. See --help. """
+import sys
+sys.path.insert(0, "../../game")
+sys.path.insert(0, "..")
+
+import argparse
+import itertools
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from Backfill import gameIdOf, logFiles, readLines
+from Spool import turnOf
+from synthetic import syntheticTurns
+
+class MockGame():
+    def __init__(self, game_id, turn_strings):
+        self.game_id = game_id
+        self.turn_strings = turn_strings
+        self.start_time = None
+        self.end_time = None
+        # Time each turn was first written to a client, by turn number. Logs may
+        # start mid-game, so turn numbers need not match positions in turn_strings.
+        self.sent_times = {}
+
+class MockServer():
+    def __init__(self, games, concurrency=10, turn_rate=10.0, now_playing_interval=1.0, \
+        host="127.0.0.1", port=0):
+        """ games: list of (gameId, list of turn strings).
+
+        turn_rate: Turns per second each live game emits.
+
+        now_playing_interval: Seconds between /now-playing events. """
+        self.games = [MockGame(game_id, turn_strings) for game_id, turn_strings in games]
+        self.games_by_id = {game.game_id: game for game in self.games}
+        self.concurrency = concurrency
+        self.turn_rate = turn_rate
+        self.now_playing_interval = now_playing_interval
+        self.condition = threading.Condition()
+        self.server = ThreadingHTTPServer((host, port), self._handlerClass())
+        self.server.daemon_threads = True
+
+    @property
+    def url(self):
+        return "http://%s:%d" % self.server.server_address
+
+    def start(self):
+        """ Serve from a background thread and start the first games. """
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        threading.Thread(target=self._schedule, daemon=True).start()
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def liveGameIds(self):
+        now = time.time()
+        return [game.game_id for game in self.games \
+            if game.start_time is not None and game.end_time > now]
+
+    def finished(self):
+        now = time.time()
+        return all(game.end_time is not None and game.end_time <= now for game in self.games)
+
+    def _schedule(self):
+        """ Start games so that `concurrency` are live at once. """
+        pending = list(self.games)
+        while pending:
+            now = time.time()
+            live = sum(1 for game in self.games \
+                if game.start_time is not None and game.end_time > now)
+            with self.condition:
+                for game in pending[:max(0, self.concurrency - live)]:
+                    game.start_time = now
+                    game.end_time = now + (len(game.turn_strings) - 1) / self.turn_rate
+                    pending.remove(game)
+                self.condition.notify_all()
+            time.sleep(min(0.05, 1.0 / self.turn_rate))
+
+    def _handlerClass(self):
+        mock = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_GET(self):
+                if self.path.rstrip("/").endswith("/now-playing"):
+                    self._startStream()
+                    self._nowPlaying()
+                elif "/events/" in self.path:
+                    game = mock.games_by_id.get(self.path.rstrip("/").rsplit("/", 1)[-1])
+                    if game is None:
+                        self.send_error(404)
+                        return
+                    self._startStream()
+                    self._events(game)
+                else:
+                    self.send_error(404)
+                    return
+                self.wfile.write(b"0\r\n\r\n")
+
+            def _startStream(self):
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream")
+                self.send_header("Transfer-Encoding", "chunked")
+                self.end_headers()
+
+            def _send(self, data):
+                chunk = b"data: " + data.encode("utf-8") + b"\n\n"
+                self.wfile.write(b"%x\r\n%s\r\n" % (len(chunk), chunk))
+                self.wfile.flush()
+
+            def _nowPlaying(self):
+                while not mock.finished():
+                    self._send(json.dumps(mock.liveGameIds()))
+                    time.sleep(mock.now_playing_interval)
+
+            def _events(self, game):
+                with mock.condition:
+                    while game.start_time is None:
+                        mock.condition.wait()
+                for index, turn_string in enumerate(game.turn_strings):
+                    delay = game.start_time + index / mock.turn_rate - time.time()
+                    if delay > 0:
+                        time.sleep(delay)
+                    self._send(turn_string)
+                    game.sent_times.setdefault(turnOf(turn_string), time.time())
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+def recordedGames(patterns):
+    """ Load the games of recorded logs as (gameId, turn strings) pairs. """
+    games = []
+    for path in logFiles(patterns):
+        for game_id, turn_strings in itertools.groupby(readLines(path), gameIdOf):
+            if game_id is not None:
+                games.append((game_id, list(turn_strings)))
+    return games
+
+def syntheticGames(count, size=18, max_turns=1200, seed=0):
+    """ Generate count synthetic games with unique 8 character ids. """
+    prefix = "".join(random.Random(seed).choice("abcdefghijklmnopqrstuvwxyz") for i in range(3))
+    games = []
+    for index in range(count):
+        game_id = "m" + prefix + "%04d" % index
+        games.append((game_id, list(syntheticTurns(size, max_turns, seed=seed+index, game_id=game_id))))
+    return games
+
+def addArguments(parser):
+    """ Add the options describing which games to serve to parser. """
+    parser.add_argument("--logs", nargs="+", default=None, \
+        help="Replay these recorded logs (files, directories or globs) instead of synthetic games.")
+    parser.add_argument("--games", type=int, default=20, help="Number of synthetic games (default: 20).")
+    parser.add_argument("--size", type=int, default=18, help="Board size of synthetic games (default: 18).")
+    parser.add_argument("--max-turns", type=int, default=1200, \
+        help="Turns of synthetic games (default: 1200).")
+    parser.add_argument("--seed", type=int, default=None, \
+        help="Seed for synthetic games (default: random, so game ids do not clash between runs).")
+    parser.add_argument("--concurrency", type=int, default=10, help="Games live at once (default: 10).")
+    parser.add_argument("--turn-rate", type=float, default=10.0, \
+        help="Turns per second per game (default: 10).")
+
+def serverFromArguments(args, port=0):
+    if args.logs:
+        games = recordedGames(args.logs)
+    else:
+        seed = args.seed if args.seed is not None else random.randrange(2**31)
+        games = syntheticGames(args.games, args.size, args.max_turns, seed)
+    return MockServer(games, args.concurrency, args.turn_rate, port=port)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve recorded or synthetic games like the Vindinium server.")
+    addArguments(parser)
+    parser.add_argument("--port", type=int, default=9000)
+    args = parser.parse_args()
+
+    mock_server = serverFromArguments(args, args.port)
+    mock_server.start()
+    print("Serving " + str(len(mock_server.games)) + " games on " + mock_server.url)
+    try:
+        while not mock_server.finished():
+            time.sleep(1)
+    except KeyboardInterrupt:
+        pass
+    mock_server.stop()
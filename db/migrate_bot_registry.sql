@@ -0,0 +1,24 @@
+-- Converts a database created before Inserter kept bots in a BotRegistry:
+-- Bots gains latestHistoricalBotId and latestHistoricalElo, set to the head
+-- of each bot's chain of HistoricalBots and its Elo, and Games gains
+-- historicalBotIds. Games inserted before
+-- the conversion keep a NULL historicalBotIds, their bots being found by
+-- HistoricalBots.lastGameId as before. Run once with
+-- psql -d vindinium -f db/migrate_bot_registry.sql while nothing is inserting.
+BEGIN;
+
+ALTER TABLE Games ADD COLUMN historicalBotIds INT[];
+ALTER TABLE Bots ADD COLUMN latestHistoricalBotId INT
+    REFERENCES HistoricalBots(id) ON DELETE SET NULL;
+ALTER TABLE Bots ADD COLUMN latestHistoricalElo INT;
+
+UPDATE Bots b
+    SET latestHistoricalBotId = head.id, latestHistoricalElo = head.elo
+FROM (SELECT DISTINCT ON (hb.userId) hb.userId, hb.id, hb.elo
+    FROM HistoricalBots hb
+    LEFT JOIN HistoricalBots hb_later ON hb_later.previousHistoricalBotId = hb.id
+    WHERE hb_later.id IS NULL
+    ORDER BY hb.userId, hb.id DESC) AS head
+WHERE b.userId = head.userId;
+
+COMMIT;
@@ -0,0 +1,18 @@
+-- Converts a database created before the Maps table existed. Games inserted
+-- before the conversion keep a NULL mapHash, since their terrain was never
+-- stored. Run once with psql -d vindinium -f db/migrate_maps.sql while
+-- nothing is inserting.
+BEGIN;
+
+CREATE TABLE Maps (
+    mapHash CHAR(40) PRIMARY KEY,
+    size INT NOT NULL,
+    terrain BYTEA NOT NULL,
+    mineLocs INT[][] NOT NULL,
+    tavernLocs INT[][] NOT NULL,
+    targetFields BYTEA NOT NULL
+);
+
+ALTER TABLE Games ADD COLUMN mapHash CHAR(40) REFERENCES Maps;
+
+COMMIT;
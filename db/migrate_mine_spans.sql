@@ -0,0 +1,48 @@
+-- Converts a database created before MineSpans existed: the per-turn Mines
+-- table is collapsed into MineSpans and replaced by the compatibility view.
+-- Run once with psql -d vindinium -f db/migrate_mine_spans.sql while nothing
+-- is inserting, then partition Heroes and MineSpans with
+-- python3 Partitions.py vindinium <user> migrate (from db/).
+BEGIN;
+
+CREATE TABLE MineSpans(
+    gameId VARCHAR(8) NOT NULL REFERENCES Games,
+    mineNumber INT NOT NULL,
+    pos INT[] NOT NULL,
+    inGameId INT,
+    fromTurn INT NOT NULL,
+    toTurn INT,
+    gameTime TIMESTAMP NOT NULL,
+    PRIMARY KEY (gameId, mineNumber, fromTurn, gameTime)
+);
+
+-- Number the runs of turns with the same owner, then collapse each run.
+INSERT INTO MineSpans (gameId, mineNumber, pos, inGameId, fromTurn, toTurn, gameTime)
+SELECT gameId, mineNumber, min(pos), inGameId, min(turn), max(turn), gameTime
+FROM (
+    SELECT gameId, mineNumber, pos, inGameId, turn, gameTime,
+        sum(changed) OVER (PARTITION BY gameId, mineNumber ORDER BY turn) AS span
+    FROM (
+        SELECT m.gameId, m.mineNumber, m.pos, h.inGameId, t.turn,
+            COALESCE(g.time, 'epoch') AS gameTime,
+            CASE WHEN h.inGameId IS NOT DISTINCT FROM lag(h.inGameId)
+                OVER (PARTITION BY m.gameId, m.mineNumber ORDER BY t.turn)
+                THEN 0 ELSE 1 END AS changed
+        FROM Mines m
+        JOIN Turns t ON t.id = m.turnId
+        JOIN Games g ON g.gameId = m.gameId
+        LEFT JOIN Heroes h ON h.id = m.heroId
+    ) AS owners
+) AS spans
+GROUP BY gameId, mineNumber, inGameId, span, gameTime;
+
+DROP TABLE Mines;
+
+CREATE VIEW Mines AS
+    SELECT s.gameId, t.id AS turnId, s.mineNumber, s.pos, h.id AS heroId
+    FROM MineSpans s
+    JOIN Turns t ON t.gameId = s.gameId AND t.turn >= s.fromTurn
+        AND (s.toTurn IS NULL OR t.turn <= s.toTurn)
+    LEFT JOIN Heroes h ON h.turnId = t.id AND h.inGameId = s.inGameId;
+
+COMMIT;
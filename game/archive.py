@@ -0,0 +1,217 @@
+""" A columnar on-disk archive of games, for analysing many games without a
+database.
+
+Each game is a directory named after its game id holding a meta.json file
+and one .npy file per column. Columns are memory-mapped when read, so
+queries over thousands of games only touch the pages they need and never
+copy the data into Python objects. For T recorded turns, H heroes and M
+mines the columns are:
+
+    turn              (T,)      int32   turn number of each row
+    hero_life         (T, H)    int16
+    hero_gold         (T, H)    int32
+    hero_pos          (T, H, 2) int16   (x, y), as in Hero.pos
+    hero_mine_count   (T, H)    int16
+    hero_died         (T, H)    bool    died between the previous row and this one
+    hero_crashed      (T, H)    bool
+    mine_owner        (T, M)    int8    hero id, or Board.NO_HERO
+    terrain           (S, S)    int8    static terrain (heroes shown as air);
+                                        absent if unknown
+
+Mines are in game.mine_locs order, so mine i is mine number i+1 of the
+Mines table.
+
+Usage: python3 archive.py <archive directory>, which prints the average hero
+lifespan and mine hold time of every finished game archived there. """
+import json
+import os
+import sys
+import time
+
+import numpy as np
+
+from game import Board, DistanceCache, Game
+
+FORMAT_VERSION = 1
+
+HERO_COLUMNS = {"hero_life": np.int16, "hero_gold": np.int32, "hero_pos": np.int16, \
+    "hero_mine_count": np.int16, "hero_died": np.bool_, "hero_crashed": np.bool_}
+
+class GameArchiveWriter:
+    """ Collects the turns of one game and writes them as an archive. """
+
+    def __init__(self):
+        self.previous_game = None
+        self.meta = None
+        self.terrain = None
+        self.columns = {name: [] for name in ("turn", "mine_owner") + tuple(HERO_COLUMNS)}
+
+    def startGame(self, game_id, size, max_turns, heroes, mine_locs, tavern_locs, terrain=None):
+        """ Describe the game, for sources other than Game objects. heroes:
+        list of dicts with heroId, userId, name and elo keys. terrain: the
+        static terrain as returned by DistanceCache.staticTerrain, or None if
+        it is unknown. """
+        self.meta = {"version": FORMAT_VERSION, "gameId": game_id, "size": size, \
+            "maxTurns": max_turns, "heroes": heroes, "mines": [list(loc) for loc in mine_locs], \
+            "taverns": [list(loc) for loc in tavern_locs], "finished": False}
+        self.terrain = terrain
+
+    def append(self, game, dead_heroes=None):
+        """ Add the next turn of the game. dead_heroes: the heroes that died
+        since the previous turn; by default they are detected against the
+        previously appended turn with Game.getFreshlyDeadHeroes. """
+        if self.meta is None:
+            self.startGame(game.gameId, game.board.size, game.max_turns, [{"heroId": hero.heroId, \
+                "userId": hero.userId, "name": hero.name, "elo": hero.elo} for hero in game.heroes], \
+                game.mine_locs, game.tavern_locs, DistanceCache.staticTerrain(game.board))
+        if dead_heroes is None:
+            if self.previous_game is not None and self.previous_game.turn + 1 == game.turn:
+                dead_heroes = Game.getFreshlyDeadHeroes(self.previous_game, game)
+            else:
+                dead_heroes = []
+        mine_xs = [x for x, y in game.mine_locs]
+        mine_ys = [y for x, y in game.mine_locs]
+        self.appendRow(game.turn, [hero.health for hero in game.heroes], \
+            [hero.gold for hero in game.heroes], [hero.pos for hero in game.heroes], \
+            [hero.mine_count for hero in game.heroes], [hero in dead_heroes for hero in game.heroes], \
+            [hero.crashed for hero in game.heroes], game.board.owners[mine_xs, mine_ys])
+        self.meta["finished"] = game.finished
+        self.previous_game = game
+
+    def appendRow(self, turn, life, gold, pos, mine_count, died, crashed, mine_owner):
+        """ Add one turn given as per-hero and per-mine sequences, for sources
+        other than Game objects. Heroes are in heroId order and mines in the
+        order given to startGame. """
+        for name, values in (("turn", turn), ("hero_life", life), ("hero_gold", gold), \
+            ("hero_pos", pos), ("hero_mine_count", mine_count), ("hero_died", died), \
+            ("hero_crashed", crashed), ("mine_owner", mine_owner)):
+            self.columns[name].append(values)
+
+    def finish(self, finished=True):
+        self.meta["finished"] = finished
+
+    def arrays(self):
+        """ Return the columns collected so far as a dict of arrays, without
+        terrain. """
+        mine_count = len(self.meta["mines"])
+        arrays = {"turn": np.array(self.columns["turn"], dtype=np.int32), \
+            "mine_owner": np.array(self.columns["mine_owner"], dtype=np.int8) \
+            .reshape(len(self.columns["turn"]), mine_count)}
+        for name, dtype in HERO_COLUMNS.items():
+            arrays[name] = np.array(self.columns[name], dtype=dtype)
+        return arrays
+
+    def write(self, root):
+        """ Write the game to root/<gameId>, replacing any existing archive of
+        it. Returns the directory written. """
+        directory = os.path.join(root, self.meta["gameId"])
+        os.makedirs(directory, exist_ok=True)
+        arrays = self.arrays()
+        if self.terrain is not None:
+            arrays["terrain"] = np.asarray(self.terrain, dtype=np.int8)
+        elif os.path.exists(os.path.join(directory, "terrain.npy")):
+            os.remove(os.path.join(directory, "terrain.npy"))
+        for name, array in arrays.items():
+            np.save(os.path.join(directory, name + ".npy"), array)
+        meta = dict(self.meta, turns=len(arrays["turn"]))
+        # meta.json is written last, so a game without one is incomplete
+        with open(os.path.join(directory, "meta.json.tmp"), "w") as meta_file:
+            json.dump(meta, meta_file)
+        os.replace(os.path.join(directory, "meta.json.tmp"), os.path.join(directory, "meta.json"))
+        return directory
+
+class GameArchive:
+    """ One archived game. Columns are attributes, memory-mapped on first
+    use; see the module docstring for their layout. """
+
+    def __init__(self, directory):
+        self.directory = directory
+        with open(os.path.join(directory, "meta.json")) as meta_file:
+            self.meta = json.load(meta_file)
+        self.gameId = self.meta["gameId"]
+        self.size = self.meta["size"]
+        self.finished = self.meta["finished"]
+        self.mine_locs = [tuple(loc) for loc in self.meta["mines"]]
+        self.tavern_locs = [tuple(loc) for loc in self.meta["taverns"]]
+
+    def __getattr__(self, name):
+        path = os.path.join(self.__dict__["directory"], name + ".npy")
+        if name.startswith("_") or not os.path.exists(path):
+            if name == "terrain":
+                return None
+            raise AttributeError(name)
+        array = np.load(path, mmap_mode="r")
+        setattr(self, name, array)
+        return array
+
+    def arrays(self):
+        """ Return the columns other than terrain as a dict of arrays. """
+        return {name: getattr(self, name) for name in ("turn", "mine_owner") + tuple(HERO_COLUMNS)}
+
+    def lifespans(self):
+        """ Return the length in turns of every completed life of every hero,
+        i.e. from the start of the game or a respawn until a death. Lives
+        still running at the end of the recording are left out. """
+        lifespans = []
+        for hero in range(self.hero_died.shape[1]):
+            deaths = self.turn[np.flatnonzero(self.hero_died[:, hero])]
+            lifespans.append(np.diff(deaths, prepend=self.turn[0]))
+        return np.concatenate(lifespans) if lifespans else np.zeros(0, dtype=np.int32)
+
+    def mineHoldTimes(self):
+        """ Return the length in turns of every period a hero owned a mine.
+        Periods still running at the end of the recording are included. """
+        owners = np.asarray(self.mine_owner)
+        if owners.size == 0:
+            return np.zeros(0, dtype=np.int32)
+        # A run starts wherever the owner differs from the previous row's.
+        starts = np.ones(owners.shape, dtype=bool)
+        starts[1:] = owners[1:] != owners[:-1]
+        turns = np.asarray(self.turn)
+        hold_times = []
+        for mine in range(owners.shape[1]):
+            run_starts = np.flatnonzero(starts[:, mine])
+            run_ends = np.append(turns[run_starts[1:]], turns[-1] + 1)
+            owned = owners[run_starts, mine] != Board.NO_HERO
+            hold_times.append((run_ends - turns[run_starts])[owned])
+        return np.concatenate(hold_times)
+
+class Archive:
+    """ A directory of archived games. """
+
+    def __init__(self, root):
+        self.root = root
+
+    def gameIds(self):
+        return sorted(name for name in os.listdir(self.root) \
+            if os.path.exists(os.path.join(self.root, name, "meta.json")))
+
+    def games(self, finished_only=True):
+        """ Yield a GameArchive for every complete archived game, by default
+        only games that were played to the end. """
+        for game_id in self.gameIds():
+            game = GameArchive(os.path.join(self.root, game_id))
+            if game.finished or not finished_only:
+                yield game
+
+    def game(self, game_id):
+        return GameArchive(os.path.join(self.root, game_id))
+
+    def averageHeroLifespan(self):
+        """ Average number of turns a hero lives before dying. """
+        lifespans = [game.lifespans() for game in self.games()]
+        lifespans = np.concatenate(lifespans) if lifespans else np.zeros(0)
+        return float(lifespans.mean()) if len(lifespans) else float("nan")
+
+    def averageMineHoldTime(self):
+        """ Average number of turns a mine is owned by the same hero. """
+        hold_times = [game.mineHoldTimes() for game in self.games()]
+        hold_times = np.concatenate(hold_times) if hold_times else np.zeros(0)
+        return float(hold_times.mean()) if len(hold_times) else float("nan")
+
+if __name__ == "__main__":
+    archive = Archive(sys.argv[1])
+    start = time.time()
+    print("Average hero lifespan: %.1f turns" % archive.averageHeroLifespan())
+    print("Average mine hold time: %.1f turns" % archive.averageMineHoldTime())
+    print("%d games in %.2f s" % (len(archive.gameIds()), time.time() - start))
@@ -0,0 +1,102 @@
+""" Extracts the events of a whole game (deaths, mine captures and losses,
+tavern visits and crashes) from its turns as arrays, in one vectorized pass
+instead of comparing Game objects turn by turn.
+
+The input is the columns of a game as stored by archive.py: turn, hero_life,
+hero_gold, hero_pos, hero_mine_count, hero_crashed and mine_owner. Only
+consecutive turns are compared, so turns missing from a recording produce no
+events. Between turn t-1 and turn t it is hero (t-1) % 4 + 1 that moves. """
+import numpy as np
+
+from game import Board, Game
+
+# Event kinds, in the order of the Events.kind enum of create_tables.sql
+DEATH, CAPTURE, LOSS, TAVERN, CRASH = range(5)
+KIND_NAMES = ("death", "capture", "loss", "tavern", "crash")
+
+""" heroId: the hero the event happened to.
+otherHeroId: for deaths the likely killer, for captures the previous owner
+of the mine and for losses its new owner; Board.NO_HERO if there is none.
+mineNumber: for captures and losses, the mine's index in mine_owner plus
+one (as in the Mines table), otherwise 0. """
+EVENT_DTYPE = np.dtype([("turn", np.int32), ("kind", np.int8), ("heroId", np.int8), \
+    ("otherHeroId", np.int8), ("mineNumber", np.int16)])
+
+def gameEvents(columns, tavern_locs):
+    """ Return the events of a game as an array of EVENT_DTYPE, ordered by
+    turn. columns: a mapping from column name to array, such as
+    GameArchive.arrays() or GameArchiveWriter.arrays(). """
+    turns = np.asarray(columns["turn"])
+    if len(turns) < 2:
+        return np.zeros(0, dtype=EVENT_DTYPE)
+    life = np.asarray(columns["hero_life"], dtype=np.int32)
+    gold = np.asarray(columns["hero_gold"], dtype=np.int32)
+    pos = np.asarray(columns["hero_pos"], dtype=np.int32)
+    mine_count = np.asarray(columns["hero_mine_count"], dtype=np.int32)
+    crashed = np.asarray(columns["hero_crashed"], dtype=bool)
+    owners = np.asarray(columns["mine_owner"])
+    hero_count = life.shape[1]
+
+    # Row i of each of these compares row i of the columns with row i+1.
+    consecutive = (turns[1:] == turns[:-1] + 1)[:, np.newaxis]
+    after_turns = turns[1:]
+    mover = (after_turns - 1) % hero_count
+    is_mover = np.arange(hero_count)[np.newaxis, :] == mover[:, np.newaxis]
+    life_gain = life[1:] - life[:-1]
+    steps = np.abs(pos[1:] - pos[:-1]).sum(axis=2)
+
+    # Deaths, as in Game.getFreshlyDeadHeroes. The killer is the hero who
+    # moved, if it ended its move next to where the victim was; heroes that
+    # die walking into a mine have no killer.
+    died = consecutive & ((life_gain > Game.TAVERN_HEALTH) | (steps > 1))
+    mover_pos = pos[1:][np.arange(len(mover)), mover]
+    next_to_mover = np.abs(pos[:-1] - mover_pos[:, np.newaxis, :]).sum(axis=2) == 1
+    killer = np.where(next_to_mover & ~is_mover, mover[:, np.newaxis] + 1, Board.NO_HERO)
+
+    # A tavern visit heals the mover, or costs it TAVERN_COST gold on top of
+    # its mine income when it was already at full health, without it moving.
+    if tavern_locs:
+        taverns = np.array(list(tavern_locs), dtype=np.int32)
+        next_to_tavern = (np.abs(pos[1:, :, np.newaxis, :] - taverns).sum(axis=3) == 1).any(axis=2)
+    else:
+        next_to_tavern = np.zeros(life_gain.shape, dtype=bool)
+    paid = (gold[1:] - gold[:-1]) == mine_count[1:] - Game.TAVERN_COST
+    tavern = consecutive & is_mover & ~died & (steps == 0) & next_to_tavern & ((life_gain > 0) | paid)
+
+    crash = consecutive & crashed[1:] & ~crashed[:-1]
+
+    changed = (owners[1:] != owners[:-1]) & consecutive
+    capture = changed & (owners[1:] != Board.NO_HERO)
+    loss = changed & (owners[:-1] != Board.NO_HERO)
+
+    parts = []
+    for kind, mask, other in ((DEATH, died, killer), (TAVERN, tavern, None), (CRASH, crash, None)):
+        rows, heroes = np.nonzero(mask)
+        part = np.zeros(len(rows), dtype=EVENT_DTYPE)
+        part["turn"] = after_turns[rows]
+        part["kind"] = kind
+        part["heroId"] = heroes + 1
+        if other is not None:
+            part["otherHeroId"] = other[rows, heroes]
+        parts.append(part)
+    for kind, mask, hero, other in ((CAPTURE, capture, owners[1:], owners[:-1]), \
+        (LOSS, loss, owners[:-1], owners[1:])):
+        rows, mines = np.nonzero(mask)
+        part = np.zeros(len(rows), dtype=EVENT_DTYPE)
+        part["turn"] = after_turns[rows]
+        part["kind"] = kind
+        part["heroId"] = hero[rows, mines]
+        part["otherHeroId"] = other[rows, mines]
+        part["mineNumber"] = mines + 1
+        parts.append(part)
+    events = np.concatenate(parts)
+    return events[np.argsort(events["turn"], kind="stable")]
+
+def eventRows(game_id, events):
+    """ Return the rows of the Events table for events of game_id, as
+    (gameId, turn, kind, heroId, otherHeroId, mineNumber) with None for
+    missing values. """
+    return [(game_id, int(turn), KIND_NAMES[kind], int(hero_id), \
+        int(other_hero_id) if other_hero_id != Board.NO_HERO else None, \
+        int(mine_number) if mine_number != 0 else None) \
+        for turn, kind, hero_id, other_hero_id, mine_number in events.tolist()]
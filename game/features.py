@@ -0,0 +1,165 @@
+""" A dense feature matrix of archived games, with one row per turn and
+hero, for analyses too slow to run in SQL over Heroes.heroDistances.
+
+For a game of T turns and H heroes, gameFeatures returns a (T * H,
+len(featureColumns(...))) int32 matrix whose row t * H + h describes hero
+h + 1 at the game's t-th recorded turn:
+
+    turn, hero_id, life, gold, mine_count, crashed
+    nearest_enemy     distance to the nearest other hero
+    nearest_tavern    distance to the nearest tavern
+    nearest_mine      distance to the nearest mine the hero does not own
+    enemies_within_R  number of other heroes at most R away, one column per
+                      radius R
+    died_within_K     1 if the hero dies within the next K turns, one column
+                      per horizon K. Deaths after the last recorded turn are
+                      unknown, so the last K turns of a recording may miss
+                      some.
+
+Distances are path lengths that other heroes do not block, as in the
+Heroes *ObstructedDistances columns, and -1 where there is no path. They
+come from two batched Board.distanceFields searches per game, one from the
+distinct tiles heroes stood on and one from the taverns and each mine, so
+games need their terrain archived.
+
+Usage: python3 features.py <archive directory> <output.npy or .csv>, which
+writes the features of every finished archived game to one file without
+holding more than one game in memory. In a .npy file the first column is
+the index of the row's game in the list of game ids written next to it as
+<output>.json, with the column names; a .csv file starts with a header and
+its first column is the game id. For example, heroes below 20 life with no
+enemy within 3 tiles that die within the next 40 turns are
+
+    m = np.load("features.npy", mmap_mode="r")
+    columns = json.load(open("features.npy.json"))["columns"]
+    m[(m[:, columns.index("life")] < 20) & (m[:, columns.index("enemies_within_3")] == 0) \\
+        & (m[:, columns.index("died_within_40")] == 1)] """
+import argparse
+import json
+import os
+import sys
+
+import numpy as np
+
+from archive import Archive
+from game import Board
+
+def featureColumns(radii=(3,), horizons=(40,)):
+    """ Names of the columns of gameFeatures(game, radii, horizons). """
+    return ["turn", "hero_id", "life", "gold", "mine_count", "crashed", "nearest_enemy", \
+        "nearest_tavern", "nearest_mine"] + ["enemies_within_%d" % r for r in radii] \
+        + ["died_within_%d" % k for k in horizons]
+
+def gameFeatures(game, radii=(3,), horizons=(40,)):
+    """ Return the feature matrix of game, a GameArchive with terrain; see
+    the module docstring. """
+    if game.terrain is None:
+        raise ValueError("Game " + game.gameId + " has no terrain")
+    board = Board.fromTerrain(np.asarray(game.terrain))
+    size = board.size
+    turns = np.asarray(game.turn)
+    pos = np.asarray(game.hero_pos).astype(np.intp)
+    turn_count, hero_count = pos.shape[:2]
+    tiles = pos[:, :, 0] * size + pos[:, :, 1] # (T, H)
+
+    # Distances from every tile a hero stood on, to every tile
+    sources, source_index = np.unique(tiles, return_inverse=True)
+    source_index = source_index.reshape(tiles.shape)
+    fields = board.distanceFields([[divmod(int(tile), size)] for tile in sources]).reshape(len(sources), -1)
+    hero_distances = fields[source_index[:, :, None], tiles[:, None, :]] # (T, H, H)
+    hero_distances[:, np.arange(hero_count), np.arange(hero_count)] = -1
+
+    # Fields from taverns and mines give the distance to them from any tile
+    target_fields = board.distanceFields([game.tavern_locs] + [[loc] for loc in game.mine_locs])
+    target_fields = target_fields.reshape(len(target_fields), -1)
+    tavern_distances = target_fields[0][tiles] # (T, H)
+    mine_distances = target_fields[1:][:, tiles].transpose(1, 2, 0) # (T, H, M)
+    owners = np.asarray(game.mine_owner)
+    owned = owners[:, None, :] == np.arange(1, hero_count + 1)[None, :, None]
+    mine_distances = np.where(owned, -1, mine_distances)
+
+    # Cumulative deaths up to each row, and the last row within each horizon
+    deaths = np.cumsum(np.asarray(game.hero_died), axis=0)
+
+    columns = [np.repeat(turns, hero_count), np.tile(np.arange(1, hero_count + 1), turn_count), \
+        np.asarray(game.hero_life).ravel(), np.asarray(game.hero_gold).ravel(), \
+        np.asarray(game.hero_mine_count).ravel(), np.asarray(game.hero_crashed).ravel(), \
+        _nearest(hero_distances).ravel(), tavern_distances.ravel(), _nearest(mine_distances).ravel()]
+    for r in radii:
+        columns.append(((hero_distances >= 0) & (hero_distances <= r)).sum(axis=2).ravel())
+    for k in horizons:
+        horizon_rows = np.searchsorted(turns, turns + k, side="right") - 1
+        columns.append((deaths[horizon_rows] > deaths).ravel())
+    return np.column_stack(columns).astype(np.int32)
+
+def _nearest(distances):
+    """ Minimum over the last axis of distances, ignoring -1, or -1 if every
+    distance is -1. """
+    if distances.shape[-1] == 0:
+        return np.full(distances.shape[:-1], -1, dtype=np.int64)
+    nearest = np.where(distances >= 0, distances, np.iinfo(np.int64).max).min(axis=-1)
+    return np.where(nearest == np.iinfo(np.int64).max, -1, nearest)
+
+class FeatureWriter:
+    """ Appends the feature matrices of many games to one .npy or .csv
+    file, one game at a time. """
+
+    NPY_HEADER_BYTES = 128 # Enough for any shape, so the header can be rewritten in place
+
+    def __init__(self, path, columns):
+        self.path = path
+        self.columns = columns
+        self.csv = path.endswith(".csv")
+        self.game_ids = []
+        self.rows = 0
+        self.file = open(path, "w" if self.csv else "wb")
+        if self.csv:
+            self.file.write(",".join(["gameId"] + columns) + "\n")
+        else:
+            self._writeNpyHeader()
+
+    def write(self, game_id, matrix):
+        if self.csv:
+            np.savetxt(self.file, matrix, fmt=game_id.replace("%", "%%") + "," + ",".join(["%d"] * len(self.columns)))
+        else:
+            game_column = np.full((len(matrix), 1), len(self.game_ids), dtype=np.int32)
+            self.file.write(np.hstack([game_column, matrix]).astype("<i4").tobytes())
+        self.game_ids.append(game_id)
+        self.rows += len(matrix)
+
+    def close(self):
+        if not self.csv:
+            self.file.seek(0)
+            self._writeNpyHeader()
+            with open(self.path + ".json.tmp", "w") as meta_file:
+                json.dump({"columns": ["game"] + self.columns, "games": self.game_ids}, meta_file)
+            os.replace(self.path + ".json.tmp", self.path + ".json")
+        self.file.close()
+
+    def _writeNpyHeader(self):
+        header = repr({"descr": "<i4", "fortran_order": False, "shape": (self.rows, len(self.columns) + 1)})
+        magic = np.lib.format.magic(1, 0)
+        header_bytes = FeatureWriter.NPY_HEADER_BYTES - len(magic) - 2
+        self.file.write(magic + header_bytes.to_bytes(2, "little") \
+            + header.ljust(header_bytes - 1).encode("latin1") + b"\n")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Write the per-turn, per-hero feature matrix of every archived game.")
+    parser.add_argument("archive_root", help="Archive written by db/ArchiveExporter.py.")
+    parser.add_argument("output", help="File to write, .npy or .csv.")
+    parser.add_argument("--radius", type=int, nargs="+", default=[3], help="Radii of the enemies_within columns.")
+    parser.add_argument("--horizon", type=int, nargs="+", default=[40], help="Turns of the died_within columns.")
+    parser.add_argument("--unfinished", action="store_true", help="Include games not played to the end.")
+    args = parser.parse_args()
+
+    writer = FeatureWriter(args.output, featureColumns(args.radius, args.horizon))
+    skipped = 0
+    for game in Archive(args.archive_root).games(not args.unfinished):
+        if game.terrain is None:
+            skipped += 1
+            continue
+        writer.write(game.gameId, gameFeatures(game, args.radius, args.horizon))
+    writer.close()
+    print("Wrote %d rows of %d games to %s" % (writer.rows, len(writer.game_ids), args.output))
+    if skipped:
+        print("Skipped %d games without terrain" % skipped, file=sys.stderr)
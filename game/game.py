@@ -1,6 +1,5 @@
 from collections import deque
 import numpy as np
-import re
 
 AIM = {"North": (0, -1),
        "East": (1, 0),
@@ -34,6 +33,31 @@ class Game:
     def __init__(self, state, playing_game):
         """ playing_game: The JSON we receive is slightly different if we are
         actively playing a game or if we are observing a game. """
+        self.board = Board(state["game"]["board"])
+        self.mine_locs = set(self.board.locsOfType(Tile.MINE))
+        self.tavern_locs = set(self.board.locsOfType(Tile.TAVERN))
+        self._readState(state, playing_game)
+    
+    def advance(self, state):
+        """ Return the Game for state, a later turn of the same game.
+        
+        Equivalent to Game(state, self.playing_game), but only the tiles that
+        differ from this turn's board are parsed, and the mine and tavern
+        locations are reused unless the static terrain changed. """
+        game = Game.__new__(Game)
+        game.board = self.board.advance(state["game"]["board"])
+        if game.board.passable_mask is self.board.passable_mask:
+            game.mine_locs = self.mine_locs
+            game.tavern_locs = self.tavern_locs
+        else:
+            game.mine_locs = set(game.board.locsOfType(Tile.MINE))
+            game.tavern_locs = set(game.board.locsOfType(Tile.TAVERN))
+        game._readState(state, self.playing_game)
+        return game
+    
+    def _readState(self, state, playing_game):
+        """ Set everything but the board and the mine and tavern locations
+        from state. """
         self.playing_game = playing_game
         self.state = state
         self.gameId = state["game"]["id"]
@@ -41,17 +65,7 @@ class Game:
         self.max_turns = state["game"]["maxTurns"]
         self.hero_turn = self.turn // 4
         self.max_hero_turns = self.max_turns // 4
-        self.board = Board(state["game"]["board"])
         self.heroes = [Hero(state["game"]["heroes"][i]) for i in range(len(state["game"]["heroes"]))]
-        self.mine_locs = set()
-        self.tavern_locs = set()
-        for x in range(len(self.board.tiles)):
-            for y in range(len(self.board.tiles[x])):
-                obj = self.board.tiles[x][y]
-                if obj.type == Tile.MINE:
-                    self.mine_locs.add((x,y))
-                elif obj.type == Tile.TAVERN:
-                    self.tavern_locs.add((x, y))
         self.finished = state["game"]["finished"]
         if self.playing_game:
             self.hero = list(filter(lambda hero : hero.heroId == state["hero"]["id"], self.heroes))[0]
@@ -119,57 +133,123 @@ class Game:
         return freshly_dead_heroes
 
 class Board:
-    def __parseTile(self, string):
-        if string == "  ":
-            return Tile(Tile.AIR)
-        if string == "##":
-            return Tile(Tile.WALL)
-        if string == "[]":
-            return Tile(Tile.TAVERN)
-        match = re.match("\$([-0-9])", string)
-        if match:
-            return Tile(Tile.MINE, match.group(1))
-        match = re.match("\@([0-9])", string)
-        if match:
-            return Tile(Tile.HERO, match.group(1))
-
+    NO_HERO = 0 # Value of Board.owners for tiles without an owning hero
+    
+    # Lookup tables indexed by the byte values of a two-character tile. The
+    # first character determines the tile type, the second the hero id.
+    _TILE_TYPES = np.full(256, -1, dtype=np.int8)
+    _TILE_TYPES[ord(" ")] = Tile.AIR
+    _TILE_TYPES[ord("#")] = Tile.WALL
+    _TILE_TYPES[ord("[")] = Tile.TAVERN
+    _TILE_TYPES[ord("$")] = Tile.MINE
+    _TILE_TYPES[ord("@")] = Tile.HERO
+    _TILE_OWNERS = np.zeros(256, dtype=np.int8)
+    _TILE_OWNERS[ord("1"):ord("9")+1] = np.arange(1, 10)
+    
     def __parseTiles(self, tiles):
-        vector = [tiles[i:i+2] for i in range(0, len(tiles), 2)]
-        matrix = [vector[i:i+self.size] for i in range(0, len(vector), self.size)]
-
-        return np.transpose([[self.__parseTile(x) for x in xs] for xs in matrix]).copy()
+        """ Parse the server's tile string into self.terrain and self.owners.
+        
+        The tile string is row-major (one row per y value), whereas the board
+        is indexed [x][y], so both arrays are transposed. """
+        cells = np.frombuffer(tiles.encode("ascii"), dtype=np.uint8)
+        if len(cells) != self.size * self.size * 2:
+            raise ValueError("Expected " + str(self.size * self.size) + " tiles, got " \
+                + str(len(cells) / 2))
+        cells = cells.reshape(self.size, self.size, 2)
+        terrain = Board._TILE_TYPES[cells[:, :, 0]]
+        if (terrain < 0).any():
+            raise ValueError("Unrecognised tile in board: " + tiles)
+        self.terrain = np.ascontiguousarray(terrain.T)
+        self.owners = np.ascontiguousarray(Board._TILE_OWNERS[cells[:, :, 1]].T)
+        self.passable_mask = Board._passableMask(self.terrain)
+        self.tiles_string = tiles
+    
+    @staticmethod
+    def _passableMask(terrain):
+        return (terrain != Tile.WALL) & (terrain != Tile.TAVERN) & (terrain != Tile.MINE)
 
     def __init__(self, board=None, zeroPos=None):
         """ Must pass board argument unless being called internally to this class 
         
+        The board is stored as two int8 arrays indexed [x][y]: terrain holds
+        the Tile type of each tile and owners holds the id of the hero
+        standing on or owning the tile (Board.NO_HERO if there is none).
+        
         (Unimplemented) If zeroPos != None, then from zeroPos calculate the distance
         each other tile on the board is from zeroPos, factoring in walls and other
         permanently impassable terrain."""
         if board != None:
             self.size = board["size"]
-            self.tiles = self.__parseTiles(board["tiles"])
+            self.__parseTiles(board["tiles"])
             if zeroPos != None:
                 raise NotImplementedError("Not implemented yet")
 
     def __copy__(self):
         newBoard = Board()
         newBoard.size = self.size
-        newBoard.tiles = []
-        for x in range(len(self.tiles)):
-            newBoard.tiles.append([])
-            for y in range(len(self.tiles[x])):
-                newBoard.tiles[x].append(Tile(self.tiles[x][y].type, self.tiles[x][y].heroId))
+        newBoard.terrain = self.terrain.copy()
+        newBoard.owners = self.owners.copy()
+        newBoard.passable_mask = self.passable_mask
+        newBoard.tiles_string = self.tiles_string
+        return newBoard
+
+    @staticmethod
+    def fromTerrain(terrain):
+        """ Return a Board with the given (size, size) terrain array and no
+        owners, such as a static terrain from DistanceCache.staticTerrain. """
+        newBoard = Board()
+        newBoard.size = terrain.shape[0]
+        newBoard.terrain = terrain
+        newBoard.owners = np.zeros_like(terrain)
+        newBoard.passable_mask = Board._passableMask(terrain)
+        newBoard.tiles_string = None
         return newBoard
 
+    def advance(self, board):
+        """ Return a new Board for board, a later state of this board, by
+        copying this one and patching only the tiles whose characters differ
+        in the tile string. The new Board shares this one's passable_mask
+        unless a wall, tavern or mine changed. """
+        tiles = board["tiles"]
+        if board["size"] != self.size or self.tiles_string is None \
+            or len(tiles) != len(self.tiles_string):
+            return Board(board)
+        old_cells = np.frombuffer(self.tiles_string.encode("ascii"), dtype=np.uint8).reshape(-1, 2)
+        new_cells = np.frombuffer(tiles.encode("ascii"), dtype=np.uint8).reshape(-1, 2)
+        changed = np.nonzero((old_cells != new_cells).any(axis=1))[0]
+        
+        newBoard = self.__copy__()
+        newBoard.tiles_string = tiles
+        if len(changed) == 0:
+            return newBoard
+        types = Board._TILE_TYPES[new_cells[changed, 0]]
+        if (types < 0).any():
+            raise ValueError("Unrecognised tile in board: " + tiles)
+        # The tile string is row-major, one row per y value
+        y, x = np.divmod(changed, self.size)
+        old_types = newBoard.terrain[x, y]
+        newBoard.terrain[x, y] = types
+        newBoard.owners[x, y] = Board._TILE_OWNERS[new_cells[changed, 1]]
+        moved = (old_types == Tile.HERO) | (old_types == Tile.AIR)
+        if not ((old_types == types) | (moved & ((types == Tile.HERO) | (types == Tile.AIR)))).all():
+            newBoard.passable_mask = Board._passableMask(newBoard.terrain)
+        return newBoard
+
+    def locsOfType(self, tile_type):
+        """ Return a list of (x, y) locations of all tiles of tile_type, in
+        x-major order. """
+        return [(int(x), int(y)) for x, y in np.argwhere(self.terrain == tile_type)]
+
     def tile(self, loc):
-        return self.tiles[loc[0]][loc[1]]
+        x, y = loc
+        owner = int(self.owners[x, y])
+        return Tile(int(self.terrain[x, y]), owner if owner != Board.NO_HERO else None)
 
     def passable(self, loc):
         """ True if hero can walk to loc, ignoring if a hero is currently
         there, """
         x, y = loc
-        pos = self.tiles[x][y]
-        return (pos.type != Tile.WALL) and (pos.type != Tile.TAVERN) and (pos.type != Tile.MINE)
+        return bool(self.passable_mask[x, y])
     
     def bfs(self, loc, path_through_heroes, fill_value=float("inf")):
         """ Return a 2d array of the board, with each element being an int 
@@ -199,19 +279,67 @@ class Board:
                     continue
                 distance_map[next_loc[0]][next_loc[1]] = cur_loc_cost + 1
                 seen.add(next_loc)
-                if self.passable(next_loc) \
-                    and (path_through_heroes or self.tile(next_loc).type != Tile.HERO):
+                if self.passable_mask[next_loc] \
+                    and (path_through_heroes or self.terrain[next_loc] != Tile.HERO):
                     queue.append(next_loc)
         
         return distance_map
-    
+
+    def distanceFields(self, sources, path_through_heroes=True, fill_value=-1):
+        """ Breadth-first search from many sources at once, expanding every
+        frontier with array operations over the passable mask.
+
+        sources: a list of groups of locations. Returns a (len(sources),
+        size, size) int64 array whose [i][x][y] is the distance from tile
+        (x, y) to the nearest location of group i, or fill_value if none is
+        reachable. For example [[hero.pos] for hero in game.heroes] gives the
+        distance field of each hero, and [game.tavern_locs, game.mine_locs]
+        the nearest-tavern and nearest-mine fields, in a single search.
+
+        The rules are those of bfs(): every tile next to a reached passable
+        tile (or a source) receives a distance, and with path_through_heroes
+        false, paths may not pass through tiles heroes stand on. """
+        size = self.size
+        # Tiles are laid out row by row with a border of one unexpandable
+        # tile, so that the four neighbours of tile i are i - 1, i + 1,
+        # i - width and i + width, and every step is four slices.
+        width = size + 2
+        expandable = np.zeros((width, width), dtype=bool)
+        expandable[1:-1, 1:-1] = self.passable_mask
+        if not path_through_heroes:
+            expandable[1:-1, 1:-1] &= self.terrain != Tile.HERO
+        expandable = expandable.ravel()
+        distances = np.full((len(sources), width * width), -1, dtype=np.int64)
+        frontier = np.zeros((len(sources), width * width), dtype=bool)
+        for index, locs in enumerate(sources):
+            for x, y in locs:
+                frontier[index, (x + 1) * width + y + 1] = True
+        distances[frontier] = 0
+        reached = frontier.copy()
+        neighbours = np.empty_like(frontier)
+        distance = 0
+        while frontier.any():
+            distance += 1
+            neighbours[:, :1] = False
+            neighbours[:, 1:] = frontier[:, :-1]
+            neighbours[:, :-1] |= frontier[:, 1:]
+            neighbours[:, width:] |= frontier[:, :-width]
+            neighbours[:, :-width] |= frontier[:, width:]
+            neighbours &= ~reached
+            np.copyto(distances, distance, where=neighbours)
+            reached |= neighbours
+            np.logical_and(neighbours, expandable, out=frontier)
+        distances = distances.reshape(len(sources), width, width)[:, 1:-1, 1:-1]
+        if fill_value != -1:
+            distances = np.where(distances >= 0, distances, fill_value)
+        return np.ascontiguousarray(distances)
+
     def heroIdsInRange(self, loc, r):
         """Return list of heroes within r of pos, unsorted."""
         hero_ids_in_range = []
-        for x in range(len(self.tiles)):
-            for y in range(len(self.tiles[x])):
-                if self.tiles[x][y].type == Tile.HERO and Board.l1Distance(loc, (x,y)) <= r:
-                    hero_ids_in_range.append(self.tiles[x][y].heroId)
+        for x, y in np.argwhere(self.terrain == Tile.HERO):
+            if Board.l1Distance(loc, (x,y)) <= r:
+                hero_ids_in_range.append(int(self.owners[x, y]))
         return hero_ids_in_range
 
     def to(self, loc, direction, stay_on_impassable=False):
@@ -229,9 +357,7 @@ class Board:
         if (n_y < 0): n_y = 0
         if (n_y >= self.size): n_y = self.size - 1
         if stay_on_impassable:
-            tile = self.tile((n_x, n_y))
-            if tile.type == Tile.WALL or tile.type == Tile.TAVERN \
-                or tile.type == Tile.MINE or tile.type == Tile.HERO:
+            if not self.passable_mask[n_x, n_y] or self.terrain[n_x, n_y] == Tile.HERO:
                 return loc
 
         return (n_x, n_y)
@@ -240,8 +366,11 @@ class Board:
         """This is only necessary when simulating a game. After sending a move
         command to the server, you do not need to call this, as the server
         will send back a new game state anyway."""
-        self.tiles[oldPos[0]][oldPos[1]] = Tile(Tile.AIR)
-        self.tiles[hero.pos[0]][hero.pos[1]] = Tile(Tile.HERO, hero.heroId)
+        self.tiles_string = None # No longer matches the arrays
+        self.terrain[oldPos[0], oldPos[1]] = Tile.AIR
+        self.owners[oldPos[0], oldPos[1]] = Board.NO_HERO
+        self.terrain[hero.pos[0], hero.pos[1]] = Tile.HERO
+        self.owners[hero.pos[0], hero.pos[1]] = hero.heroId
 
     def meaningfulDirection(self, loc, direction):
         """Returns true if issuing the direction command from loc
@@ -262,8 +391,8 @@ class Board:
         n_x, n_y = x + d_x, y + d_y
         if n_x < 0 or n_y < 0 or n_x >= self.size or n_y >= self.size:
             return False
-        terrain = self.tile((n_x, n_y))
-        if terrain.type == Tile.WALL or terrain.type == Tile.HERO:
+        terrain = self.terrain[n_x, n_y]
+        if terrain == Tile.WALL or terrain == Tile.HERO:
             return False
         return True
 
@@ -298,6 +427,152 @@ class Board:
         return AIM_INVERSE[(x_dir, y_dir)] # Exception if next_loc not adjacent to previous_loc
     
 
+class DistanceCache:
+    """ Distances between tiles of one map, shared by every turn of a game.
+    
+    Walls, taverns and mines never move during a game, so a distance that
+    ignores heroes (an unobstructed distance) only depends on the two tiles
+    involved. Those distance maps are computed once per source tile and
+    memoised, along with the number of shortest paths to each tile. A
+    distance that treats other heroes as obstacles (an obstructed distance) is
+    only computed with a fresh breadth-first search when the other heroes
+    could lie on every shortest path; otherwise it equals the unobstructed
+    distance.
+    
+    Distances follow the same rules as Board.bfs: a target tile always
+    receives a distance, but paths only continue through passable tiles. """
+    
+    def __init__(self, board):
+        self.size = board.size
+        self.static_terrain = DistanceCache.staticTerrain(board)
+        self.passable_mask = board.passable_mask.copy()
+        self._fields = {}
+        self._path_counts = {}
+        size = self.size
+        self._expandable = self.passable_mask.ravel().tolist()
+        self._neighbours = []
+        for x in range(size):
+            for y in range(size):
+                neighbours = []
+                for d_x, d_y in ((0, -1), (1, 0), (0, 1), (-1, 0)):
+                    n_x, n_y = x + d_x, y + d_y
+                    if 0 <= n_x < size and 0 <= n_y < size:
+                        neighbours.append(n_x * size + n_y)
+                self._neighbours.append(neighbours)
+    
+    @staticmethod
+    def staticTerrain(board):
+        """ Return board.terrain with heroes replaced by air. """
+        return np.where(board.terrain == Tile.HERO, np.int8(Tile.AIR), board.terrain)
+    
+    def matches(self, board):
+        """ True if board has the same walls, taverns and mines as the board
+        this cache was built from. """
+        return board.size == self.size \
+            and np.array_equal(DistanceCache.staticTerrain(board), self.static_terrain)
+    
+    def field(self, loc):
+        """ Return the unobstructed distance from loc to every tile as a
+        (size, size) int64 array, with -1 for unreachable tiles. Callers must
+        not modify the result. """
+        field = self._fields.get(loc)
+        if field is None:
+            field, path_counts = self._bfs(loc, (), True)
+            field.setflags(write=False)
+            path_counts.setflags(write=False)
+            self._fields[loc] = field
+            self._path_counts[loc] = path_counts
+        return field
+    
+    def pathCounts(self, loc):
+        """ Return the number of shortest unobstructed paths from loc to every
+        tile as a float64 array (counts can exceed the range of int64). """
+        self.field(loc)
+        return self._path_counts[loc]
+    
+    def obstructedField(self, loc, hero_locs):
+        """ Like field(), but paths may not pass through any of hero_locs
+        (other than loc itself). Never memoised. """
+        return self._bfs(loc, [x * self.size + y for x, y in hero_locs if (x, y) != loc], False)
+    
+    def _bfs(self, loc, blocked, count_paths):
+        size = self.size
+        distances = [-1] * (size * size)
+        counts = [0] * (size * size)
+        start = loc[0] * size + loc[1]
+        distances[start] = 0
+        counts[start] = 1
+        expandable = self._expandable
+        if blocked:
+            expandable = list(expandable)
+            for index in blocked:
+                expandable[index] = False
+        neighbours = self._neighbours
+        queue = deque([start])
+        while queue:
+            current = queue.popleft()
+            next_distance = distances[current] + 1
+            for index in neighbours[current]:
+                if distances[index] == -1:
+                    distances[index] = next_distance
+                    counts[index] = counts[current]
+                    if expandable[index]:
+                        queue.append(index)
+                elif count_paths and distances[index] == next_distance:
+                    counts[index] += counts[current]
+        distances = np.array(distances, dtype=np.int64).reshape(size, size)
+        if count_paths:
+            return distances, np.array(counts, dtype=np.float64).reshape(size, size)
+        return distances
+    
+    def heroDistances(self, game, fill_value=float("inf")):
+        """ Return, for each hero of game in order, a tuple of six lists:
+        the unobstructed and obstructed distances from that hero to each hero,
+        to each tavern (in game.tavern_locs order) and to each mine (in
+        game.mine_locs order). Unreachable targets get fill_value. """
+        hero_locs = [hero.pos for hero in game.heroes]
+        targets = hero_locs + list(game.tavern_locs) + list(game.mine_locs)
+        target_x = np.array([x for x, y in targets], dtype=np.intp)
+        target_y = np.array([y for x, y in targets], dtype=np.intp)
+        hero_count, tavern_count = len(hero_locs), len(game.tavern_locs)
+        # Distances and shortest path counts from each hero to each target,
+        # which by symmetry are also those from each target to each hero.
+        hero_to_target = np.array([self.field(loc)[target_x, target_y] for loc in hero_locs])
+        paths_to_target = np.array([self.pathCounts(loc)[target_x, target_y] for loc in hero_locs])
+        target_indices = np.arange(len(targets))
+        
+        result = []
+        for i, loc in enumerate(hero_locs):
+            distances = hero_to_target[i]
+            # Count the shortest paths that pass through another hero. If
+            # there are fewer of them than shortest paths overall, some
+            # shortest path avoids every hero. The margin keeps floating point
+            # error on the safe side.
+            paths_through_heroes = np.zeros(len(targets))
+            for j in range(hero_count):
+                if i == j or distances[j] < 0:
+                    continue
+                on_shortest_path = (hero_to_target[j] >= 0) \
+                    & (distances[j] + hero_to_target[j] == distances) \
+                    & (target_indices != j)
+                paths_through_heroes += np.where(on_shortest_path, \
+                    paths_to_target[i][j] * paths_to_target[j], 0)
+            if ((paths_through_heroes > 0) \
+                & (paths_through_heroes >= paths_to_target[i] * (1 - 1e-9))).any():
+                obstructed = self.obstructedField(loc, hero_locs)[target_x, target_y]
+            else:
+                obstructed = distances
+            result.append(tuple(DistanceCache._toList(values, fill_value) \
+                for values in (distances[:hero_count], obstructed[:hero_count], \
+                distances[hero_count:hero_count+tavern_count], \
+                obstructed[hero_count:hero_count+tavern_count], \
+                distances[hero_count+tavern_count:], obstructed[hero_count+tavern_count:])))
+        return result
+    
+    @staticmethod
+    def _toList(values, fill_value):
+        return [fill_value if value < 0 else value for value in values.tolist()]
+
 class Hero:
     def __init__(self, hero):
         self.name = hero["name"]
@@ -0,0 +1,268 @@
+""" A forward simulator of Vindinium games, for rollouts and search.
+
+A Simulator holds the state that changes during a game (hero positions,
+life, gold, crashes and mine owners) in a few small lists, and shares
+everything that does not (the static terrain, spawn points and neighbour
+tables) between all its snapshots. copy() therefore only copies those
+lists, and a rollout can take a snapshot at every step.
+
+Each step() plays the move of the hero whose turn it is, as the server
+does:
+
+1. The hero walks to the next tile if it is free air. Walking into a
+   tavern buys a beer (Game.TAVERN_COST gold for Game.TAVERN_HEALTH life, up
+   to Game.HERO_MAX_HEALTH) if the hero can afford it. Walking into a mine
+   it does not own costs Game.MINE_COST life and captures the mine, unless
+   the hero dies trying.
+2. The hero attacks every adjacent hero for Game.HERO_ATTACK_POWER life.
+   Heroes killed lose their mines to it.
+3. The hero loses one life (never below one) and earns one gold per mine.
+
+Dead heroes respawn at their spawn point with full life, killing any hero
+standing there and taking its mines. A hero that dies fighting a mine loses
+its mines to nobody, and its move ends after respawning and step 3.
+
+Tiles are numbered x * size + y, positions are (x, y) as in Hero.pos, and
+hero i of the lists is hero id i + 1.
+
+Usage: python3 simulator.py <log files>, which replays recorded games (plain
+or gzipped logs of turn strings, as Backfill.py reads) and compares every
+simulated turn with the next recorded one. """
+import gzip
+import json
+import random
+import sys
+
+import numpy as np
+
+from game import AIM, Board, Game, Tile
+
+DIRECTIONS = tuple(AIM)
+
+class Simulator:
+    def __init__(self, game):
+        """ Start from a Game (usually its first turn). """
+        board = game.board
+        size = board.size
+        self.size = size
+        self.max_turns = game.max_turns
+        terrain = board.terrain.ravel().tolist()
+        self.terrain = [Tile.AIR if tile == Tile.HERO else tile for tile in terrain]
+        self.mine_locs = sorted(game.mine_locs)
+        self.mine_index = {x * size + y: index for index, (x, y) in enumerate(self.mine_locs)}
+        self.spawns = [hero.spawn_pos[0] * size + hero.spawn_pos[1] for hero in game.heroes]
+        # moves[direction][tile]: the tile a step in that direction leads to,
+        # or None off the board
+        self.moves = {}
+        for direction, (d_x, d_y) in AIM.items():
+            self.moves[direction] = [(x + d_x) * size + y + d_y \
+                if 0 <= x + d_x < size and 0 <= y + d_y < size else None \
+                for x in range(size) for y in range(size)]
+        self.neighbours = [frozenset(self.moves[direction][tile] for direction in DIRECTIONS[:4]) - {None} \
+            for tile in range(size * size)]
+
+        self.turn = game.turn
+        self.positions = [hero.pos[0] * size + hero.pos[1] for hero in game.heroes]
+        self.life = [hero.health for hero in game.heroes]
+        self.gold = [hero.gold for hero in game.heroes]
+        self.crashed = [hero.crashed for hero in game.heroes]
+        owners = board.owners
+        self.mine_owners = [int(owners[x, y]) for x, y in self.mine_locs]
+        self.mine_counts = [self.mine_owners.count(hero_id) for hero_id in range(1, len(game.heroes) + 1)]
+
+    def copy(self):
+        """ Return an independent snapshot of the current state. """
+        snapshot = Simulator.__new__(Simulator)
+        snapshot.__dict__.update(self.__dict__)
+        snapshot.positions = self.positions[:]
+        snapshot.life = self.life[:]
+        snapshot.gold = self.gold[:]
+        snapshot.crashed = self.crashed[:]
+        snapshot.mine_owners = self.mine_owners[:]
+        snapshot.mine_counts = self.mine_counts[:]
+        return snapshot
+
+    @property
+    def finished(self):
+        return self.turn >= self.max_turns
+
+    def heroToMove(self):
+        """ Index of the hero whose move the next step() plays. """
+        return self.turn % len(self.positions)
+
+    def step(self, direction):
+        """ Play direction (one of AIM) for the hero to move. Crashed heroes
+        always stay. """
+        hero = self.turn % len(self.positions)
+        if self.crashed[hero]:
+            direction = "Stay"
+        target = self.moves[direction][self.positions[hero]]
+        alive = True
+        if target is not None:
+            tile = self.terrain[target]
+            if tile == Tile.AIR:
+                if target not in self.positions:
+                    self.positions[hero] = target
+            elif tile == Tile.TAVERN:
+                if self.gold[hero] >= Game.TAVERN_COST:
+                    self.gold[hero] -= Game.TAVERN_COST
+                    self.life[hero] = min(Game.HERO_MAX_HEALTH, self.life[hero] + Game.TAVERN_HEALTH)
+            elif tile == Tile.MINE:
+                mine = self.mine_index[target]
+                if self.mine_owners[mine] != hero + 1:
+                    self.life[hero] -= Game.MINE_COST
+                    if self.life[hero] > 0:
+                        self._transferMine(mine, hero + 1)
+                    else:
+                        alive = False
+                        self._die(hero, Board.NO_HERO)
+        if alive:
+            neighbours = self.neighbours[self.positions[hero]]
+            for enemy, position in enumerate(self.positions):
+                if enemy != hero and position in neighbours:
+                    self.life[enemy] -= Game.HERO_ATTACK_POWER
+                    if self.life[enemy] <= 0:
+                        self._die(enemy, hero + 1)
+        self.life[hero] = max(1, self.life[hero] - 1)
+        self.gold[hero] += self.mine_counts[hero]
+        self.turn += 1
+
+    def rollout(self, policy, turns=None):
+        """ Step with the directions policy(simulator) returns, for turns
+        steps or until the game ends. Returns self. """
+        end = self.max_turns if turns is None else min(self.max_turns, self.turn + turns)
+        while self.turn < end:
+            self.step(policy(self))
+        return self
+
+    def heroPositions(self):
+        """ Hero positions as (x, y) tuples, like Hero.pos. """
+        return [divmod(position, self.size) for position in self.positions]
+
+    def _transferMine(self, mine, new_owner):
+        old_owner = self.mine_owners[mine]
+        if old_owner != Board.NO_HERO:
+            self.mine_counts[old_owner - 1] -= 1
+        if new_owner != Board.NO_HERO:
+            self.mine_counts[new_owner - 1] += 1
+        self.mine_owners[mine] = new_owner
+
+    def _transferMines(self, from_owner, to_owner):
+        for mine, owner in enumerate(self.mine_owners):
+            if owner == from_owner:
+                self._transferMine(mine, to_owner)
+
+    def _die(self, hero, killer):
+        """ Give hero's mines to killer (a hero id or Board.NO_HERO) and
+        respawn it. """
+        self._transferMines(hero + 1, killer)
+        spawn = self.spawns[hero]
+        self.positions[hero] = spawn
+        self.life[hero] = Game.HERO_MAX_HEALTH
+        for other, position in enumerate(self.positions):
+            if other != hero and position == spawn:
+                self._die(other, hero + 1)
+
+def randomPolicy(rng=random):
+    """ Return a policy choosing a direction uniformly at random. """
+    return lambda simulator: rng.choice(DIRECTIONS)
+
+def greedyPolicy(simulator, rng=random, low_life=30, randomness=0.25):
+    """ Return a policy for the map of simulator that walks each hero towards
+    the nearest mine it does not own, or to the nearest tavern when its life
+    is at most low_life and it can pay, along unobstructed shortest paths.
+    A fraction randomness of the moves is random instead. """
+    size = simulator.size
+    board = Board.fromTerrain(np.array(simulator.terrain, dtype=np.int8).reshape(size, size))
+    # Distances from each mine and from the nearest tavern, by tile;
+    # unreachable tiles count as further than any reachable one.
+    fields = board.distanceFields([[loc] for loc in simulator.mine_locs] + [board.locsOfType(Tile.TAVERN)])
+    fields = fields.reshape(len(fields), size * size)
+    fields[fields < 0] = size * size
+    tavern = len(simulator.mine_locs)
+    moves = [(direction, simulator.moves[direction]) for direction in DIRECTIONS[:4]]
+
+    def policy(simulator):
+        if rng.random() < randomness:
+            return rng.choice(DIRECTIONS)
+        hero = simulator.heroToMove()
+        if simulator.life[hero] <= low_life and simulator.gold[hero] >= Game.TAVERN_COST:
+            targets = [tavern]
+        else:
+            targets = [mine for mine, owner in enumerate(simulator.mine_owners) if owner != hero + 1] or [tavern]
+        position = simulator.positions[hero]
+        tiles = [(direction, tiles[position]) for direction, tiles in moves if tiles[position] is not None]
+        distances = fields[np.ix_(targets, [tile for direction, tile in tiles])].min(axis=0)
+        return tiles[int(distances.argmin())][0]
+    return policy
+
+def compare(simulator, game):
+    """ Return the names of the fields of the simulated state that differ
+    from those of game, a recorded turn. """
+    differences = []
+    if simulator.turn != game.turn:
+        differences.append("turn")
+    if simulator.heroPositions() != [hero.pos for hero in game.heroes]:
+        differences.append("pos")
+    if simulator.life != [hero.health for hero in game.heroes]:
+        differences.append("life")
+    if simulator.gold != [hero.gold for hero in game.heroes]:
+        differences.append("gold")
+    if simulator.mine_counts != [hero.mine_count for hero in game.heroes]:
+        differences.append("mineCount")
+    if simulator.mine_owners != [int(game.board.owners[x, y]) for x, y in simulator.mine_locs]:
+        differences.append("mineOwner")
+    return differences
+
+def recordedGames(paths):
+    """ Yield the turns of each game of the logs at paths as a list of
+    Games, split wherever the game id changes. """
+    for path in paths:
+        opener = gzip.open if path.endswith(".gz") else open
+        turns = []
+        with opener(path, "rt") as log:
+            for line in log:
+                line = line.strip()
+                if line.startswith("data:"):
+                    line = line[5:].lstrip(" ")
+                if not line:
+                    continue
+                game = Game({"game": json.loads(line)}, False)
+                if turns and game.gameId != turns[-1].gameId:
+                    yield turns
+                    turns = []
+                turns.append(game)
+        if turns:
+            yield turns
+
+def validate(games):
+    """ Replay each recorded game, stepping with the direction each mover
+    recorded, and compare every simulated turn with the next recorded one.
+    A mismatch restarts the simulation from the recorded turn. Returns
+    (turns compared, {field: mismatches}). """
+    compared = 0
+    mismatches = {}
+    for turns in games:
+        simulator = Simulator(turns[0])
+        for previous, game in zip(turns, turns[1:]):
+            if game.turn != previous.turn + 1:
+                simulator = Simulator(game)
+                continue
+            mover = game.heroes[simulator.heroToMove()]
+            simulator.step(mover.last_direction if mover.last_direction in AIM else "Stay")
+            # Crashes are decided by the server, not by the rules
+            simulator.crashed = [hero.crashed for hero in game.heroes]
+            compared += 1
+            differences = compare(simulator, game)
+            for field in differences:
+                mismatches[field] = mismatches.get(field, 0) + 1
+            if differences:
+                simulator = Simulator(game)
+    return compared, mismatches
+
+if __name__ == "__main__":
+    compared, mismatches = validate(recordedGames(sys.argv[1:]))
+    print("Compared %d turns" % compared)
+    for field, count in sorted(mismatches.items()):
+        print("%-10s %d mismatches (%.2f%%)" % (field, count, 100.0 * count / max(1, compared)))
+    sys.exit(1 if mismatches else 0)
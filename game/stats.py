@@ -0,0 +1,40 @@
+""" Per-hero summaries of one finished game, computed from its columns (as
+stored by archive.py) and its events (as found by events.py). Every value
+is a sum, so summaries of many games can be added together and divided by
+the number of games or deaths afterwards. """
+import numpy as np
+
+import events as _events
+
+GOLD_CURVE_POINTS = 10 # Gold is sampled at 10%, 20%, ..., 100% of the game
+
+def gameStats(columns, events):
+    """ Return a dict from statistic name to an array with one value per
+    hero:
+
+    won: 1 if the hero finished with the most gold (ties all win)
+    deaths, kills, crashes (1 if crashed at the end), minesCaptured
+    gold, mineCount: at the end of the game
+    lifespanTurns: total length of the hero's completed lives, so that
+        lifespanTurns / deaths is its average lifespan
+    goldCurve: (heroes, GOLD_CURVE_POINTS) gold at each tenth of the game """
+    turns = np.asarray(columns["turn"])
+    gold = np.asarray(columns["hero_gold"])
+    hero_count = gold.shape[1]
+    deaths = events[events["kind"] == _events.DEATH]
+    captures = events[events["kind"] == _events.CAPTURE]
+
+    last_death = np.full(hero_count + 1, turns[0], dtype=np.int64)
+    np.maximum.at(last_death, deaths["heroId"], deaths["turn"])
+    curve_turns = turns[0] + (turns[-1] - turns[0]) * np.arange(1, GOLD_CURVE_POINTS + 1) // GOLD_CURVE_POINTS
+    curve_rows = np.minimum(np.searchsorted(turns, curve_turns), len(turns) - 1)
+
+    return {"won": (gold[-1] == gold[-1].max()).astype(np.int64), \
+        "deaths": np.bincount(deaths["heroId"], minlength=hero_count + 1)[1:], \
+        "kills": np.bincount(deaths["otherHeroId"], minlength=hero_count + 1)[1:], \
+        "crashes": np.asarray(columns["hero_crashed"][-1], dtype=np.int64), \
+        "gold": gold[-1].astype(np.int64), \
+        "mineCount": np.asarray(columns["hero_mine_count"][-1], dtype=np.int64), \
+        "lifespanTurns": last_death[1:] - turns[0], \
+        "minesCaptured": np.bincount(captures["heroId"], minlength=hero_count + 1)[1:], \
+        "goldCurve": gold[curve_rows].T.astype(np.int64)}
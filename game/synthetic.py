@@ -0,0 +1,218 @@
+import argparse
+import json
+import random
+import sys
+
+from game import AIM, Board, Game, Tile
+from simulator import Simulator, greedyPolicy
+
+def syntheticBoard(size=18, mine_count=None, seed=0):
+    """ Return a board dict ({"size": ..., "tiles": ...}) in the same format
+    the server sends, along with the spawn positions of the four heroes.
+
+    Like Vindinium's own maps, the board is built from one randomly generated
+    quadrant mirrored horizontally and vertically, so every hero starts in an
+    equivalent position. mine_count is rounded down to a multiple of four and
+    defaults to roughly one mine for every 16 tiles. Tiles that cannot be
+    reached from the heroes' spawn positions are turned into walls.
+
+    The same arguments always produce the same board. """
+    if size % 2 != 0 or size < 6:
+        raise ValueError("Board size must be an even number of at least 6")
+    rng = random.Random(seed)
+    half = size // 2
+    if mine_count is None:
+        mine_count = size * size // 16
+
+    quadrant = [[Tile.AIR for y in range(half)] for x in range(half)]
+    free = [(x, y) for x in range(half) for y in range(half)]
+    rng.shuffle(free)
+    spawn = free.pop()
+    tavern = free.pop()
+    quadrant[tavern[0]][tavern[1]] = Tile.TAVERN
+    for i in range(min(mine_count // 4, len(free))):
+        x, y = free.pop()
+        quadrant[x][y] = Tile.MINE
+    for x, y in free:
+        if rng.random() < 0.2:
+            quadrant[x][y] = Tile.WALL
+
+    terrain = [[None for y in range(size)] for x in range(size)]
+    for x in range(half):
+        for y in range(half):
+            for m_x, m_y in ((x, y), (size-1-x, y), (x, size-1-y), (size-1-x, size-1-y)):
+                terrain[m_x][m_y] = quadrant[x][y]
+    spawns = [spawn, (size-1-spawn[0], spawn[1]), (size-1-spawn[0], size-1-spawn[1]),
+        (spawn[0], size-1-spawn[1])]
+
+    # Flood fill from the spawn points; unreachable air becomes wall and
+    # unreachable mines and taverns (those with no reachable neighbour) too.
+    reachable = set(spawns)
+    stack = list(spawns)
+    while stack:
+        x, y = stack.pop()
+        for n_x, n_y in ((x+1, y), (x-1, y), (x, y+1), (x, y-1)):
+            if 0 <= n_x < size and 0 <= n_y < size and (n_x, n_y) not in reachable:
+                if terrain[n_x][n_y] == Tile.AIR:
+                    reachable.add((n_x, n_y))
+                    stack.append((n_x, n_y))
+    for x in range(size):
+        for y in range(size):
+            if (x, y) in reachable or terrain[x][y] == Tile.WALL:
+                continue
+            neighbours = ((x+1, y), (x-1, y), (x, y+1), (x, y-1))
+            if terrain[x][y] == Tile.AIR or not any(n in reachable for n in neighbours):
+                terrain[x][y] = Tile.WALL
+
+    for hero_id, (x, y) in enumerate(spawns, 1):
+        terrain[x][y] = (Tile.HERO, hero_id)
+    return {"size": size, "tiles": tilesString(terrain)}, spawns
+
+def tilesString(terrain):
+    """ Inverse of Board's tile parsing. terrain is indexed [x][y], and each
+    element is a Tile type, or a (Tile type, hero id) pair for heroes and
+    owned mines. """
+    size = len(terrain)
+    symbols = {Tile.AIR: "  ", Tile.WALL: "##", Tile.TAVERN: "[]", Tile.MINE: "$-"}
+    rows = []
+    for y in range(size):
+        for x in range(size):
+            tile = terrain[x][y]
+            if isinstance(tile, tuple):
+                tile_type, hero_id = tile
+                rows.append(("@" if tile_type == Tile.HERO else "$") + str(hero_id))
+            else:
+                rows.append(symbols[tile])
+    return "".join(rows)
+
+def boardTilesString(board):
+    """ Return the server's tile string for a Board. """
+    terrain = [[None for y in range(board.size)] for x in range(board.size)]
+    for x in range(board.size):
+        for y in range(board.size):
+            tile_type = int(board.terrain[x, y])
+            owner = int(board.owners[x, y])
+            if owner != Board.NO_HERO or tile_type == Tile.HERO:
+                terrain[x][y] = (tile_type, owner)
+            else:
+                terrain[x][y] = tile_type
+    return tilesString(terrain)
+
+def syntheticTurns(size=18, max_turns=1200, mine_count=None, seed=0, game_id=None):
+    """ Yield the turn strings of a synthetic game, one per turn, in the
+    format the server streams from /events/<gameId>.
+
+    Heroes take turns moving in a random direction. Walking into a mine
+    captures it (at the cost of Game.MINE_COST life), walking into a tavern
+    heals, and heroes earn one gold per owned mine per turn. The game is not
+    meant to be a faithful simulation, only to exercise ingestion with
+    plausible data. """
+    rng = random.Random(seed)
+    board_dict, spawns = syntheticBoard(size, mine_count, seed)
+    board = Board(board_dict)
+    if game_id is None:
+        game_id = "".join(rng.choice("abcdefghijklmnopqrstuvwxyz0123456789") for i in range(8))
+    heroes = []
+    for hero_id, spawn in enumerate(spawns, 1):
+        heroes.append({"id": hero_id, "name": "bot" + str(hero_id), \
+            "userId": "user000" + str(hero_id), "elo": 1200 + 10 * hero_id, \
+            "pos": {"x": spawn[1], "y": spawn[0]}, "life": 100, "gold": 0, \
+            "mineCount": 0, "spawnPos": {"x": spawn[1], "y": spawn[0]}, "crashed": False})
+    
+    for turn in range(max_turns + 1):
+        if turn > 0:
+            hero = heroes[(turn - 1) % 4]
+            _randomMove(rng, board, hero, heroes)
+        yield turnString(game_id, turn, max_turns, heroes, board)
+
+def simulatedTurns(size=18, max_turns=1200, mine_count=None, seed=0, game_id=None, crash_rate=0.0002):
+    """ Like syntheticTurns, but the game is played by the rules of
+    Simulator, with fights, deaths, respawns and crashes, by heroes
+    following greedyPolicy. crash_rate is the chance that a hero crashes on
+    each of its moves; crashed heroes stay put for the rest of the game.
+
+    The same arguments always produce the same game. """
+    rng = random.Random(seed)
+    first_turn = next(syntheticTurns(size, max_turns, mine_count, seed, game_id))
+    yield first_turn
+    state = json.loads(first_turn)
+    simulator = Simulator(Game({"game": state}, False))
+    policy = greedyPolicy(simulator, rng)
+    heroes = state["heroes"]
+    static_tiles = [[Tile.AIR if tile == Tile.HERO else tile for tile in simulator.terrain[x * size:(x + 1) * size]] \
+        for x in range(size)]
+    while not simulator.finished:
+        hero = simulator.heroToMove()
+        if not simulator.crashed[hero] and rng.random() < crash_rate:
+            simulator.crashed[hero] = True
+        direction = policy(simulator)
+        simulator.step(direction)
+        heroes[hero]["lastDir"] = "Stay" if simulator.crashed[hero] else direction
+        terrain = [list(column) for column in static_tiles]
+        for (x, y), owner in zip(simulator.mine_locs, simulator.mine_owners):
+            if owner != Board.NO_HERO:
+                terrain[x][y] = (Tile.MINE, owner)
+        for index, ((x, y), hero_state) in enumerate(zip(simulator.heroPositions(), heroes)):
+            terrain[x][y] = (Tile.HERO, index + 1)
+            hero_state["pos"] = {"x": y, "y": x}
+            hero_state["life"] = simulator.life[index]
+            hero_state["gold"] = simulator.gold[index]
+            hero_state["mineCount"] = simulator.mine_counts[index]
+            del hero_state["crashed"] # Keep the boolean last
+            hero_state["crashed"] = simulator.crashed[index]
+        yield json.dumps({"id": state["id"], "turn": simulator.turn, "maxTurns": max_turns, "heroes": heroes, \
+            "board": {"size": size, "tiles": tilesString(terrain)}, "finished": simulator.finished}, \
+            separators=(",", ":"))
+
+def turnString(game_id, turn, max_turns, heroes, board):
+    """ Serialise a turn the way the server does. Booleans are kept as the
+    last key of their objects, as they are in the server's output. """
+    state = {"id": game_id, "turn": turn, "maxTurns": max_turns, "heroes": heroes, \
+        "board": {"size": board.size, "tiles": boardTilesString(board)}, \
+        "finished": turn == max_turns}
+    return json.dumps(state, separators=(",", ":"))
+
+def _randomMove(rng, board, hero, heroes):
+    direction = rng.choice(list(AIM))
+    pos = (hero["pos"]["y"], hero["pos"]["x"])
+    target = board.to(pos, direction)
+    target_type = board.terrain[target]
+    if target_type == Tile.AIR:
+        board.terrain[pos] = Tile.AIR
+        board.owners[pos] = Board.NO_HERO
+        board.terrain[target] = Tile.HERO
+        board.owners[target] = hero["id"]
+        hero["pos"] = {"x": target[1], "y": target[0]}
+    elif target_type == Tile.MINE and board.owners[target] != hero["id"]:
+        previous_owner = int(board.owners[target])
+        if previous_owner != Board.NO_HERO:
+            heroes[previous_owner - 1]["mineCount"] -= 1
+        board.owners[target] = hero["id"]
+        hero["mineCount"] += 1
+        hero["life"] = max(1, hero["life"] - Game.MINE_COST)
+    elif target_type == Tile.TAVERN and hero["gold"] >= Game.TAVERN_COST:
+        hero["gold"] -= Game.TAVERN_COST
+        hero["life"] = min(Game.HERO_MAX_HEALTH, hero["life"] + Game.TAVERN_HEALTH)
+    hero["lastDir"] = direction
+    hero["crashed"] = hero.pop("crashed") # Keep the boolean last
+    hero["gold"] += hero["mineCount"]
+    hero["life"] = max(1, hero["life"] - 1)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Write synthetic games as a log of turn strings, one per line, "
+        "like a recorded event stream.")
+    parser.add_argument("--games", type=int, default=1)
+    parser.add_argument("--size", type=int, default=18, help="Board size (even, at least 6).")
+    parser.add_argument("--mines", type=int, default=None, help="Mine count (default: one per 16 tiles).")
+    parser.add_argument("--turns", type=int, default=1200)
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the first game; each game adds one.")
+    parser.add_argument("--random-walk", action="store_true", \
+        help="Move heroes at random with syntheticTurns instead of simulating the game.")
+    parser.add_argument("--sse", action="store_true", help="Prefix each turn with \"data: \" as the server does.")
+    args = parser.parse_args()
+
+    generate = syntheticTurns if args.random_walk else simulatedTurns
+    prefix = "data: " if args.sse else ""
+    for seed in range(args.seed, args.seed + args.games):
+        for turn_string in generate(args.size, args.turns, args.mines, seed):
+            sys.stdout.write(prefix + turn_string + "\n")